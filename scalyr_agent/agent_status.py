@@ -212,8 +212,28 @@ class LogProcessorStatus(object):
         self.total_lines_copied = 0
         # The total number of log lines that were not sent to the server due to subsampling rules.
         self.total_lines_dropped_by_sampling = 0
+        # The total bytes that were not sent to the server because the log exceeded its rate limit.
+        self.total_bytes_dropped_by_rate_limit = 0
+        # The total number of log lines that were not sent to the server because the log exceeded its rate limit.
+        self.total_lines_dropped_by_rate_limit = 0
+        # The rate at which lines are currently being sampled because the log has fallen behind.
+        self.adaptive_sampling_rate = 1.0
         # The total number of redactions applied to the log lines copied to the server.
         self.total_redactions = 0
+        # The estimated number of seconds spent applying each of the sampling and redaction rules, as a list of tuples
+        # of the kind of rule ('sampling' or 'redaction'), its regular expression and the seconds.
+        self.rule_times = []
+        # The number of lines whose rule results were found, and not found, in the rule cache.
+        self.rule_cache_hits = 0
+        self.rule_cache_misses = 0
+        # Whether or not the rule cache is currently on.  It turns itself off when its hit rate is too low.
+        self.rule_cache_enabled = True
+        # The total number of pages read from the file.
+        self.total_page_reads = 0
+        # The number of bytes currently read from the file at a time.  This grows when the file falls behind.
+        self.current_page_size = 0
+        # The largest number of bytes read from the file at a time.
+        self.largest_page_size = 0
 
 
 class MonitorManagerStatus(object):
@@ -338,9 +358,21 @@ def __report_copying_manager(output, manager_status, agent_log_file_path, read_t
                         output.write('%ld bytes dropped by sampling (%ld lines), ' % (
                             processor_status.total_bytes_dropped_by_sampling,
                             processor_status.total_lines_dropped_by_sampling))
+                    if processor_status.total_bytes_dropped_by_rate_limit > 0:
+                        output.write('%ld bytes dropped by rate limit (%ld lines), ' % (
+                            processor_status.total_bytes_dropped_by_rate_limit,
+                            processor_status.total_lines_dropped_by_rate_limit))
+                    if processor_status.adaptive_sampling_rate < 1.0:
+                        output.write('sampling %.0f%% of lines to catch up, ' % (
+                            processor_status.adaptive_sampling_rate * 100))
 
                     if processor_status.total_redactions > 0:
                         output.write('%ld redactions, ' % processor_status.total_redactions)
+                    __report_rule_times(output, processor_status)
+                    if processor_status.total_page_reads > 0:
+                        output.write('%ld page reads (%ld bytes per page, largest %ld), ' % (
+                            processor_status.total_page_reads, processor_status.current_page_size,
+                            processor_status.largest_page_size))
                     output.write('last checked %s' % scalyr_util.format_time(processor_status.last_scan_time))
                     output.write('\n')
                     output.flush()
@@ -366,14 +398,48 @@ def __report_copying_manager(output, manager_status, agent_log_file_path, read_t
                     output.write('%ld bytes dropped by sampling (%ld lines), ' % (
                         processor_status.total_bytes_dropped_by_sampling,
                         processor_status.total_lines_dropped_by_sampling))
+                if processor_status.total_bytes_dropped_by_rate_limit > 0:
+                    output.write('%ld bytes dropped by rate limit (%ld lines), ' % (
+                        processor_status.total_bytes_dropped_by_rate_limit,
+                        processor_status.total_lines_dropped_by_rate_limit))
+                if processor_status.adaptive_sampling_rate < 1.0:
+                    output.write('sampling %.0f%% of lines to catch up, ' % (
+                        processor_status.adaptive_sampling_rate * 100))
 
                 if processor_status.total_redactions > 0:
                     output.write('%ld redactions, ' % processor_status.total_redactions)
+                __report_rule_times(output, processor_status)
+                if processor_status.total_page_reads > 0:
+                    output.write('%ld page reads (%ld bytes per page, largest %ld), ' % (
+                        processor_status.total_page_reads, processor_status.current_page_size,
+                        processor_status.largest_page_size))
                 output.write('last checked %s' % scalyr_util.format_time(processor_status.last_scan_time))
                 output.write('\n')
                 output.flush()
 
 
+def __report_rule_times(output, processor_status):
+    """Writes the estimated time spent on each of the processor's rules, along with the hit rate of its rule cache.
+
+    @param output: The output stream.
+    @param processor_status: The status of the processor.
+    @type processor_status: LogProcessorStatus
+    """
+    rule_times = []
+    for (kind, match_expression, seconds) in processor_status.rule_times:
+        if seconds > 0:
+            rule_times.append('%s "%s" %.3f secs' % (kind, match_expression, seconds))
+    if len(rule_times) > 0:
+        output.write('rule times (%s), ' % ', '.join(rule_times))
+
+    lookups = processor_status.rule_cache_hits + processor_status.rule_cache_misses
+    if lookups > 0:
+        output.write('rule cache hit rate %.0f%% (%ld lines), ' % (processor_status.rule_cache_hits * 100.0 / lookups,
+                                                                  lookups))
+        if not processor_status.rule_cache_enabled:
+            output.write('rule cache off for low hit rate, ')
+
+
 def __report_monitor_manager(output, manager_status, read_time):
     print >>output, 'Monitors:'
     print >>output, '========='
@@ -321,6 +321,36 @@ class Configuration(object):
         # file is stored in.
         return self.__resolve_absolute_path(config_directory, self.__get_parent_directory(self.__file_path))
 
+    @property
+    def use_inotify(self):
+        """Returns the configuration value for 'use_inotify'."""
+        return self.__get_config().get_bool('use_inotify')
+
+    @property
+    def inotify_resync_interval(self):
+        """Returns the configuration value for 'inotify_resync_interval'."""
+        return self.__get_config().get_float('inotify_resync_interval')
+
+    @property
+    def log_hibernation_threshold(self):
+        """Returns the configuration value for 'log_hibernation_threshold'."""
+        return self.__get_config().get_float('log_hibernation_threshold')
+
+    @property
+    def max_log_hibernation_poll_interval(self):
+        """Returns the configuration value for 'max_log_hibernation_poll_interval'."""
+        return self.__get_config().get_float('max_log_hibernation_poll_interval')
+
+    @property
+    def adaptive_sampling_threshold(self):
+        """Returns the configuration value for 'adaptive_sampling_threshold'."""
+        return self.__get_config().get_int('adaptive_sampling_threshold')
+
+    @property
+    def line_processing_workers(self):
+        """Returns the configuration value for 'line_processing_workers'."""
+        return self.__get_config().get_int('line_processing_workers')
+
     @property
     def max_allowed_request_size(self):
         """Returns the configuration value for 'max_allowed_request_size'."""
@@ -539,6 +569,25 @@ class Configuration(object):
 
         self.__verify_or_set_optional_bool(config, 'use_unsafe_debugging', False, description)
 
+        # Whether or not to use inotify (on Linux) to detect changes to the log paths rather than stat'ing each one
+        # every time it is checked.  Paths are still stat'ed every inotify_resync_interval seconds, and the sizes of
+        # open log files are still checked on each pass.
+        self.__verify_or_set_optional_bool(config, 'use_inotify', False, description)
+        self.__verify_or_set_optional_float(config, 'inotify_resync_interval', 30.0, description)
+
+        # The number of seconds a log file must go without growing before it is closed and only checked for changes
+        # every so often (at most every max_log_hibernation_poll_interval seconds).  If 0, log files stay open.
+        self.__verify_or_set_optional_float(config, 'log_hibernation_threshold', 0.0, description)
+        self.__verify_or_set_optional_float(config, 'max_log_hibernation_poll_interval', 60.0, description)
+
+        # The number of bytes a log file may have waiting to be copied before its lines are sampled so that it can
+        # catch up.  The sampling rate adapts to how fast the lines can be copied.  If 0, lines are not sampled.
+        self.__verify_or_set_optional_int(config, 'adaptive_sampling_threshold', 0, description)
+
+        # The number of worker processes to apply the sampling and redaction rules to the log lines in, so that CPU
+        # heavy rules are not limited to a single core.  If 0, the rules are applied by the log copier thread.
+        self.__verify_or_set_optional_int(config, 'line_processing_workers', 0, description)
+
         self.__verify_or_set_optional_int(config, 'max_allowed_request_size', 1*1024*1024, description)
         self.__verify_or_set_optional_int(config, 'min_allowed_request_size', 100*1024, description)
         self.__verify_or_set_optional_float(config, 'min_request_spacing_interval', 1.0, description)
@@ -621,6 +670,48 @@ class Configuration(object):
 
         self.__verify_or_set_optional_attributes(log_entry, 'attributes', description)
 
+        # Whether or not the log file should be read through memory mappings rather than copied into a buffer.  This
+        # is not safe for logs rotated by truncating them in place (logrotate's copytruncate option), so it is turned
+        # off for a log once it is seen to be truncated.
+        self.__verify_or_set_optional_bool(log_entry, 'use_mmap', False, description)
+
+        # Whether or not gzip compressed files (ending in .gz) should be decompressed when read, including the
+        # compressed copies of rotated log files.  If false, they are copied as is.
+        self.__verify_or_set_optional_bool(log_entry, 'read_compressed', False, description)
+
+        # The regular expression matching the first line of each multi-line event, such as a stack trace.  Lines that
+        # do not match it are joined to the preceding event.  If empty, each line is its own event.
+        self.__verify_or_set_optional_string(log_entry, 'event_start_pattern', '', description)
+        if len(log_entry.get_string('event_start_pattern')) > 0:
+            self.__verify_required_regexp(log_entry, 'event_start_pattern', description)
+        self.__verify_or_set_optional_int(log_entry, 'max_event_size', 32 * 1024, description)
+
+        # The maximum rate, in bytes per second, at which lines are copied from the log file.  Lines in excess of it
+        # are dropped.  The burst size is the number of bytes that may be copied at once, which defaults to one
+        # second's worth.  If the rate is 0, the log file is not rate limited.
+        self.__verify_or_set_optional_float(log_entry, 'rate_limit_bytes_per_second', 0.0, description)
+        self.__verify_or_set_optional_int(log_entry, 'rate_limit_burst_size', 0, description)
+
+        # The number of seconds over which repeats of a line are collapsed into a single event with a repeat count.
+        # If 0, repeated lines are copied as is.
+        self.__verify_or_set_optional_float(log_entry, 'dedup_window', 0.0, description)
+
+        # The number of recently seen lines to cache the results of the sampling and redaction rules for, so they are
+        # not applied again to repeats of the same line.  If 0, the rules are applied to every line.
+        self.__verify_or_set_optional_int(log_entry, 'rule_cache_size', 0, description)
+
+        # The maximum number of lines and bytes to pack into a single event to reduce the per event overhead.  If the
+        # number of lines is 0, each line is sent as its own event.
+        self.__verify_or_set_optional_int(log_entry, 'coalesce_max_lines', 0, description)
+        self.__verify_or_set_optional_int(log_entry, 'coalesce_max_bytes', 32 * 1024, description)
+
+        # Whether or not to send the top-level fields of lines holding JSON objects as event attributes.  If
+        # json_attributes is not empty, only the fields it names are sent.  The json_message_field is used as the
+        # event's message.
+        self.__verify_or_set_optional_bool(log_entry, 'parse_json_lines', False, description)
+        self.__verify_or_set_optional_array(log_entry, 'json_attributes', description)
+        self.__verify_or_set_optional_string(log_entry, 'json_message_field', 'message', description)
+
         # Verify that if it has a sampling_rules array, then it is an array of json objects.
         self.__verify_or_set_optional_array(log_entry, 'sampling_rules', description)
         i = 0
@@ -629,6 +720,14 @@ class Configuration(object):
             element_description += description
             self.__verify_required_regexp(element, 'match_expression', element_description)
             self.__verify_required_percentage(element, 'sampling_rate', element_description)
+            # The number of the group in match_expression holding the key, such as a request id, that decides whether
+            # or not a line is kept, so related lines are kept or dropped together.  If 0, lines are sampled randomly.
+            self.__verify_or_set_optional_int(element, 'sampling_key_group', 0, element_description)
+            key_group = element.get_int('sampling_key_group')
+            if key_group < 0 or key_group > re.compile(element.get_string('match_expression')).groups:
+                raise BadConfiguration('The value for field "sampling_key_group" is not the number of a group in '
+                                       'match_expression.  Error is in %s' % element_description,
+                                       'sampling_key_group', 'notGroup')
             i += 1
 
         # Verify that if it has a redaction_rules array, then it is an array of json objects.
@@ -28,7 +28,9 @@ import scalyr_agent.util as scalyr_util
 
 from scalyr_agent import json_lib
 from scalyr_agent.util import StoppableThread
-from scalyr_agent.log_processing import LogMatcher, LogFileProcessor
+from scalyr_agent import inotify_watcher
+from scalyr_agent.log_processing import LogMatcher, LogFileProcessor, FileSystem, InotifyFileSystem
+from scalyr_agent.log_processing import LineProcessingPool
 from scalyr_agent.agent_status import CopyingManagerStatus
 
 log = scalyr_logging.getLogger(__name__)
@@ -224,6 +226,46 @@ class CopyingManager(StoppableThread):
         # A semaphore that we increment when this object has begun copying files (after first scan).
         self.__copying_semaphore = threading.Semaphore()
 
+        # The file system used by all of the LogFileProcessors.  It is shared so that file change notifications
+        # only need to be processed once per loop.
+        self.__file_system = self.__create_file_system()
+
+        # The pool of worker processes used by all of the LogFileProcessors to apply their sampling and redaction
+        # rules, or None if they apply them on this thread.  It is created when the thread starts running, so that the
+        # worker processes are only forked by the copier that uses them.
+        self.__line_processing_pool = None
+
+    def __create_line_processing_pool(self):
+        """Creates the pool of worker processes to apply the sampling and redaction rules in, if so configured.
+
+        @rtype: LineProcessingPool or None
+        """
+        if self.__config.line_processing_workers <= 0:
+            return None
+        try:
+            return LineProcessingPool(self.__config.line_processing_workers)
+        except (OSError, ImportError), e:
+            log.warn('Could not start the line processing workers, processing lines on the log copier thread: %s',
+                     str(e), error_code='lineProcessingPoolFailure')
+            return None
+
+    def __create_file_system(self):
+        """Creates the FileSystem to use to access the log files, using inotify to detect changes if so configured.
+
+        @rtype: FileSystem
+        """
+        if self.__config.use_inotify:
+            if inotify_watcher.is_supported():
+                try:
+                    return InotifyFileSystem(resync_interval=self.__config.inotify_resync_interval)
+                except OSError, e:
+                    log.warn('Could not initialize inotify, falling back to polling log files: %s', str(e),
+                             error_code='inotifyFailure')
+            else:
+                log.warn('The use_inotify option is not supported on this platform.  Log files will be polled.',
+                         error_code='inotifyNotSupported')
+        return FileSystem()
+
     @staticmethod
     def build_log(log_config):
         """Returns a LogMatcher instance that will handle matching the log specified in the config.
@@ -252,6 +294,9 @@ class CopyingManager(StoppableThread):
         #   - sleep
         # noinspection PyBroadException
         try:
+            # Start the line processing workers before anything else so that no processor is created without them.
+            self.__line_processing_pool = self.__create_line_processing_pool()
+
             # Try to read the checkpoint state from disk.
             current_time = time.time()
             checkpoints_state = self.__read_checkpoint_state()
@@ -289,6 +334,9 @@ class CopyingManager(StoppableThread):
                 current_time = time.time()
                 # noinspection PyBroadException
                 try:
+                    # Learn which log files have changed since the last loop, if the file system supports it.
+                    self.__file_system.process_change_notifications(current_time=current_time)
+
                     # If we have a pending request and it's been too taken too long to send it, just drop it
                     # on the ground and advance.
                     if current_time - last_success > self.__config.max_retry_time:
@@ -366,10 +414,17 @@ class CopyingManager(StoppableThread):
                     self.__lock.release()
 
                 self._run_state.sleep_but_awaken_if_stopped(copying_params.current_sleep_interval)
+
+            self.__file_system.release()
         except Exception:
             # If we got an exception here, it is caused by a bug in the program, so let's just terminate.
             log.exception('Log copying failed due to exception')
             sys.exit(1)
+        finally:
+            # Make sure the worker processes do not outlive the copier, however it stopped.
+            if self.__line_processing_pool is not None:
+                self.__line_processing_pool.close()
+                self.__line_processing_pool = None
 
     def wait_for_copying_to_begin(self):
         """Block the current thread until this instance has finished its first scan and has begun copying.
@@ -610,7 +665,13 @@ class CopyingManager(StoppableThread):
 
         for matcher in self.__log_matchers:
             for new_processor in matcher.find_matches(self.__log_paths_being_processed, checkpoints,
-                                                      copy_at_index_zero=copy_at_index_zero):
+                                                      copy_at_index_zero=copy_at_index_zero,
+                                                      file_system=self.__file_system):
+                new_processor.set_parameters(
+                    hibernation_threshold=self.__config.log_hibernation_threshold,
+                    max_hibernation_poll_interval=self.__config.max_log_hibernation_poll_interval,
+                    adaptive_sampling_threshold=self.__config.adaptive_sampling_threshold)
+                new_processor.set_line_processing_pool(self.__line_processing_pool)
                 self.__log_processors.append(new_processor)
                 self.__log_paths_being_processed[new_processor.log_path] = True
 
@@ -0,0 +1,190 @@
+# Copyright 2014 Scalyr Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------------
+#
+# A thin wrapper around the Linux inotify system calls, implemented using ctypes so that no additional
+# dependencies are required.
+#
+# author: Steven Czerwinski <czerwin@scalyr.com>
+
+__author__ = 'czerwin@scalyr.com'
+
+import errno
+import os
+import struct
+import sys
+
+# The event masks, as defined in sys/inotify.h.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+# The flags for inotify_init1.  These have the same values as O_NONBLOCK and O_CLOEXEC.
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# The fixed portion of the inotify_event struct:  wd, mask, cookie, len.
+_EVENT_HEADER = struct.Struct('iIII')
+
+__libc__ = None
+
+
+def __load_libc():
+    """Loads the C library and declares the inotify functions.
+
+    @return: The library, or None if it, or the inotify functions, are not available.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        library_name = ctypes.util.find_library('c')
+        if library_name is None:
+            return None
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        return libc
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+def is_supported():
+    """
+    @return: True if inotify can be used on this system.
+    @rtype: bool
+    """
+    global __libc__
+    if not sys.platform.startswith('linux'):
+        return False
+    if __libc__ is None:
+        __libc__ = __load_libc()
+    return __libc__ is not None
+
+
+class InotifyWatcher(object):
+    """Watches files and directories for changes using Linux's inotify.
+
+    The underlying file descriptor is non-blocking, so `read_events` only returns the events already queued
+    by the kernel.
+    """
+
+    # The maximum number of bytes to read from the inotify file descriptor in a single read.  This is
+    # large enough for hundreds of events.
+    READ_SIZE = 64 * 1024
+
+    def __init__(self):
+        """Creates a new inotify instance.
+
+        @raise OSError: If inotify is not supported or an instance could not be created, such as when the per user
+            limit on instances has been reached.
+        """
+        if not is_supported():
+            raise OSError(errno.ENOSYS, 'inotify is not supported on this system')
+        self.__fd = __libc__.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            self.__raise_last_error()
+
+    def add_watch(self, path, mask):
+        """Begins watching the file or directory at path for the events in mask.
+
+        If the path is already being watched, its mask is replaced and the same watch descriptor is returned.
+
+        @param path: The path of the file or directory.
+        @param mask: The events to watch for, OR'ed together.
+
+        @type path: str
+        @type mask: int
+
+        @return: The watch descriptor.
+        @rtype: int
+
+        @raise OSError: If the watch could not be added, such as when the path does not exist or the limit on
+            the number of watches has been reached.
+        """
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        result = __libc__.inotify_add_watch(self.__fd, path, mask)
+        if result < 0:
+            self.__raise_last_error(path)
+        return result
+
+    def remove_watch(self, watch_descriptor):
+        """Stops watching the path associated with the watch descriptor.
+
+        Errors are ignored since the kernel automatically removes watches for deleted paths.
+
+        @param watch_descriptor: The descriptor returned by `add_watch`.
+        @type watch_descriptor: int
+        """
+        __libc__.inotify_rm_watch(self.__fd, watch_descriptor)
+
+    def read_events(self):
+        """Reads all events currently queued.
+
+        @return: A list of (watch_descriptor, mask, name) for each event.  The name is only present for events
+            about a file inside a watched directory, otherwise it is None.  If the kernel event queue overflowed,
+            an event with watch descriptor -1 and the IN_Q_OVERFLOW bit set is included.
+        @rtype: list of (int, int, str)
+        """
+        result = []
+        while True:
+            try:
+                data = os.read(self.__fd, InotifyWatcher.READ_SIZE)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.EAGAIN:
+                    return result
+                raise
+
+            if len(data) == 0:
+                return result
+
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                (watch_descriptor, mask, _, name_length) = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = None
+                if name_length > 0:
+                    name = data[offset:offset + name_length].rstrip('\0')
+                    offset += name_length
+                result.append((watch_descriptor, mask, name))
+
+    def close(self):
+        """Releases the inotify instance, along with all of its watches."""
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    @staticmethod
+    def __raise_last_error(path=None):
+        """Raises an OSError for the last error set by a C library call.
+        """
+        import ctypes
+        error_number = ctypes.get_errno()
+        if path is not None:
+            raise OSError(error_number, os.strerror(error_number), path)
+        raise OSError(error_number, os.strerror(error_number))
@@ -26,10 +26,12 @@ The classes exported by this package are:
   JsonConversionException     -- Exception raised when conversion of a field in a JSON object fails.
   JsonMissingFieldException   -- Exception raised when a request field in a JSON object is missing.
   JsonParseException          -- Exception raised when parsing a string as JSON fails.
+  EscapedString               -- A string value already escaped for JSON, which is serialized as is.
 
 The methods exported are:
   parse                       -- Parses a string as JSON and returns the value.
   serialize                   -- Serializes a JSON value to a string.
+  escape_lines                -- Escapes many lines for JSON in a single pass.
 """
 
 __author__ = 'Steven Czerwinski <czerwin@scalyr.com>'
@@ -38,8 +40,8 @@ from scalyr_agent.json_lib.exceptions import JsonConversionException
 from scalyr_agent.json_lib.exceptions import JsonMissingFieldException, JsonParseException
 from scalyr_agent.json_lib.objects import JsonObject, JsonArray
 from scalyr_agent.json_lib.parser import parse
-from scalyr_agent.json_lib.serializer import serialize
+from scalyr_agent.json_lib.serializer import serialize, escape_lines, EscapedString
 
 
-__all__ = ['parse', 'serialize', 'JsonObject', 'JsonArray', 'JsonConversionException', 'JsonMissingFieldException',
-           'JsonParseException']
+__all__ = ['parse', 'serialize', 'escape_lines', 'EscapedString', 'JsonObject', 'JsonArray',
+           'JsonConversionException', 'JsonMissingFieldException', 'JsonParseException']
@@ -61,6 +61,10 @@ def serialize(value, output=None, use_fast_encoding=False):
         output.write('"')
         output.write(__to_escaped_string(value, use_fast_encoding=use_fast_encoding))
         output.write('"')
+    elif value_type is EscapedString:
+        output.write('"')
+        output.write(value.escaped_value)
+        output.write('"')
     elif value_type is dict or value_type is JsonObject:
         output.write('{')
         first = True
@@ -120,6 +124,64 @@ ESCAPE_DCT_OPT.setdefault(chr(127), '\\u007f')
 
 HAS_UTF8 = re.compile(r'[\x80-\xff]')
 
+# The characters that must be escaped other than the common ones (backslash, double quote, newline and tab).  Text
+# without any of these can be escaped using a few calls to str.replace instead of a regular expression substitution.
+ESCAPE_UNCOMMON_OPT = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+
+# The translations used by escape_lines.  Each newline is followed by a raw newline in the escaped text so that it
+# can be split back into lines.  That is unambiguous since no other raw newlines are left after escaping.
+ESCAPE_LINES_DCT_OPT = dict(ESCAPE_DCT_OPT)
+ESCAPE_LINES_DCT_OPT['\n'] = '\\n\n'
+
+
+class EscapedString(object):
+    """A string value that has already been escaped for JSON, such as by ``escape_lines``.
+
+    When serialized, the escaped value is written as is, without escaping it again.
+    """
+    def __init__(self, escaped_value):
+        """
+        @param escaped_value: The escaped string, not including the surrounding double quotes.
+        @type escaped_value: str
+        """
+        self.escaped_value = escaped_value
+
+
+def escape_lines(lines):
+    """Returns the JSON escaped form of each of the lines, using the fast encoding only the Scalyr servers work with.
+
+    The result is the same as escaping each line separately, but when possible, all of the lines are escaped in a
+    single pass over their combined text.  This is much cheaper than escaping many short lines, such as those read
+    from a log file, one at a time.
+
+    Each line may only contain a newline as its last character.  Lines without a trailing newline (other than the last
+    line) and lines with high ascii characters are escaped separately.
+
+    @param lines: The lines to escape.
+    @type lines: list of str
+
+    @return: The escaped lines.
+    @rtype: list of str
+    """
+    chunk = ''.join(lines)
+    if type(chunk) is str and HAS_UTF8.search(chunk) is None:
+        if ESCAPE_UNCOMMON_OPT.search(chunk) is None:
+            escaped = chunk.replace('\\', '\\\\').replace('"', '\\"').replace('\t', '\\t').replace('\n', '\\n\n')
+        else:
+            def replace(match):
+                return ESCAPE_LINES_DCT_OPT[match.group(0)]
+            escaped = ESCAPE_OPT.sub(replace, chunk)
+
+        result = escaped.split('\n')
+        # If the last line ended in a newline, there is nothing after it.
+        if len(result[-1]) == 0:
+            result.pop()
+        # Otherwise, some line did not end in a newline, so the line boundaries were lost.
+        if len(result) == len(lines):
+            return result
+
+    return [__to_escaped_string(line, use_fast_encoding=True) for line in lines]
+
 
 def __to_escaped_string(string_value, use_fast_encoding=False, use_optimization=True):
     """Returns a string that is properly escaped by JSON standards.
@@ -19,7 +19,7 @@ __author__ = 'czerwin@scalyr.com'
 
 import unittest
 
-from scalyr_agent.json_lib import serialize
+from scalyr_agent.json_lib import serialize, escape_lines, EscapedString
 
 
 class SerializeTests(unittest.TestCase):
@@ -60,9 +60,24 @@ class SerializeTests(unittest.TestCase):
         self.assertEquals(self.write([1, 2, 5]), '[1,2,5]')
         self.assertEquals(self.write([]), '[]')
 
+    def test_escaped_string(self):
+        self.assertEquals(self.write({'hi': EscapedString('a\\"b')}), '{"hi":"a\\"b"}')
+
+    def test_escape_lines(self):
+        self.__run_escape_lines_test_case(['Hi there\n', 'He said "hi"\n', 'C:\\temp\tdir\n', 'partial'])
+        self.__run_escape_lines_test_case(['Hi there\n', 'Escaped\5\r\n', 'Escaped\177\b\f\n'])
+        self.__run_escape_lines_test_case(['Escaped\xE2\x82\xAC\n', 'Hi there\n'])
+        self.__run_escape_lines_test_case(['Hi there', 'no newline\n', 'at line end\n'])
+        self.__run_escape_lines_test_case(['\n', '\n'])
+        self.__run_escape_lines_test_case([])
+
     def write(self, value):
         return serialize(value, use_fast_encoding=True)
 
+    def __run_escape_lines_test_case(self, lines):
+        expected = [serialize(line, use_fast_encoding=True)[1:-1] for line in lines]
+        self.assertEquals(escape_lines(lines), expected)
+
     def __run_string_test_case(self, input_string, expected_result):
         self.assertEquals(serialize(input_string, use_fast_encoding=True), expected_result)
         self.assertEquals(serialize(input_string, use_fast_encoding=False), expected_result)
\ No newline at end of file
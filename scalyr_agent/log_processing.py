@@ -27,18 +27,27 @@ __author__ = 'czerwin@scalyr.com'
 
 import errno
 import glob
+import gzip
+import mmap
 import os
 import random
 import re
+import sre_constants
+import sre_parse
+import stat
+import struct
 import threading
 import time
+import zlib
 
+import scalyr_agent.inotify_watcher as inotify_watcher
 import scalyr_agent.json_lib as json_lib
 import scalyr_agent.scalyr_logging as scalyr_logging
 import scalyr_agent.util as scalyr_util
 
 from scalyr_agent.agent_status import LogMatcherStatus
 from scalyr_agent.agent_status import LogProcessorStatus
+from scalyr_agent.scalyr_client import EventTemplate
 
 from cStringIO import StringIO
 from os import listdir
@@ -66,6 +75,11 @@ MAX_LOG_OFFSET_SIZE = 5 * 1024 * 1024
 # always be greater than the MAX_LINE_SIZE
 READ_PAGE_SIZE = 64 * 1024
 
+# The largest number of bytes to read from a file at a time.  When a file has fallen behind, the number of bytes read
+# at a time doubles with each read (starting at READ_PAGE_SIZE) until it reaches this size, and it halves again once
+# the backlog has been worked off.  This cuts down on the number of reads needed to catch up.
+MAX_READ_PAGE_SIZE = 1024 * 1024
+
 # The minimum time we wait for a log file to reappear on a file system after it has been removed before
 # we consider it deleted.
 LOG_DELETION_DELAY = 10 * 60
@@ -74,6 +88,63 @@ LOG_DELETION_DELAY = 10 * 60
 # is exceeded, then we consider those bytes to be stale and just skip to reading from the end to get the freshest bytes.
 COPY_STALENESS_THRESHOLD = 15 * 60
 
+# The default maximum size, in bytes, of an event assembled from multiple lines by LogLineAssembler.  This must be
+# comfortably smaller than the minimum allowed request size, or an event might never fit into a request.
+MAX_EVENT_SIZE = 32 * 1024
+
+# The number of seconds LogFileProcessor waits for more continuation lines for the last multi-line event in a log
+# before sending it as is.  This is the multi-line event equivalent of LINE_COMPLETION_WAIT_TIME.
+EVENT_COMPLETION_WAIT_TIME = 5
+
+# The minimum number of seconds between the entries LogFileIterator records in its index of when the bytes in the log
+# file were written.  See LogFileIterator.advance_to_time.
+GROWTH_INDEX_INTERVAL = 10
+
+# The maximum number of entries kept in the index of when the bytes in the log file were written.  When exceeded, every
+# other entry is discarded, trading accuracy for space.
+MAX_GROWTH_INDEX_ENTRIES = 500
+
+# When a log file has fallen too far behind, we skip ahead so that we are only copying the bytes written in the most
+# recent number of seconds specified here, rather than skipping all the way to the end of the log.
+CATCH_UP_WINDOW = 5 * 60
+
+# If a log file has not grown for this many seconds, its LogFileProcessor hibernates:  it closes the file and frees its
+# buffer, and only checks the file for changes every so often.  If 0, processors never hibernate.
+HIBERNATION_THRESHOLD = 0
+
+# The number of seconds between checks of a hibernating log file for changes starts at MIN_HIBERNATION_POLL_INTERVAL and
+# doubles after every check that finds no change, up to MAX_HIBERNATION_POLL_INTERVAL.
+MIN_HIBERNATION_POLL_INTERVAL = 1
+MAX_HIBERNATION_POLL_INTERVAL = 60
+
+# If a log file has more than this many bytes waiting to be copied, its LogFileProcessor samples its lines to catch up
+# rather than falling so far behind that it has to skip ahead.  The sampling rate is halved every
+# ADAPTIVE_SAMPLING_UPDATE_INTERVAL seconds while the backlog is over the threshold (down to
+# MIN_ADAPTIVE_SAMPLING_RATE), and raised by ADAPTIVE_SAMPLING_RATE_INCREASE while it is under half of it.  If 0, lines
+# are never sampled due to a backlog.
+ADAPTIVE_SAMPLING_THRESHOLD = 0
+ADAPTIVE_SAMPLING_UPDATE_INTERVAL = 5
+MIN_ADAPTIVE_SAMPLING_RATE = 0.01
+ADAPTIVE_SAMPLING_RATE_INCREASE = 0.1
+
+# The sampling and redaction rules are timed on one in this many lines, and the time taken multiplied by this to
+# estimate the total time spent on each rule.  A warning is logged when a rule takes more than SLOW_RULE_THRESHOLD
+# seconds on a single line, since that usually means its regular expression backtracks badly.
+RULE_TIMING_INTERVAL = 100
+SLOW_RULE_THRESHOLD = 0.001
+
+# The maximum number of distinct lines whose repeats are tracked at once for each log file when dedup is enabled.
+# Lines copied while this many are being tracked are not deduplicated until some of them expire.
+MAX_DEDUP_LINES = 1000
+
+# The number of bytes just before the iterator's position that are fingerprinted in its checkpoints.  When restoring
+# from a checkpoint, the fingerprint is used to cheaply verify the file still holds the same content.
+FINGERPRINT_SIZE = 64
+
+# If True, LogFileIterator verifies its buffer bookkeeping after every line it returns.  These checks are too
+# expensive to perform on the hot path in production, so they are only turned on for debugging and testing.
+CHECK_BUFFER_INVARIANTS = False
+
 log = scalyr_logging.getLogger(__name__)
 
 
@@ -92,17 +163,32 @@ class LogFileIterator(object):
     but then return to it by invoking 'seek'.
     """
 
-    def __init__(self, path, file_system=None, checkpoint=None):
+    # Matches what follows the log file's name in the name of a compressed rotation of it, such as `.1.gz`.
+    __ROTATION_SUFFIX = re.compile(r'(?:[.-]\d[\w.-]*)?\.gz$')
+
+    # The number of milliseconds a compressed rotation's modification time may be before the last recorded
+    # modification time of the rotated file, to allow for the granularity of file systems' modification times.
+    __MODIFICATION_TIME_SLACK = 2000
+
+    def __init__(self, path, file_system=None, checkpoint=None, use_mmap=False, read_compressed=False):
         """
 
         @param path: The path of the file to read.
         @param file_system: The object to use to read the file system.  This is used for testing
             purposes.  If None, then will just use the native file system.
         @param checkpoint: The checkpoint object describing where to pick up reading the file.
+        @param use_mmap: If True, the pending files are memory mapped and pages are sliced directly out of the
+            mappings rather than read and copied into a StringIO buffer.  This is ignored on win32, and turned off
+            once the log is seen to be truncated in place, since that is not safe with mappings.
+        @param read_compressed: If True, gzip compressed files (ending in .gz) are decompressed as they are read,
+            and the unread bytes of a rotated log file that was compressed since the checkpoint was written are read
+            from its compressed copy.
 
         @type path: str
         @type file_system: FileSystem
         @type checkpoint: dict
+        @type use_mmap: bool
+        @type read_compressed: bool
         """
         # The full path of the log file.
         self.__path = path
@@ -125,6 +211,11 @@ class LogFileIterator(object):
         # Oh yes, we actually use a StringIO buffer to temporarily buffer the bytes from the files.  We read them in
         # in chunks of 64K and then just pull the strings out of them.  A single buffer holds the contents from
         # different files if needed.
+        #
+        # If use_mmap is True, then we avoid most of that copying.  Each pending file is memory mapped and, as long as
+        # the bytes we need come from a single file, the buffer is just the page sliced out of that mapping
+        # (see LogFileIterator.PageBuffer).  We only fall back to the StringIO buffer when the bytes have to be
+        # stitched together from more than one file, such as right after a log rotation.
 
         # The objects of this list are of type LogFileIterator.FileState.  Each object has two important fields
         # position_start and position_end which specify where the contents of the file falls in terms of mark position.
@@ -140,10 +231,19 @@ class LogFileIterator(object):
         # This is a list of LogFileIterator.BufferEntry which maps which portions of the buffer map to which mark
         # positions.
         self.__buffer_contents_index = None
+        # A sparse index of when the bytes in the log file were written, used to skip ahead to a point in time.  It is
+        # a list of (position, time) tuples, both increasing, where each entry records that the bytes before that
+        # mark position were all written at or before that time.  Entries are added as we notice the log file grow.
+        self.__growth_index = []
 
         # If we are currently not returning a line from the buffer because it is not terminated in a newline, then
         # this records the time when we first decided not return it.  (We wait some amount of time before giving up.)
         self.__partial_line_time = None
+        # The number of bytes in the partial line the last time we decided not to return it.
+        self.__partial_line_bytes = 0
+        # The fingerprint last computed for a checkpoint, along with the file and position it was computed for, so
+        # that we do not have to read the file again if the position has not moved since the last checkpoint.
+        self.__last_fingerprint = None
 
         # If there is no longer a file at the log path, then this marks the time when we first noticed it was gone.
         self.__log_deletion_time = None
@@ -159,9 +259,18 @@ class LogFileIterator(object):
         self.__line_completion_wait_time = LINE_COMPLETION_WAIT_TIME
         self.__log_deletion_delay = LOG_DELETION_DELAY
         self.__page_size = READ_PAGE_SIZE
+        self.__max_page_size = MAX_READ_PAGE_SIZE
+        # The number of bytes that will be read at a time.  This varies between __page_size and __max_page_size
+        # depending on how far behind we are.
+        self.__current_page_size = self.__page_size
+        self.__use_mmap = use_mmap and sys.platform != 'win32'
+        self.__read_compressed = read_compressed
+        self.__check_buffer_invariants = CHECK_BUFFER_INVARIANTS
 
         # Stat just used in testing to verify pages are being read correctly.
         self.page_reads = 0
+        # The largest number of bytes read at a time.  Reported on the status page.
+        self.largest_page_size = self.__page_size
 
         # The file system facade that we direct all I/O calls through
         # so that we can insert testing methods in the future if needed.
@@ -177,6 +286,9 @@ class LogFileIterator(object):
             try:
                 if 'position' in checkpoint:
                     self.__position = checkpoint['position']
+                    if 'growth_index' in checkpoint:
+                        for entry in checkpoint['growth_index']:
+                            self.__growth_index.append((entry[0], entry[1]))
                     for state in checkpoint['pending_files']:
                         if not state['is_log_file'] or self.__file_system.trust_inodes:
                             (file_object, file_size, inode) = self.__open_file_by_inode(os.path.dirname(self.__path),
@@ -184,9 +296,31 @@ class LogFileIterator(object):
                         else:
                             (file_object, file_size, inode) = self.__open_file_by_path(self.__path)
 
+                        if file_object is None and 'path' in state and self.__read_compressed:
+                            # The compressed copy of a rotated log is reopened by its own path, since inodes cannot
+                            # be used to find it on all platforms.
+                            (file_object, file_size, inode) = self.__open_file_by_path(state['path'])
+
+                        if file_object is None and not state['is_log_file'] and self.__read_compressed:
+                            # The rotated file may have been compressed (and the original removed) since the
+                            # checkpoint was written, such as by logrotate's compress option.
+                            (file_object, file_size, inode) = self.__open_compressed_rotation(
+                                state['last_known_size'], state.get('last_modification_time'))
+
                         if file_object is not None:
-                            self.__pending_files.append(LogFileIterator.FileState(state, file_object))
+                            file_state = LogFileIterator.FileState(state, file_object)
+                            if inode is not None:
+                                file_state.inode = inode
+                            if not file_state.is_log_file and self.__file_system.is_compressed(file_object):
+                                file_state.path = file_object.path
+                            self.__pending_files.append(file_state)
+                    if 'fingerprint' in checkpoint:
+                        self.__verify_fingerprint(checkpoint['fingerprint'])
                     self.__refresh_pending_files(time.time())
+                    # Pick up waiting for the partial line where we left off, as long as it is still there.
+                    if 'partial_line_time' in checkpoint and self.available >= checkpoint['partial_line_bytes']:
+                        self.__partial_line_time = checkpoint['partial_line_time']
+                        self.__partial_line_bytes = checkpoint['partial_line_bytes']
                     need_to_close = False
                 else:
                     # Must be a psuedo checkpoint created by the static create_checkpoint method.  This is asking us
@@ -205,7 +339,8 @@ class LogFileIterator(object):
                         self.__close_file(file_state)
                     self.__pending_files = []
 
-    def set_parameters(self, max_line_length=None, page_size=None):
+    def set_parameters(self, max_line_length=None, page_size=None, check_buffer_invariants=None,
+                       max_page_size=None):
         """Sets the various parameters for reading the file.
 
         This is used for testing purposes.
@@ -213,14 +348,28 @@ class LogFileIterator(object):
         @param max_line_length: The maximum allowed line size or None if you do not wish to change the current value.
         @param page_size: How much data is read from the file at a given time. or None if you do not wish to change
             the current value.
+        @param check_buffer_invariants: Whether or not to verify the buffer bookkeeping after every line is read,
+            or None if you do not wish to change the current value.
+        @param max_page_size: The most data that will be read from the file at a given time when catching up, or
+            None if you do not wish to change the current value.  Set it to page_size to disable growing the page.
         @type max_line_length: int or None
         @type page_size: int or None
+        @type check_buffer_invariants: bool or None
+        @type max_page_size: int or None
         """
         if max_line_length is not None:
             self.__max_line_length = max_line_length
 
         if page_size is not None:
             self.__page_size = page_size
+            self.__current_page_size = page_size
+            self.largest_page_size = page_size
+
+        if max_page_size is not None:
+            self.__max_page_size = max_page_size
+
+        if check_buffer_invariants is not None:
+            self.__check_buffer_invariants = check_buffer_invariants
 
     def mark(self, current_time=None):
         """Marks the current location of the file.
@@ -261,6 +410,13 @@ class LogFileIterator(object):
                 buffer_entry.position_start -= self.__position
                 buffer_entry.position_end -= self.__position
 
+        # Entries for positions we have already read past are no longer useful.
+        new_growth_index = []
+        for (position, write_time) in self.__growth_index:
+            if position > self.__position:
+                new_growth_index.append((position - self.__position, write_time))
+        self.__growth_index = new_growth_index
+
         self.__position = 0
 
         self.__pending_files = new_pending_files
@@ -333,13 +489,8 @@ class LogFileIterator(object):
             self.__fill_buffer(current_time)
         original_buffer_index = self.__buffer.tell()
 
-        expected_buffer_index = self.__determine_buffer_index(self.__position)
-        # Just a sanity check.
-        if len(self.__buffer_contents_index) > 0 and self.__position != self.__buffer_contents_index[-1].position_end:
-            if expected_buffer_index != original_buffer_index:
-                assert expected_buffer_index == original_buffer_index, (
-                    'Mismatch between expected index and actual %ld %ld',
-                    expected_buffer_index, original_buffer_index)
+        if self.__check_buffer_invariants:
+            self.__verify_buffer_index(original_buffer_index)
 
         result = self.__buffer.readline(self.__max_line_length)
         if len(result) == 0:
@@ -351,6 +502,7 @@ class LogFileIterator(object):
         if result[-1] != '\n' and result[-1] != '\r' and len(result) < self.__max_line_length:
             if self.__partial_line_time is None:
                 self.__partial_line_time = current_time
+            self.__partial_line_bytes = len(result)
             if current_time - self.__partial_line_time < self.__line_completion_wait_time:
                 # We aren't going to return it so reset buffer back to the original spot.
                 self.__buffer.seek(original_buffer_index)
@@ -360,16 +512,151 @@ class LogFileIterator(object):
 
         self.__position = self.__determine_mark_position(self.__buffer.tell())
 
-        # Just a sanity check.
-        if len(self.__buffer_contents_index) > 0:
+        if self.__check_buffer_invariants:
+            self.__verify_buffer_size()
+
+        return result
+
+    def read_lines(self, max_bytes=None, max_lines=None, current_time=None):
+        """Returns the next available lines from the file, along with the position of the start and end of each line.
+
+        This follows the same rules as 'readline' for deciding when a line is available, including the handling of
+        partial lines and the maximum line length.  However, it is much cheaper per line since it splits all of the
+        lines in the buffer in a single pass instead of doing the buffer bookkeeping for each line.
+
+        The iterator is left positioned after the last returned line.  If the caller decides not to consume all of
+        the returned lines, it may 'seek' back to the start position of the first line it did not consume.
+
+        @param max_bytes: If not None, no more lines are returned once this many bytes have been returned.  The last
+            line returned may cause this to be exceeded.
+        @param max_lines: If not None, the maximum number of lines to return.
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+
+        @type max_bytes: int or None
+        @type max_lines: int or None
+        @type current_time: float or None
+
+        @return: A list of tuples, one per line, holding the line, the position of the start of the line, and
+            the position of the end of the line.  The list is empty if no lines are available.
+        @rtype: list of (str, LogFileIterator.Position, LogFileIterator.Position)
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        result = []
+        total_bytes = 0
+        max_line_length = self.__max_line_length
+
+        # Each iteration of this loop refills the buffer (if necessary) and then splits as many lines as it can
+        # out of it.
+        more_to_read = True
+        while more_to_read:
+            if self.__buffer is None or (self.__available_buffer_bytes() < max_line_length and
+                                         self.__more_file_bytes_available()):
+                self.__fill_buffer(current_time)
+                just_filled = True
+            else:
+                just_filled = False
+
+            entries = self.__buffer_contents_index
+            index = self.__buffer.tell()
+            if len(entries) == 0 or index >= entries[-1].buffer_index_end:
+                self.__partial_line_time = None
+                break
+
+            if self.__check_buffer_invariants:
+                self.__verify_buffer_index(index)
+
+            contents = self.__buffer.getvalue()
+            buffer_end = entries[-1].buffer_index_end
+            more_file_bytes = self.__more_file_bytes_available()
+            # The entry in the buffer contents index that holds the current index.  We move through the entries in
+            # lock step with the index so that mapping a buffer index to a mark position does not require a scan.
+            entry_index = 0
+            mark_generation = self.__mark_generation
+            start_position = LogFileIterator.Position(mark_generation, self.__position)
+            more_to_read = False
+
+            while (max_lines is None or len(result) < max_lines) and (max_bytes is None or total_bytes < max_bytes):
+                remaining = buffer_end - index
+                if remaining == 0:
+                    more_to_read = more_file_bytes
+                    break
+                # If there might not be a full line left in the buffer, go back around and refill it first.  We only
+                # do this if we have made progress since the last refill so that we cannot get stuck.
+                if remaining < max_line_length and more_file_bytes and not just_filled:
+                    more_to_read = True
+                    break
+
+                limit = index + min(remaining, max_line_length)
+                end = contents.find('\n', index, limit) + 1
+                if end == 0:
+                    end = limit
+                    # We have a partial line (doesn't end in a newline).  We should only return it if it has reached
+                    # the maximum line length or sufficient time has passed.
+                    if end - index < max_line_length and contents[end - 1] != '\r':
+                        if self.__partial_line_time is None:
+                            self.__partial_line_time = current_time
+                        self.__partial_line_bytes = end - index
+                        if current_time - self.__partial_line_time < self.__line_completion_wait_time:
+                            break
+                    else:
+                        self.__partial_line_time = None
+                else:
+                    self.__partial_line_time = None
+
+                # Find the mark position for the end of the line.
+                while entry_index < len(entries) - 1 and end >= entries[entry_index].buffer_index_end:
+                    entry_index += 1
+                entry = entries[entry_index]
+                if end >= entry.buffer_index_end:
+                    end_position = LogFileIterator.Position(mark_generation, entry.position_end)
+                else:
+                    end_position = LogFileIterator.Position(
+                        mark_generation, entry.position_start + end - entry.buffer_index_start)
+
+                line = contents[index:end]
+                result.append((line, start_position, end_position))
+                total_bytes += end - index
+                index = end
+                start_position = end_position
+                just_filled = False
+
+            self.__buffer.seek(index)
+            self.__position = start_position.mark_offset
+
+        if self.__check_buffer_invariants:
+            self.__verify_buffer_size()
+
+        return result
+
+    def __verify_buffer_index(self, buffer_index):
+        """Asserts that the buffer index matches the one expected for the current position.
+
+        This is just a sanity check.  It is only performed if buffer invariant checking is turned on.
+
+        @param buffer_index: The current index into the buffer.
+        @type buffer_index: int
+        """
+        expected_buffer_index = self.__determine_buffer_index(self.__position)
+        if len(self.__buffer_contents_index) > 0 and self.__position != self.__buffer_contents_index[-1].position_end:
+            if expected_buffer_index != buffer_index:
+                assert expected_buffer_index == buffer_index, (
+                    'Mismatch between expected index and actual %ld %ld',
+                    expected_buffer_index, buffer_index)
+
+    def __verify_buffer_size(self):
+        """Asserts that the buffer holds the number of bytes recorded in the buffer contents index.
+
+        This is just a sanity check.  It is only performed if buffer invariant checking is turned on.
+        """
+        if self.__buffer_contents_index is not None and len(self.__buffer_contents_index) > 0:
             expected_size = self.__buffer_contents_index[-1].buffer_index_end
             actual_size = self.__file_system.get_file_size(self.__buffer)
             if expected_size != actual_size:
                 assert expected_size == actual_size, ('Mismatch between expected and actual size %ld %ld',
                                                       expected_size, actual_size)
 
-        return result
-
     def advance_to_end(self, current_time=None):
         """Advance the iterator to point at the end of the log file and begin reading from there.
 
@@ -390,6 +677,7 @@ class LogFileIterator(object):
         self.__pending_files = []
         self.__buffer_contents_index = None
         self.__buffer = None
+        self.__growth_index = []
         self.__mark_generation += 1
         self.__position = 0
 
@@ -397,6 +685,99 @@ class LogFileIterator(object):
 
         return skipping
 
+    def advance_to_time(self, cutoff_time, max_available=None, current_time=None):
+        """Advance the iterator past the bytes that were written before cutoff_time, so that reading resumes with
+        the most recent portion of the log file.
+
+        When the bytes were written is determined from the times the iterator noticed the log file grow, so this is
+        only accurate to within GROWTH_INDEX_INTERVAL seconds and errs on the side of keeping bytes.  Bytes written
+        while nothing was watching the log file (such as when the agent was not running) are kept, unless limited
+        by max_available.  The iterator is always left at the start of a line.  If the last line of the log has not
+        been completely written yet, the iterator is left at its start rather than in its middle, even if that means
+        keeping some bytes written before cutoff_time.
+
+        @param cutoff_time: The time in seconds past epoch.  Bytes written before this time are skipped.
+        @param max_available: If not None, the iterator is also advanced far enough that there are at most this many
+            bytes left to read.
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+
+        @type cutoff_time: float
+        @type max_available: int or None
+        @type current_time: float or None
+
+        @return: The number of bytes that were skipped.
+        @rtype: int
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        self.__refresh_pending_files(current_time=current_time)
+        if len(self.__pending_files) == 0:
+            return 0
+
+        original_position = self.__position
+        target = original_position
+        for (position, write_time) in self.__growth_index:
+            if write_time > cutoff_time:
+                break
+            target = max(target, position)
+
+        if max_available is not None:
+            target = max(target, self.__pending_files[-1].position_end - max_available)
+
+        if target <= original_position:
+            return 0
+
+        # The target may be in the middle of a line, so we back up a byte and throw away everything up to the next
+        # newline.  If the byte before the target is a newline, we are just throwing away that newline.
+        if not self.__skip_lines(target - 1, True, current_time):
+            # There is no newline after the target, so it is in the last line, which has not been completely written
+            # yet.  Rather than later returning just the end of that line, we back up to its start.  Since lines are
+            # split at max_line_length, the start must be within that many bytes of the target.
+            self.__skip_lines(max(original_position, target - self.__max_line_length), False, current_time)
+
+        self.__partial_line_time = None
+        return self.__position - original_position
+
+    def __skip_lines(self, start_position, stop_at_newline, current_time):
+        """Moves the iterator to start_position and then past the complete lines that follow it.
+
+        Lines are split at max_line_length just as `readline` does, but partial lines are never skipped, regardless of
+        how long they have been waiting for a newline.
+
+        @param start_position: The position to start skipping from.
+        @param stop_at_newline: If True, stops after the first line that ends in a newline.  Otherwise, skips all
+            complete lines.
+        @param current_time: The value to use for the current time.
+
+        @type start_position: int
+        @type stop_at_newline: bool
+        @type current_time: float
+
+        @return: True if a line ending in a newline was skipped.
+        @rtype: bool
+        """
+        self.__position = start_position
+        self.__reset_buffer()
+
+        skipped_newline = False
+        while True:
+            if self.__buffer is None or (self.__available_buffer_bytes() < self.__max_line_length and
+                                         self.__more_file_bytes_available()):
+                self.__fill_buffer(current_time)
+            original_buffer_index = self.__buffer.tell()
+
+            line = self.__buffer.readline(self.__max_line_length)
+            if len(line) == 0 or (line[-1] != '\n' and len(line) < self.__max_line_length):
+                self.__buffer.seek(original_buffer_index)
+                return skipped_newline
+
+            self.__position = self.__determine_mark_position(self.__buffer.tell())
+            if line[-1] == '\n':
+                skipped_newline = True
+                if stop_at_newline:
+                    return True
+
     def scan_for_new_bytes(self, current_time=None):
         """Checks the underlying file to see if any new bytes are available or if the file has been rotated.
 
@@ -532,6 +913,9 @@ class LogFileIterator(object):
         @param file_entry: The entry for the file to close.
         @type file_entry: FileState
         """
+        if file_entry.mapping is not None:
+            self.__file_system.close(file_entry.mapping)
+            file_entry.mapping = None
         if file_entry.file_handle is not None:
             self.__file_system.close(file_entry.file_handle)
             file_entry.file_handle = None
@@ -570,12 +954,18 @@ class LogFileIterator(object):
         # First, try to see if the file at the log file path still exists, and if so, what's size and inode is.
         try:
             # Get the latest size and inode of the file at __path.
-            stat_result = self.__file_system.stat(self.__path)
+            stat_result = self.__file_system.watched_stat(self.__path, current_time=current_time)
             latest_inode = stat_result.st_ino
             latest_size = stat_result.st_size
+            if (current_log_file is not None and current_log_file.file_handle is not None and
+                    self.__file_system.is_compressed(current_log_file.file_handle)):
+                # The size on disk of a compressed file is not the number of bytes we read from it.
+                latest_size = self.__file_system.get_file_size(current_log_file.file_handle)
 
             # See if it is rotated by checking out the file handle we last opened to this file path.
             if current_log_file is not None:
+                if current_log_file.last_known_size > latest_size:
+                    self.__disable_mmap()
                 if (current_log_file.last_known_size > latest_size or
                         self.__file_system.trust_inodes and current_log_file.inode != latest_inode):
                     # Ok, the log file has rotated.  We need to add in a new entry to represent this.
@@ -607,6 +997,7 @@ class LogFileIterator(object):
                 else:
                     # It has not been rotated.  So we just update the size of the current entry.
                     current_log_file.last_known_size = latest_size
+                    current_log_file.last_modification_time = LogFileIterator.FileState.modification_time(stat_result)
                     current_log_file.position_end = current_log_file.position_start + latest_size
             else:
                 # There is no entry representing the file at log_path, but it does exist, so we need to add it in.
@@ -632,12 +1023,41 @@ class LogFileIterator(object):
         if has_no_position and len(self.__pending_files) > 0:
             self.__position = self.__pending_files[-1].position_end
 
+        if len(self.__pending_files) > 0 and current_time is not None:
+            self.__record_growth(self.__pending_files[-1].position_end, current_time)
+
+    def __record_growth(self, end_position, current_time):
+        """Records in the growth index that the bytes before end_position were written by current_time, if it has
+        been long enough since the last entry was added.
+
+        @param end_position: The mark position of the end of the log file.
+        @param current_time: The current time.
+        @type end_position: int
+        @type current_time: float
+        """
+        if len(self.__growth_index) > 0:
+            (last_position, last_time) = self.__growth_index[-1]
+            if end_position <= last_position or current_time - last_time < GROWTH_INDEX_INTERVAL:
+                return
+
+        self.__growth_index.append((end_position, current_time))
+        if len(self.__growth_index) > MAX_GROWTH_INDEX_ENTRIES:
+            # Keep the most recent entry since it is the most accurate.
+            self.__growth_index = self.__growth_index[-1::-2][::-1]
+
     def __fill_buffer(self, current_time):
         """Fill the memory buffer with up to a page worth of file content read from the pending files.
 
         @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
         @type current_time: float or None
         """
+        # Just in case a file has been rotated recently, we refresh our list before we read it.
+        self.__refresh_pending_files(current_time)
+        page_size = self.__adjust_page_size()
+
+        if self.__use_mmap and self.__fill_buffer_from_mapping(page_size):
+            return
+
         new_buffer = StringIO()
         new_buffer_content_index = []
 
@@ -673,9 +1093,6 @@ class LogFileIterator(object):
 
         leftover_bytes = new_buffer.tell()
 
-        # Just in case a file has been rotated recently, we refresh our list before we read it.
-        self.__refresh_pending_files(current_time)
-
         # Now we go through the files and get as many bytes as we can.
         should_have_bytes = False
         for pending_file in self.__pending_files:
@@ -685,8 +1102,9 @@ class LogFileIterator(object):
                 bytes_left_in_file = pending_file.last_known_size - (read_position - pending_file.position_start)
                 content = self.__read_file_chunk(
                     pending_file, read_position,
-                    min(self.__page_size - new_buffer.tell(), bytes_left_in_file))
+                    min(page_size - new_buffer.tell(), bytes_left_in_file))
                 if content is not None:
+                    self.__read_ahead(pending_file, read_position + len(content))
                     buffer_start = new_buffer.tell()
                     new_buffer.write(content)
                     buffer_end = new_buffer.tell()
@@ -694,7 +1112,7 @@ class LogFileIterator(object):
                                                                                 buffer_start,
                                                                                 buffer_end - buffer_start))
                 read_position = pending_file.position_end
-                if new_buffer.tell() >= self.__page_size:
+                if new_buffer.tell() >= page_size:
                     break
 
         buffer_size = new_buffer.tell()
@@ -730,6 +1148,136 @@ class LogFileIterator(object):
                                                       expected_size, actual_size, leftover_bytes,
                                                       actual_size - leftover_bytes)
 
+    def __fill_buffer_from_mapping(self, page_size):
+        """Fill the buffer with up to a page of bytes taken directly from a pending file's memory mapping.
+
+        This only handles the case where the bytes that should be placed in the buffer all come from a single pending
+        file.  Compared to __fill_buffer, this avoids the seek and read calls for the file and does not copy over the
+        leftover bytes from the current buffer since the new page just begins at the current position.
+
+        The caller must have already refreshed the pending files.
+
+        @param page_size: The maximum number of bytes to place in the buffer.
+        @type page_size: int
+
+        @return: True if the buffer was filled.  If False, the caller must fall back to the copying approach.
+        @rtype: bool
+        """
+        read_position = self.__position
+        target_file = None
+        for pending_file in self.__pending_files:
+            if target_file is not None:
+                # We can only use the mapping if the target file holds at least a full line's worth of bytes or there
+                # are no bytes after it.  Otherwise, a line might have to be stitched together across files.
+                if (pending_file.position_end > target_file.position_end and
+                        target_file.position_end - read_position < self.__max_line_length):
+                    return False
+                break
+            if read_position < pending_file.position_end:
+                target_file = pending_file
+                read_position = max(pending_file.position_start, read_position)
+
+        if (target_file is None or not target_file.valid or target_file.file_handle is None or
+                self.__file_system.is_compressed(target_file.file_handle)):
+            return False
+
+        offset_in_file = read_position - target_file.position_start
+        num_bytes = min(page_size, target_file.position_end - read_position)
+
+        # Touching a mapped page that is beyond the end of the file results in a bus error, which kills the process,
+        # so the mapping must never be used if the file could be truncated while we copy the page out of it.  This is
+        # also why we take a copy of the page rather than handing out a view on the mapping itself.  There is no way
+        # to check the size and copy atomically, so:
+        #   - If the file has been truncated, it is being rotated by copying and truncating it in place, and the
+        #     mapping is not used for it again.  We let the copying approach deal with invalidating the file.
+        #   - If the file has changed since the last page was read from it, the page is read by the copying approach,
+        #     which just gets fewer bytes if the file shrinks.  Only files that have held still are mapped.
+        stat_result = self.__file_system.fstat(target_file.file_handle)
+        if stat_result.st_size < target_file.last_known_size:
+            self.__disable_mmap()
+            return False
+
+        mapping_check = (stat_result.st_size, stat_result.st_mtime)
+        if target_file.mapping_check != mapping_check:
+            target_file.mapping_check = mapping_check
+            return False
+
+        # Only remap the file if it has grown past the portion we have already mapped.
+        if target_file.mapping is None or len(target_file.mapping) < offset_in_file + num_bytes:
+            if target_file.mapping is not None:
+                self.__file_system.close(target_file.mapping)
+                target_file.mapping = None
+            try:
+                target_file.mapping = self.__file_system.mmap(target_file.file_handle, target_file.last_known_size)
+            except (EnvironmentError, ValueError), e:
+                log.warn('Could not memory map file %s due to error %s.  Falling back to reading it.', self.__path,
+                         str(e), limit_once_per_x_secs=60, limit_key=('mmap-failed-%s' % self.__path))
+                return False
+
+        self.page_reads += 1
+        self.__read_ahead(target_file, read_position + num_bytes)
+        self.__buffer = LogFileIterator.PageBuffer(target_file.mapping[offset_in_file:offset_in_file + num_bytes])
+        self.__buffer_contents_index = [LogFileIterator.BufferEntry(read_position, 0, num_bytes)]
+        self.__position = read_position
+        return True
+
+    def __disable_mmap(self):
+        """Stops reading the log through memory mappings because it has been truncated in place, such as by
+        logrotate's copytruncate option.  A truncation racing with a copy out of the mapping would crash the agent.
+        """
+        if not self.__use_mmap:
+            return
+        log.warn('Log file \'%s\' was truncated in place, so it will no longer be read through memory mappings.  '
+                 'The use_mmap option should not be used for logs rotated with copytruncate.', self.__path,
+                 limit_once_per_x_secs=300, limit_key=('mmap-truncated-%s' % self.__path))
+        self.__use_mmap = False
+        for file_state in self.__pending_files:
+            if file_state.mapping is not None:
+                self.__file_system.close(file_state.mapping)
+                file_state.mapping = None
+
+    def __adjust_page_size(self):
+        """Grows or shrinks the number of bytes to read at a time based on how many bytes remain to be read.
+
+        This should be invoked right before reading a page, after the pending files have been refreshed.
+
+        @return: The number of bytes to read for the page.
+        @rtype: int
+        """
+        # We only consider ourselves to be catching up if there are several pages worth of bytes to read.  This keeps
+        # the page size stable when just tailing a file that is being written in bursts.
+        backlog = self.available
+        if backlog >= 4 * self.__current_page_size:
+            self.__current_page_size = min(2 * self.__current_page_size, self.__max_page_size)
+        elif backlog < self.__current_page_size / 2:
+            self.__current_page_size = max(self.__current_page_size / 2, self.__page_size)
+
+        self.largest_page_size = max(self.largest_page_size, self.__current_page_size)
+        return self.__current_page_size
+
+    def __read_ahead(self, file_state, read_position_relative_to_mark):
+        """Hints to the operating system that the next page of the file will be read soon, if we are catching up.
+
+        @param file_state: The pending file being read.
+        @param read_position_relative_to_mark: The position the next page will be read from.
+        @type file_state: LogFileIterator.FileState
+        @type read_position_relative_to_mark: int
+        """
+        if self.__current_page_size <= self.__page_size or file_state.file_handle is None:
+            return
+        offset_in_file = read_position_relative_to_mark - file_state.position_start
+        num_bytes = min(self.__current_page_size, file_state.last_known_size - offset_in_file)
+        if num_bytes > 0:
+            self.__file_system.advise_will_need(file_state.file_handle, offset_in_file, num_bytes)
+
+    @property
+    def page_size(self):
+        """
+        @return: The number of bytes that will be read at a time from the file.
+        @rtype: int
+        """
+        return self.__current_page_size
+
     def __read_file_chunk(self, file_state, read_position_relative_to_mark, num_bytes):
         """Reads a portion of the file in file_state and returns it.
 
@@ -749,9 +1297,14 @@ class LogFileIterator(object):
             return None
 
         # The file_handle could have been closed if we are on a win32 system and prepare_for_inactivity was closed.
-        # If so, we need to re-open it for reading.
+        # If so, we need to re-open it for reading.  Files that are not at the log path, such as the compressed copy
+        # of a rotated log, are reopened from their own path.
         if file_state.file_handle is None:
-            (file_state.file_handle, x, y) = self.__open_file_by_path(self.__path, starting_inode=file_state.inode)
+            if file_state.path is not None:
+                file_path = file_state.path
+            else:
+                file_path = self.__path
+            (file_state.file_handle, x, y) = self.__open_file_by_path(file_path, starting_inode=file_state.inode)
 
         if file_state.file_handle is None:
             file_state.valid = False
@@ -808,13 +1361,18 @@ class LogFileIterator(object):
                 while attempts_left > 0:
                     if starting_inode is None and self.__file_system.trust_inodes:
                         starting_inode = self.__file_system.stat(file_path).st_ino
-                    pending_file = self.__file_system.open(file_path)
+                    pending_file = self.__file_system.open(file_path, decompress=self.__read_compressed)
                     second_stat = self.__file_system.stat(file_path)
 
                     if not self.__file_system.trust_inodes or starting_inode == second_stat.st_ino:
                         new_file = pending_file
                         pending_file = None
-                        return new_file, second_stat.st_size, second_stat.st_ino
+                        # Log files are almost always read from front to back.
+                        self.__file_system.advise_sequential(new_file)
+                        file_size = second_stat.st_size
+                        if self.__file_system.is_compressed(new_file):
+                            file_size = self.__file_system.get_file_size(new_file)
+                        return new_file, file_size, second_stat.st_ino
 
                     pending_file.close()
                     pending_file = None
@@ -844,8 +1402,8 @@ class LogFileIterator(object):
     def __open_file_by_inode(self, dir_path, target_inode):
         """Opens the file in the directory at dir_path with the specified inode, if it exists.
 
-        Note, this is a little inefficient because we have to list all the files in the directory, but
-        this should not be needed that often.
+        The file is found using the file system's index of the directory, which is shared by all iterators using the
+        same file system, so restoring many iterators from checkpoints only lists the directory once.
 
         @param dir_path: The path of the directory to look in.
         @param target_inode: The inode of the desired file.
@@ -864,13 +1422,9 @@ class LogFileIterator(object):
 
         try:
             while attempts_left > 0:
-                found_path = None
-                # List all files in the directory in the directory.
-                for path in self.__file_system.list_files(dir_path):
-                    if self.__file_system.stat(path).st_ino == target_inode:
-                        found_path = path
-                        break
-
+                # If the index led us astray the last time through, we force it to be rebuilt.
+                found_path = self.__file_system.find_path_by_inode(dir_path, target_inode,
+                                                                   force_rebuild=(attempts_left < 3))
                 if found_path is None:
                     return None, None, None
 
@@ -888,6 +1442,68 @@ class LogFileIterator(object):
             if pending_file is not None:
                 pending_file.close()
 
+    def __open_compressed_rotation(self, file_size, modification_time):
+        """Opens the compressed copy of a rotated log file, if it exists.
+
+        The copy is identified as a compressed file in the log's directory named like a rotation of the log file
+        (such as `app.log.1.gz` or `app.log-20160101.gz`) whose uncompressed size is exactly the size of the rotated
+        file.  Since decompressing every retained rotation would be expensive, the candidates are first narrowed using
+        their modification times and the uncompressed size recorded in their gzip trailers.  Only the remaining
+        candidate whose modification time is closest to the rotation is decompressed to verify it is complete.
+
+        @param file_size: The size of the rotated file.
+        @param modification_time: The last modification time recorded for the rotated file, in milliseconds, or None
+            if it is not known.
+
+        @type file_size: int
+        @type modification_time: long or None
+
+        @return: A tuple of the file handle, the size, and the current inode of the compressed file.
+        @rtype: (FileSystem.CompressedFile, int, int)
+        """
+        dir_path = os.path.dirname(self.__path)
+        prefix = os.path.basename(self.__path)
+        best_path = None
+        best_modification_time = None
+
+        try:
+            for path in self.__file_system.list_files(dir_path):
+                file_name = os.path.basename(path)
+                if (not file_name.startswith(prefix) or not self.__file_system.is_compressed_path(path) or
+                        LogFileIterator.__ROTATION_SUFFIX.match(file_name[len(prefix):]) is None):
+                    continue
+                # The copy is written after the last write to the rotated file (or keeps its modification time, as
+                # gzip does), so older rotations can be skipped.  Allow for the granularity of modification times.
+                candidate_modification_time = LogFileIterator.FileState.modification_time(
+                    self.__file_system.stat(path))
+                if (modification_time is not None and
+                        candidate_modification_time < modification_time - LogFileIterator.__MODIFICATION_TIME_SLACK):
+                    continue
+                # The trailer of a complete copy holds its uncompressed size modulo 2^32.
+                if self.__file_system.get_compressed_size_hint(path) != file_size % 0x100000000:
+                    continue
+                if best_path is None or candidate_modification_time < best_modification_time:
+                    best_path = path
+                    best_modification_time = candidate_modification_time
+        except (IOError, OSError), e:
+            log.warn('Error seen while looking for compressed copy of rotated log \'%s\': %s', self.__path, str(e),
+                     limit_once_per_x_secs=60, limit_key=('compressed-rotation-' + self.__path))
+            return None, None, None
+
+        if best_path is None:
+            return None, None, None
+
+        # Opening the file decompresses it in full to verify it is complete.  The verified size is kept on the handle.
+        (file_object, opened_size, inode) = self.__open_file_by_path(best_path)
+        if file_object is not None and opened_size != file_size:
+            self.__file_system.close(file_object)
+            return None, None, None
+
+        if file_object is not None:
+            log.info('Resuming copying of rotated log \'%s\' from its compressed copy \'%s\'', self.__path,
+                     best_path)
+        return file_object, opened_size, inode
+
     def get_checkpoint(self):
         """Returns a check point representing the position of the iterator.
 
@@ -901,7 +1517,88 @@ class LogFileIterator(object):
         pending_files = []
         for pending_file in self.__pending_files:
             pending_files.append(pending_file.to_json())
-        return {'position': self.__position, 'pending_files': pending_files}
+        result = {'position': self.__position, 'pending_files': pending_files}
+        if len(self.__growth_index) > 0:
+            result['growth_index'] = [[position, write_time] for (position, write_time) in self.__growth_index]
+        if self.__partial_line_time is not None:
+            result['partial_line_time'] = self.__partial_line_time
+            result['partial_line_bytes'] = self.__partial_line_bytes
+
+        file_state = self.__find_file_ending_at_position()
+        if file_state is not None:
+            key = (file_state, self.__mark_generation, self.__position)
+            if self.__last_fingerprint is None or self.__last_fingerprint[0] != key:
+                self.__last_fingerprint = (key, self.__compute_fingerprint(file_state, FINGERPRINT_SIZE))
+            if self.__last_fingerprint[1] is not None:
+                result['fingerprint'] = self.__last_fingerprint[1]
+        return result
+
+    def __find_file_ending_at_position(self):
+        """
+        @return: The pending file holding the byte just before the current position, or None if there is none.
+        @rtype: LogFileIterator.FileState
+        """
+        for file_state in self.__pending_files:
+            if file_state.valid and file_state.position_start < self.__position <= file_state.position_end:
+                return file_state
+        return None
+
+    def __compute_fingerprint(self, file_state, length):
+        """Computes the fingerprint of the bytes just before the current position in the specified file.
+
+        @param file_state: The pending file holding the bytes just before the current position.
+        @param length: The maximum number of bytes to fingerprint.
+
+        @type file_state: LogFileIterator.FileState
+        @type length: int
+
+        @return: A list holding the number of bytes fingerprinted and their CRC32, or None if a fingerprint could not
+            be computed, such as for compressed files which cannot be cheaply read out of order.
+        @rtype: list of int or None
+        """
+        offset = self.__position - file_state.position_start
+        length = min(length, offset)
+        if (length <= 0 or file_state.file_handle is None or
+                self.__file_system.is_compressed(file_state.file_handle)):
+            return None
+
+        try:
+            self.__file_system.seek(file_state.file_handle, offset - length)
+            content = self.__file_system.read(file_state.file_handle, length)
+        except (IOError, OSError):
+            return None
+
+        if content is None or len(content) != length:
+            return None
+        return [length, zlib.crc32(content) & 0xffffffff]
+
+    def __verify_fingerprint(self, fingerprint):
+        """Verifies the pending files restored from a checkpoint still hold the content recorded in its fingerprint.
+
+        If they do not, the file was replaced since the checkpoint was written, such as when inodes cannot be trusted
+        and a new log file has been written at the same path.  If that is the current log file, we start reading it
+        from its beginning.  Otherwise, we drop the rotated file since we cannot tell which of its bytes we still
+        need.
+
+        @param fingerprint: The fingerprint from the checkpoint, as returned by __compute_fingerprint.
+        @type fingerprint: list of int
+        """
+        file_state = self.__find_file_ending_at_position()
+        if file_state is None:
+            return
+        current_fingerprint = self.__compute_fingerprint(file_state, fingerprint[0])
+        if current_fingerprint is None or current_fingerprint == [fingerprint[0], fingerprint[1]]:
+            return
+
+        log.info('The contents of \'%s\' changed since its last checkpoint.  Resuming from the start of the file.',
+                 self.__path)
+        if file_state.is_log_file:
+            file_state.last_known_size = self.__file_system.get_file_size(file_state.file_handle)
+            file_state.position_start = self.__position
+            file_state.position_end = self.__position + file_state.last_known_size
+        else:
+            self.__close_file(file_state)
+            self.__pending_files.remove(file_state)
 
     @staticmethod
     def create_checkpoint(initial_position):
@@ -933,6 +1630,60 @@ class LogFileIterator(object):
             self.buffer_index_start = buffer_index_start
             self.buffer_index_end = buffer_index_start + num_bytes
 
+    class PageBuffer(object):
+        """A read-only buffer holding a single page of bytes that can be used in place of the StringIO buffer.
+
+        This is used when the iterator is using memory mappings.  Lines are returned by searching for the newline and
+        slicing the page directly, without the extra copies StringIO requires.  Only the methods used by
+        LogFileIterator on its buffer are implemented.
+        """
+        def __init__(self, page):
+            """
+            @param page: The bytes held by the buffer.
+            @type page: str
+            """
+            self.__page = page
+            self.__current = 0
+
+        def readline(self, max_bytes):
+            """Returns the bytes up to and including the next newline, but no more than max_bytes bytes.
+
+            @param max_bytes: The maximum number of bytes to return.
+            @type max_bytes: int
+            @rtype: str
+            """
+            end = min(len(self.__page), self.__current + max_bytes)
+            newline = self.__page.find('\n', self.__current, end)
+            if newline >= 0:
+                end = newline + 1
+            result = self.__page[self.__current:end]
+            self.__current = end
+            return result
+
+        def read(self):
+            """Returns all remaining bytes in the buffer.
+            @rtype: str
+            """
+            result = self.__page[self.__current:]
+            self.__current = len(self.__page)
+            return result
+
+        def getvalue(self):
+            """Returns all of the bytes in the buffer, regardless of the current position.
+            @rtype: str
+            """
+            return self.__page
+
+        def tell(self):
+            return self.__current
+
+        def seek(self, position, whence=0):
+            if whence == 2:
+                position += len(self.__page)
+            elif whence == 1:
+                position += self.__current
+            self.__current = max(0, min(position, len(self.__page)))
+
     class FileState(object):
         """Represents a file in the list of pending files for the LogFileIterator."""
         def __init__(self, state_json, file_handle):
@@ -950,11 +1701,26 @@ class LogFileIterator(object):
             self.position_start = state_json['position_start']
             self.position_end = state_json['position_end']
             self.file_handle = file_handle
+            # The read-only memory mapping of the file.  This is only used if the iterator is using mmap.
+            self.mapping = None
+            # The size and modification time of the file the last time a page was read from it using mmap, or None.
+            # The mapping is only used once the file has not changed between two reads.
+            self.mapping_check = None
             if 'inode' in state_json:
                 self.inode = state_json['inode']
             self.last_known_size = state_json['last_known_size']
             # Is this file currently at the file path of the log file (or is it a file a rotated log).
             self.is_log_file = state_json['is_log_file']
+            # The path of the file if it must be reopened from somewhere other than the log path, such as the
+            # compressed copy of a rotated log.  Otherwise, None.
+            self.path = None
+            if 'path' in state_json:
+                self.path = state_json['path']
+            # The modification time of the file when last_known_size was last updated from the log path, in
+            # milliseconds past epoch (see modification_time), or None if it is not known.
+            self.last_modification_time = None
+            if 'last_modification_time' in state_json:
+                self.last_modification_time = state_json['last_modification_time']
 
         def to_json(self):
             """Creates and returns the state serialized to Json.
@@ -968,8 +1734,26 @@ class LogFileIterator(object):
                                          is_log_file=self.is_log_file)
             if self.inode is not None:
                 result['inode'] = self.inode
+            if self.path is not None:
+                result['path'] = self.path
+            if self.last_modification_time is not None:
+                result['last_modification_time'] = self.last_modification_time
             return result
 
+        @staticmethod
+        def modification_time(stat_result):
+            """Returns the modification time from the stat result as it is recorded in the state.
+
+            It is kept as an integer number of milliseconds so that it survives being serialized to a checkpoint
+            unchanged and can be compared exactly.
+
+            @param stat_result: The stat result for the file.
+            @type stat_result: posix.stat_result
+
+            @rtype: long
+            """
+            return long(stat_result.st_mtime * 1000)
+
         @staticmethod
         def create_json(position_start, initial_offset, file_size, inode, is_log_file):
             """Creates a JsonObject that represents the specified state.
@@ -1009,7 +1793,8 @@ class LogFileProcessor(object):
     to be sent to the server after applying any sampling and redaction rules.
     """
 
-    def __init__(self, file_path, log_attributes=None, file_system=None, checkpoint=None):
+    def __init__(self, file_path, log_attributes=None, file_system=None, checkpoint=None, use_mmap=False,
+                 dormant=False, read_compressed=False):
         """Initializes an instance.
 
         @param file_path: The path of the log file to process.
@@ -1020,11 +1805,21 @@ class LogFileProcessor(object):
             real file system.  This is used for testing.
         @param checkpoint: An object previously returned by the 'get_checkpoint' method.  This will cause
             the processing to pick up from where it was when the checkpoint was created.
+        @param use_mmap: If True, the log file is read through memory mappings.  See LogFileIterator.
+        @param dormant: If True and a checkpoint is given, the log file is not opened and the checkpoint is not
+            restored until the processor is asked to process the file and it has changed since the checkpoint was
+            written.  Until then, the checkpoint is returned as is by 'get_checkpoint'.  This keeps restoring thousands
+            of checkpointed logs at start up cheap.
+        @param read_compressed: If True, gzip compressed files are decompressed as they are read.  See
+            LogFileIterator.
 
         @type file_path: str
         @type log_attributes: dict or None
         @type file_system: FileSystem
         @type checkpoint: dict or None
+        @type use_mmap: bool
+        @type dormant: bool
+        @type read_compressed: bool
         """
         if file_system is None:
             file_system = FileSystem()
@@ -1041,15 +1836,55 @@ class LogFileProcessor(object):
         self.__thread_name = 'Lines for file %s' % file_path
         self.__thread_id = LogFileProcessor.generate_unique_thread_id()
 
-        self.__log_file_iterator = LogFileIterator(file_path, file_system=file_system, checkpoint=checkpoint)
+        self.__file_system = file_system
+        self.__use_mmap = use_mmap
+        self.__read_compressed = read_compressed
+        # If the processor is dormant, the checkpoint to restore the iterator from once the log file has changed.  The
+        # iterator is None until then.
+        self.__dormant_checkpoint = None
+        if dormant and checkpoint is not None:
+            self.__dormant_checkpoint = checkpoint
+            self.__log_file_iterator = None
+        else:
+            self.__log_file_iterator = LogFileIterator(file_path, file_system=file_system, checkpoint=checkpoint,
+                                                       use_mmap=use_mmap, read_compressed=read_compressed)
         # Trackers whether or not close has been invoked on this processor.
         self.__is_closed = False
 
         self.__log_attributes = log_attributes
+        # The sampling and redaction rules to apply to the lines, which may be shared with other processors.
+        self.__rules = LogLineRules()
         # The redacter to perform on all log lines from this log file.
         self.__redacter = LogLineRedacter(file_path)
         # The sampler to apply to all log lines from this log file.
         self.__sampler = LogLineSampler(file_path)
+        # The pool of worker processes to apply the rules in, or None if they are applied by the calling thread.
+        self.__line_processing_pool = None
+        # The cache of the results of applying the rules to recently seen lines, or None if they are always applied.
+        self.__rule_cache = None
+        # The assembler used to join the lines of multi-line events, or None if each line is its own event.
+        self.__assembler = None
+        # The parser used to lift the fields of lines holding JSON objects into the events' attributes, or None if
+        # lines are always sent as is.
+        self.__json_line_parser = None
+        # If the last event in the log might still have more lines written to it, the time when we first decided to
+        # wait for them.  We only wait EVENT_COMPLETION_WAIT_TIME seconds before sending the event anyway.
+        self.__pending_event_time = None
+        # Maps each sampling rate to the EventTemplate for the events sent with that rate.  The templates hold the
+        # serialized log attributes and thread id, so they only have to be serialized once.
+        self.__event_templates = {}
+        # The number of seconds during which repeats of a copied line are collapsed into a single summary event, or 0
+        # if repeated lines are copied as is.
+        self.__dedup_window = 0
+        # The lines copied within the dedup window and the number of times each has been repeated since.  Even if
+        # dedup is turned off, it may hold the repeats restored from the checkpoint until their summaries are sent.
+        self.__repeated_lines = RepeatedLineTracker()
+        if checkpoint is not None and 'repeated_lines' in checkpoint:
+            self.__repeated_lines.restore(checkpoint['repeated_lines'])
+        # The maximum number of lines and bytes to pack into a single event, or 0 lines if each line is sent as its
+        # own event.
+        self.__coalesce_max_lines = 0
+        self.__coalesce_max_bytes = MAX_EVENT_SIZE
 
         # The lock that must be held when reading all status related fields and __is_closed.
         self.__lock = threading.Lock()
@@ -1063,17 +1898,90 @@ class LogFileProcessor(object):
 
         self.__total_lines_copied = 0L
         self.__total_lines_dropped_by_sampling = 0L
+        self.__total_bytes_dropped_by_rate_limit = 0L
+        self.__total_lines_dropped_by_rate_limit = 0L
 
         self.__total_redactions = 0L
 
+        # The rate limit for the log file, as the fill rate and size of the bucket used by the RateLimiter.  The
+        # limiter itself is created the first time the log file is processed.  The rate is None if the log file is
+        # not rate limited.
+        self.__rate_limit_bytes_per_second = None
+        self.__rate_limit_burst_size = None
+        self.__rate_limiter = None
+
         # The last time the log file was checked for new content.
         self.__last_scan_time = None
 
         self.__copy_staleness_threshold = COPY_STALENESS_THRESHOLD
         self.__max_log_offset_size = MAX_LOG_OFFSET_SIZE
+        self.__catch_up_window = CATCH_UP_WINDOW
 
         self.__last_success = None
 
+        # The last time we saw bytes waiting to be copied from the log file.  Used to decide when to hibernate.
+        self.__last_activity_time = None
+        self.__hibernation_threshold = HIBERNATION_THRESHOLD
+        self.__max_hibernation_poll_interval = MAX_HIBERNATION_POLL_INTERVAL
+        # If the processor is hibernating, the number of seconds between checks of the log file for changes and the
+        # time of the next check.  Both are None if the processor is not hibernating.
+        self.__hibernation_poll_interval = None
+        self.__next_hibernation_poll_time = None
+
+        self.__adaptive_sampling_threshold = ADAPTIVE_SAMPLING_THRESHOLD
+        # The rate at which lines are currently being sampled due to a backlog, the last time it was updated, and the
+        # sampler that applies it.  The sampler is None if the rate is 1.0.
+        self.__adaptive_sampling_rate = 1.0
+        self.__last_adaptive_sampling_update = None
+        self.__adaptive_sampler = None
+
+    def set_parameters(self, copy_staleness_threshold=None, max_log_offset_size=None, catch_up_window=None,
+                       hibernation_threshold=None, max_hibernation_poll_interval=None,
+                       adaptive_sampling_threshold=None):
+        """Sets the various parameters controlling when the processor skips ahead in, hibernates, or samples the log
+        file.
+
+        The CopyingManager uses this to apply the hibernation and adaptive sampling settings from the agent
+        configuration to each new processor.  Tests also use it to shorten the other thresholds.
+
+        @param copy_staleness_threshold: The number of seconds without a success after which the processor skips
+            ahead, or None if you do not wish to change the current value.
+        @param max_log_offset_size: The maximum number of bytes the processor may be behind the end of the log before
+            it skips ahead, or None if you do not wish to change the current value.
+        @param catch_up_window: The number of seconds of the most recent log content to keep when skipping ahead,
+            or None if you do not wish to change the current value.
+        @param hibernation_threshold: The number of seconds the log file must go without growing before the processor
+            hibernates, or 0 to never hibernate.  None if you do not wish to change the current value.
+        @param max_hibernation_poll_interval: The maximum number of seconds between checks of a hibernating log file
+            for changes, or None if you do not wish to change the current value.
+        @param adaptive_sampling_threshold: The number of bytes waiting to be copied from the log file above which its
+            lines are sampled to catch up, or 0 to never sample them.  None if you do not wish to change the current
+            value.
+        @type copy_staleness_threshold: float or None
+        @type max_log_offset_size: int or None
+        @type catch_up_window: float or None
+        @type hibernation_threshold: float or None
+        @type max_hibernation_poll_interval: float or None
+        @type adaptive_sampling_threshold: int or None
+        """
+        if copy_staleness_threshold is not None:
+            self.__copy_staleness_threshold = copy_staleness_threshold
+
+        if max_log_offset_size is not None:
+            self.__max_log_offset_size = max_log_offset_size
+
+        if catch_up_window is not None:
+            self.__catch_up_window = catch_up_window
+
+        if hibernation_threshold is not None:
+            self.__hibernation_threshold = hibernation_threshold
+
+        if max_hibernation_poll_interval is not None:
+            self.__max_hibernation_poll_interval = max_hibernation_poll_interval
+
+        if adaptive_sampling_threshold is not None:
+            self.__adaptive_sampling_threshold = adaptive_sampling_threshold
+
     def generate_status(self):
         """Generates and returns a status object for this particular processor.
 
@@ -1094,8 +2002,29 @@ class LogFileProcessor(object):
             result.total_bytes_dropped_by_sampling = self.__total_bytes_dropped_by_sampling
             result.total_lines_copied = self.__total_lines_copied
             result.total_lines_dropped_by_sampling = self.__total_lines_dropped_by_sampling
+            result.total_bytes_dropped_by_rate_limit = self.__total_bytes_dropped_by_rate_limit
+            result.total_lines_dropped_by_rate_limit = self.__total_lines_dropped_by_rate_limit
+            result.adaptive_sampling_rate = self.__adaptive_sampling_rate
             result.total_redactions = self.__total_redactions
             result.total_bytes_skipped = self.__total_bytes_skipped
+            sampling_rules = self.__rules.sampling_rules
+            for index in xrange(len(sampling_rules)):
+                result.rule_times.append(('sampling', sampling_rules[index].match_expression.pattern,
+                                          self.__sampler.rule_times[index]))
+            redaction_rules = self.__rules.redaction_rules
+            for index in xrange(len(redaction_rules)):
+                result.rule_times.append(('redaction', redaction_rules[index].redaction_expression.pattern,
+                                          self.__redacter.rule_times[index]))
+            rule_cache = self.__rule_cache
+            if rule_cache is not None:
+                result.rule_cache_hits = rule_cache.hits
+                result.rule_cache_misses = rule_cache.misses
+                result.rule_cache_enabled = rule_cache.is_enabled()
+            log_file_iterator = self.__log_file_iterator
+            if log_file_iterator is not None:
+                result.total_page_reads = log_file_iterator.page_reads
+                result.current_page_size = log_file_iterator.page_size
+                result.largest_page_size = log_file_iterator.largest_page_size
 
             return result
         finally:
@@ -1120,60 +2049,228 @@ class LogFileProcessor(object):
         # TODO:  Change this to just a regular property?
         return self.__path
 
-    # Success results for the callback returned by perform_processing.
-    SUCCESS = 1
-    FAIL_AND_DROP = 2
-    FAIL_AND_RETRY = 3
+    @property
+    def is_dormant(self):
+        """
+        @return: True if the processor has not yet opened the log file to restore its checkpoint, either because it
+            has not been used since it was created or because it is hibernating.
+        @rtype: bool
+        """
+        return self.__log_file_iterator is None
 
-    def perform_processing(self, add_events_request, current_time=None):
-        """Scans the available lines from the log file, processes them using the configured redacters and samplers
-         and appends the lines that emerge to add_events_request.
+    @property
+    def is_hibernating(self):
+        """
+        @return: True if the processor is hibernating because the log file has not grown in a while.
+        @rtype: bool
+        """
+        return self.__next_hibernation_poll_time is not None
 
-        @param add_events_request:  The request to add the resulting lines/events to.  This request will
-            eventually be sent to the server.
-        @param current_time:  If not None, the value to use as the current_time.  Used for testing.
+    def __hibernate(self, current_time):
+        """Closes the log file and frees the iterator, keeping only its checkpoint, until the file changes.
 
-        @type add_events_request: scalyr_client.AddEventsRequest
-        @type current_time: float or None
+        This is only done if the iterator is positioned at the end of the file at the log path, since we rely on its
+        size and inode to detect changes.
 
-        @return A tuple containing two elements:  a callback function to invoke when the result of sending the
-            events to the server is known, and a bool indicating if the buffer has been filled and could not
-            accept new events.  The call function takes a single argument that is an int which can
-            only have values of SUCCESS, FAIL_AND_DROP, and FAIL_AND_RETRY.  If SUCCESS is passed in, then the
-            events are marked as successfully sent.  If FAIL_AND_DROP is passed in, then the events are
-            marked as consumed but not successfully processed.  If FAIL_AND_RETRY is passed in, then the processor
-            is rolled back and the events will be retried for processing later on.  The function, when invoked,
-            will return True if the log file should be considered closed and no further processing will be needed.
-            The caller should no longer use this processor instance in this case.
-        @rtype: (function(int) that returns a bool, bool)
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: True if the processor is now hibernating.
+        @rtype: bool
         """
-        if current_time is None:
-            current_time = time.time()
+        if self.__read_compressed and self.__file_system.is_compressed_path(self.__path):
+            # The size on disk of a compressed file does not match the number of bytes we read from it.
+            return False
 
-        # If this is our first time processing this log file, just pretend like we had a recent success.
-        if self.__last_success is None:
-            self.__last_success = current_time
+        checkpoint = self.__log_file_iterator.get_checkpoint()
+        pending_files = checkpoint['pending_files']
+        if len(pending_files) != 1 or not pending_files[0]['is_log_file']:
+            return False
 
-        self.__lock.acquire()
-        self.__last_scan_time = current_time
-        self.__lock.release()
+        self.__log_file_iterator.close()
+        self.__log_file_iterator = None
+        self.__dormant_checkpoint = checkpoint
+        self.__hibernation_poll_interval = MIN_HIBERNATION_POLL_INTERVAL
+        self.__next_hibernation_poll_time = current_time + self.__hibernation_poll_interval
+        return True
 
-        self.__log_file_iterator.mark(current_time=current_time)
+    def __poll_while_hibernating(self, current_time):
+        """Checks a hibernating log file for changes, if it is time to, and stops hibernating if it has changed.
 
-        # Check to see if we haven't had a success in enough time.  If so, then we just skip ahead.
-        if current_time - self.__last_success > self.__copy_staleness_threshold:
-            self.skip_to_end('Too long since last success.  Last success was \'%s\'' % scalyr_util.format_time(
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: True if the processor has stopped hibernating and the log file should be processed.
+        @rtype: bool
+        """
+        if current_time < self.__next_hibernation_poll_time:
+            return False
+
+        if self.__dormant_file_changed(current_time):
+            self.__hibernation_poll_interval = None
+            self.__next_hibernation_poll_time = None
+            self.__last_activity_time = current_time
+            return True
+
+        self.__hibernation_poll_interval = min(self.__hibernation_poll_interval * 2,
+                                               self.__max_hibernation_poll_interval)
+        self.__next_hibernation_poll_time = current_time + self.__hibernation_poll_interval
+        return False
+
+    def __dormant_file_changed(self, current_time):
+        """Checks whether the log file of a dormant processor may have bytes to read that its checkpoint does not
+        account for.
+
+        This is only False if the checkpoint is positioned at the end of the file at the log path and that file has
+        not changed size, inode, or modification time since.
+
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: True if the processor should be woken up to read the log file.
+        @rtype: bool
+        """
+        checkpoint = self.__dormant_checkpoint
+        if 'pending_files' not in checkpoint or len(checkpoint['pending_files']) != 1:
+            return True
+        log_file_state = checkpoint['pending_files'][0]
+        if not log_file_state['is_log_file'] or checkpoint['position'] != log_file_state['position_end']:
+            return True
+        if self.__read_compressed and self.__file_system.is_compressed_path(self.__path):
+            # The size on disk of a compressed file does not match the number of bytes we read from it.
+            return True
+
+        try:
+            stat_result = self.__file_system.watched_stat(self.__path, current_time=current_time)
+        except OSError:
+            # Let the iterator sort out where the file went.
+            return True
+
+        if stat_result.st_size != log_file_state['last_known_size']:
+            return True
+        if self.__file_system.trust_inodes and ('inode' not in log_file_state or
+                                                stat_result.st_ino != log_file_state['inode']):
+            return True
+        return ('last_modification_time' in log_file_state and
+                LogFileIterator.FileState.modification_time(stat_result) != log_file_state['last_modification_time'])
+
+    def __create_idle_completion_callback(self, current_time):
+        """
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: The completion callback to return from perform_processing when the log file was not read.
+        @rtype: function(int) that returns a bool
+        """
+        def idle_completion_callback(result):
+            """Invoked by the caller to indicate if the events were successfully sent to server.  Since we did not
+            add any, we only need to note the success.
+
+            @param result: Must be one of SUCCESS, FAIL_AND_DROP, FAIL_AND_RETRY.
+            @type result: int
+            @return: False since the processor is never finished.
+            @rtype: bool
+            """
+            if result == LogFileProcessor.SUCCESS:
+                self.__last_success = current_time
+            return False
+
+        return idle_completion_callback
+
+    def __wake(self):
+        """Restores the iterator from the checkpoint if the processor is dormant, opening the log file."""
+        if self.__log_file_iterator is None:
+            self.__log_file_iterator = LogFileIterator(self.__path, file_system=self.__file_system,
+                                                       checkpoint=self.__dormant_checkpoint, use_mmap=self.__use_mmap,
+                                                       read_compressed=self.__read_compressed)
+            self.__dormant_checkpoint = None
+
+    # Success results for the callback returned by perform_processing.
+    SUCCESS = 1
+    FAIL_AND_DROP = 2
+    FAIL_AND_RETRY = 3
+
+    def perform_processing(self, add_events_request, current_time=None):
+        """Scans the available lines from the log file, processes them using the configured redacters and samplers
+         and appends the lines that emerge to add_events_request.
+
+        @param add_events_request:  The request to add the resulting lines/events to.  This request will
+            eventually be sent to the server.
+        @param current_time:  If not None, the value to use as the current_time.  Used for testing.
+
+        @type add_events_request: scalyr_client.AddEventsRequest
+        @type current_time: float or None
+
+        @return A tuple containing two elements:  a callback function to invoke when the result of sending the
+            events to the server is known, and a bool indicating if the buffer has been filled and could not
+            accept new events.  The call function takes a single argument that is an int which can
+            only have values of SUCCESS, FAIL_AND_DROP, and FAIL_AND_RETRY.  If SUCCESS is passed in, then the
+            events are marked as successfully sent.  If FAIL_AND_DROP is passed in, then the events are
+            marked as consumed but not successfully processed.  If FAIL_AND_RETRY is passed in, then the processor
+            is rolled back and the events will be retried for processing later on.  The function, when invoked,
+            will return True if the log file should be considered closed and no further processing will be needed.
+            The caller should no longer use this processor instance in this case.
+        @rtype: (function(int) that returns a bool, bool)
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        self.__lock.acquire()
+        self.__last_scan_time = current_time
+        self.__lock.release()
+
+        if self.is_hibernating:
+            if not self.__poll_while_hibernating(current_time):
+                return self.__create_idle_completion_callback(current_time), False
+        elif (self.is_dormant and self.__repeated_lines.is_empty() and
+                not self.__dormant_file_changed(current_time)):
+            # There is nothing to read or send, so there is no reason to open the log file yet.
+            return self.__create_idle_completion_callback(current_time), False
+
+        self.__wake()
+
+        # If this is our first time processing this log file, just pretend like we had a recent success.
+        if self.__last_success is None:
+            self.__last_success = current_time
+
+        if self.__rate_limit_bytes_per_second is not None and self.__rate_limiter is None:
+            self.__rate_limiter = scalyr_util.RateLimiter(self.__rate_limit_burst_size,
+                                                          self.__rate_limit_bytes_per_second, current_time=current_time)
+
+        self.__log_file_iterator.mark(current_time=current_time)
+
+        # See if the log file has been idle long enough to hibernate.
+        if self.__last_activity_time is None or self.__log_file_iterator.available > 0:
+            self.__last_activity_time = current_time
+        elif (0 < self.__hibernation_threshold <= current_time - self.__last_activity_time and
+                self.__repeated_lines.is_empty() and self.__hibernate(current_time)):
+            return self.__create_idle_completion_callback(current_time), False
+
+        # Check to see if we haven't had a success in enough time.  If so, then we skip ahead to the recent content.
+        if current_time - self.__last_success > self.__copy_staleness_threshold:
+            self.skip_to_recent('Too long since last success.  Last success was \'%s\'' % scalyr_util.format_time(
                 self.__last_success), 'skipForStaleness', current_time=current_time)
         # Also make sure we are at least within 5MB of the tail of the log.  If not, then we skip ahead.
         elif self.__log_file_iterator.available > self.__max_log_offset_size:
-            self.skip_to_end(
+            self.skip_to_recent(
                 'Too far behind end of log.  Num of bytes to end is %ld' % self.__log_file_iterator.available,
                 'skipForTooFarBehind', current_time=current_time)
 
+        if self.__adaptive_sampling_threshold > 0 or self.__adaptive_sampling_rate < 1.0:
+            self.__update_adaptive_sampling_rate(current_time)
+
+        # There is nothing worth caching if there are no rules.
+        rule_cache = self.__rule_cache
+        if self.__rules.is_empty():
+            rule_cache = None
+
         # Keep track of both the position in the iterator and where we are about to add new events to the request,
         # in case we have to roll it back.
         original_position = self.__log_file_iterator.tell()
         original_events_position = add_events_request.position()
+        # Any changes to the repeated lines before this point were either sent or rolled back.
+        self.__repeated_lines.commit()
+        original_repeated_lines_mark = self.__repeated_lines.mark()
 
         # noinspection PyBroadException
         try:
@@ -1185,56 +2282,197 @@ class LogFileProcessor(object):
             total_redactions = 0L
             lines_dropped_by_sampling = 0L
             bytes_dropped_by_sampling = 0L
+            lines_dropped_by_rate_limit = 0L
+            bytes_dropped_by_rate_limit = 0L
+
+            # The rate limiter is only charged for the lines once the request holding them has been sent (see
+            # completion_callback), so that it does not have to be refunded if they are rolled back.  Until then, we
+            # keep track of how much of what was available when we started has been used.
+            rate_limit_available = None
+            if self.__rate_limiter is not None:
+                rate_limit_available = self.__rate_limiter.get_available(current_time=current_time)
+            rate_limit_used = 0
 
             buffer_filled = False
             added_thread_id = False
 
-            # Keep looping, add more events until there are no more or there is no more room.
-            while True:
-                position = self.__log_file_iterator.tell()
-
-                line = self.__log_file_iterator.readline(current_time=current_time)
+            # If lines are being coalesced, the batch of lines waiting to be sent as a single event.  If the batch
+            # does not fit into the request, we roll back to batch_start_state, the position of its first line along
+            # with the mark for the repeated lines and the counters from just before it.
+            batch = None
+            if self.__coalesce_max_lines > 0:
+                batch = LineBatch(self.__coalesce_max_lines, self.__coalesce_max_bytes)
+            batch_start_state = None
+            batch_failed = False
 
-                # This means we hit the end of the file, or at least there is not a new line yet available.
-                if len(line) == 0:
-                    break
-
-                # We have a line, process it and see what comes out.
+            # Keep looping, add more events until there are no more or there is no more room.
+            for (line, escaped_line, position, line_count, processed) in self.__read_events(current_time):
+                # We have a line, process it and see what comes out.  If multi-line events are being assembled,
+                # the "line" may actually hold several lines.
                 bytes_read += len(line)
-                lines_read += 1L
-
-                sample_result = self.__sampler.process_line(line)
+                lines_read += line_count
+
+                # If the rules were already applied to the line by the line processing pool, just use the results.
+                # Otherwise, if the line was seen recently, reuse the results of its regular expressions.  The sampling
+                # decision itself is still made for each line.
+                original_line = line
+                cached_result = None
+                if processed is None:
+                    if rule_cache is not None:
+                        cached_result = rule_cache.lookup(line)
+                    if cached_result is None:
+                        sample_result = self.__sampler.process_line(line)
+                    else:
+                        if cached_result.rule_match is None:
+                            cached_result.rule_match = self.__sampler.find_rule(line)
+                        sample_result = self.__sampler.sample(cached_result.rule_match)
+                else:
+                    # Only count the rules for the lines actually used, since the rest of the page may be read again.
+                    sample_result = processed[0]
+                    if processed[3] is not None:
+                        self.__sampler.add_counters(processed[3])
                 if sample_result is None:
-                    lines_dropped_by_sampling += 1L
+                    lines_dropped_by_sampling += line_count
                     bytes_dropped_by_sampling += len(line)
                     continue
 
-                (line, redacted) = self.__redacter.process_line(line)
+                # If we are sampling to catch up with a backlog, the line must pass that sampling as well.  The
+                # event's sample rate is the combined rate so that the server can weight it correctly.
+                if self.__adaptive_sampler is not None:
+                    adaptive_sample_result = self.__adaptive_sampler.process_line(line)
+                    if adaptive_sample_result is None:
+                        lines_dropped_by_sampling += line_count
+                        bytes_dropped_by_sampling += len(line)
+                        continue
+                    sample_result *= adaptive_sample_result
+
+                # Drop the line if the log is being written faster than its rate limit allows, so that it cannot
+                # crowd out the other logs.  A line longer than the burst size is charged as if it were the burst
+                # size, otherwise it could never be copied.
+                rate_limit_cost = 0
+                if rate_limit_available is not None:
+                    rate_limit_cost = min(len(line), self.__rate_limit_burst_size)
+                    if rate_limit_used + rate_limit_cost > rate_limit_available:
+                        lines_dropped_by_rate_limit += line_count
+                        bytes_dropped_by_rate_limit += len(line)
+                        continue
+
+                if cached_result is not None and cached_result.redaction is not None:
+                    (line, redacted, redacted_escaped_line) = cached_result.redaction
+                    if redacted:
+                        escaped_line = redacted_escaped_line
+                elif processed is None:
+                    (line, redacted) = self.__redacter.process_line(line)
+                    # If the line was changed by redaction, we have to escape it again.
+                    if redacted:
+                        escaped_line = json_lib.escape_lines([line])[0]
+                        if cached_result is not None:
+                            cached_result.redaction = (line, True, escaped_line)
+                    elif cached_result is not None:
+                        cached_result.redaction = (line, False, None)
+                else:
+                    if processed[4] is not None:
+                        self.__redacter.add_counters(processed[4])
+                    if processed[1] is not None:
+                        (_, line, escaped_line, _, _) = processed
+                        redacted = True
+                    else:
+                        redacted = False
 
-                if len(line) > 0:
-                    # Try to add the line to the request, but it will let us know if it exceeds the limit it can
-                    # send.
-                    if not add_events_request.add_event(self.__create_events_object(line, sample_result)):
-                        self.__log_file_iterator.seek(position)
-                        buffer_filled = True
-                        break
+                # Collapse repeats of the lines copied within the dedup window.  This is done last so that only the
+                # lines that would have been sent are counted.
+                if (self.__dedup_window > 0 and len(line) > 0 and
+                        self.__repeated_lines.count_repeat(escaped_line, sample_result, current_time)):
+                    continue
 
-                    # Try to add the thread id if we have not done so far.  This should only be added once per file.
-                    if not added_thread_id:
-                        if not add_events_request.add_thread(self.__thread_id, self.__thread_name):
-                            # If we got here, it means we did not have enough room to add both the thread id
-                            # and the event into the events request.  So, we have to remove the event we just
-                            # added to the add_events_request by setting the position to the original.
-                            add_events_request.set_position(original_events_position)
+                if len(line) > 0:
+                    if batch is not None:
+                        # Send the batch once this line would not fit into it.
+                        if not batch.can_add(line, line_count, sample_result):
+                            if not self.__add_batch(add_events_request, batch, not added_thread_id, current_time):
+                                batch_failed = True
+                                break
+                            added_thread_id = True
+                        if batch.is_empty():
+                            batch_start_state = (position, self.__repeated_lines.mark(),
+                                                 (bytes_read - len(original_line), lines_read - line_count,
+                                                  bytes_copied, lines_copied, total_redactions,
+                                                  lines_dropped_by_sampling, bytes_dropped_by_sampling,
+                                                  lines_dropped_by_rate_limit, bytes_dropped_by_rate_limit,
+                                                  rate_limit_used))
+                        batch.add(line, escaped_line, line_count, sample_result)
+                    else:
+                        # If the line holds a JSON object, send its fields as attributes.
+                        escaped_message = escaped_line
+                        extra_attrs = None
+                        if self.__json_line_parser is not None:
+                            parsed = self.__json_line_parser.parse(line)
+                            if parsed is not None:
+                                (json_message, extra_attrs) = parsed
+                                if json_message is not None:
+                                    escaped_message = json_message
+
+                        # Try to add the line to the request, but it will let us know if it exceeds the limit it can
+                        # send.  All of the events get their timestamps from the same time to save looking it up.
+                        if not add_events_request.add_event_from_template(self.__get_event_template(sample_result),
+                                                                          escaped_message, current_time=current_time,
+                                                                          extra_attrs=extra_attrs):
                             self.__log_file_iterator.seek(position)
                             buffer_filled = True
                             break
-                        added_thread_id = True
+
+                        # Try to add the thread id if we have not done so far.  This should only be added once per
+                        # file.
+                        if not added_thread_id:
+                            if not add_events_request.add_thread(self.__thread_id, self.__thread_name):
+                                # If we got here, it means we did not have enough room to add both the thread id
+                                # and the event into the events request.  So, we have to remove the event we just
+                                # added to the add_events_request by setting the position to the original.
+                                add_events_request.set_position(original_events_position)
+                                self.__log_file_iterator.seek(position)
+                                buffer_filled = True
+                                break
+                            added_thread_id = True
+
+                    if self.__dedup_window > 0:
+                        self.__repeated_lines.add(escaped_line, sample_result, current_time)
 
                 if redacted:
                     total_redactions += 1L
                 bytes_copied += len(line)
-                lines_copied += 1
+                lines_copied += line_count
+                rate_limit_used += rate_limit_cost
+
+            if not buffer_filled and not batch_failed and batch is not None and not batch.is_empty():
+                if not self.__add_batch(add_events_request, batch, not added_thread_id, current_time):
+                    batch_failed = True
+                added_thread_id = True
+
+            if batch_failed:
+                # Roll back to the first line in the batch so that it is sent in the next request.
+                (batch_position, batch_repeated_lines_mark,
+                 (bytes_read, lines_read, bytes_copied, lines_copied, total_redactions, lines_dropped_by_sampling,
+                  bytes_dropped_by_sampling, lines_dropped_by_rate_limit, bytes_dropped_by_rate_limit,
+                  rate_limit_used)) = batch_start_state
+                self.__log_file_iterator.seek(batch_position)
+                self.__repeated_lines.rollback(batch_repeated_lines_mark)
+                buffer_filled = True
+
+            # Once the dedup window of a line has passed, send the summary for its repeats, if any.
+            if not buffer_filled:
+                for repeated_line in self.__repeated_lines.get_expired(current_time):
+                    if repeated_line.repeat_count > 0:
+                        events_position = add_events_request.position()
+                        if not self.__add_repeat_summary(add_events_request, repeated_line, current_time):
+                            buffer_filled = True
+                            break
+                        if not added_thread_id:
+                            if not add_events_request.add_thread(self.__thread_id, self.__thread_name):
+                                add_events_request.set_position(events_position)
+                                buffer_filled = True
+                                break
+                            added_thread_id = True
+                    self.__repeated_lines.remove(repeated_line)
 
             final_position = self.__log_file_iterator.tell()
 
@@ -1266,6 +2504,11 @@ class LogFileProcessor(object):
                     # Zero out the bytes we were tracking as they were in flight.
                     self.__total_bytes_being_processed = 0
 
+                    # The lines count against the rate limit unless they are going to be read again.
+                    if (result != LogFileProcessor.FAIL_AND_RETRY and self.__rate_limiter is not None and
+                            rate_limit_used > 0):
+                        self.__rate_limiter.charge(rate_limit_used, current_time=current_time)
+
                     # If it was a success, then we update the counters and advance the iterator.
                     if result == LogFileProcessor.SUCCESS:
                         self.__total_bytes_copied += bytes_copied
@@ -1276,6 +2519,8 @@ class LogFileProcessor(object):
                         self.__total_bytes_pending = self.__log_file_iterator.available
                         self.__total_lines_copied += lines_copied
                         self.__total_lines_dropped_by_sampling += lines_dropped_by_sampling
+                        self.__total_bytes_dropped_by_rate_limit += bytes_dropped_by_rate_limit
+                        self.__total_lines_dropped_by_rate_limit += lines_dropped_by_rate_limit
                         self.__total_redactions += total_redactions
                         self.__last_success = current_time
 
@@ -1294,6 +2539,7 @@ class LogFileProcessor(object):
                         return False
                     elif result == LogFileProcessor.FAIL_AND_RETRY:
                         self.__log_file_iterator.seek(original_position)
+                        self.__repeated_lines.rollback(original_repeated_lines_mark)
                         self.__total_bytes_pending = self.__log_file_iterator.available
                         return False
                     else:
@@ -1313,9 +2559,110 @@ class LogFileProcessor(object):
             # Roll back the positions if something happened.
             self.__log_file_iterator.seek(original_position)
             add_events_request.set_position(original_events_position)
+            self.__repeated_lines.rollback(original_repeated_lines_mark)
 
             return None, False
 
+    def __update_adaptive_sampling_rate(self, current_time):
+        """Adjusts the rate at which lines are sampled to catch up with a backlog, if it is time to.
+
+        The rate is halved while the backlog is over the threshold and is gradually raised back to 1.0 once it is well
+        under it, so the rate settles around the one at which we can keep up with the log.
+
+        @param current_time: The current time.
+        @type current_time: float
+        """
+        if (self.__last_adaptive_sampling_update is not None and
+                current_time - self.__last_adaptive_sampling_update < ADAPTIVE_SAMPLING_UPDATE_INTERVAL):
+            return
+        self.__last_adaptive_sampling_update = current_time
+
+        backlog = self.__log_file_iterator.available
+        rate = self.__adaptive_sampling_rate
+        if 0 < self.__adaptive_sampling_threshold < backlog:
+            rate = max(MIN_ADAPTIVE_SAMPLING_RATE, rate / 2)
+        elif self.__adaptive_sampling_threshold <= 0 or backlog < self.__adaptive_sampling_threshold / 2:
+            # Round away floating point error so that we end up at exactly 1.0.
+            rate = min(1.0, round(rate + ADAPTIVE_SAMPLING_RATE_INCREASE, 6))
+
+        if rate == self.__adaptive_sampling_rate:
+            return
+
+        if rate < self.__adaptive_sampling_rate:
+            log.info('Sampling %.0f%% of the lines of \'%s\' to catch up with a backlog of %ld bytes', rate * 100,
+                     self.__path, backlog)
+        elif rate == 1.0:
+            log.info('No longer sampling the lines of \'%s\' since its backlog has cleared', self.__path)
+
+        self.__lock.acquire()
+        self.__adaptive_sampling_rate = rate
+        self.__lock.release()
+
+        if rate < 1.0:
+            self.__adaptive_sampler = LogLineSampler(self.__path, timing_interval=0)
+            self.__adaptive_sampler.add_rule('', rate)
+        else:
+            self.__adaptive_sampler = None
+        # The templates for the old combined rates will no longer be needed.
+        self.__event_templates = {}
+
+    def __add_batch(self, add_events_request, batch, add_thread, current_time):
+        """Adds the event holding the lines in the batch to the request, and clears the batch if it was added.
+
+        @param add_events_request: The request to add the event to.
+        @param batch: The batch, which must not be empty.
+        @param add_thread: True if the thread for the log file should be added to the request as well.
+        @param current_time: The current time.
+
+        @type add_events_request: scalyr_client.AddEventsRequest
+        @type batch: LineBatch
+        @type add_thread: bool
+        @type current_time: float
+
+        @return: True if the event (and thread) was added, or False if there was not enough room in the request.
+        @rtype: bool
+        """
+        events_position = add_events_request.position()
+        # There is no need to pay for the extra attribute if there is only one event.
+        extra_attrs = None
+        if batch.event_count > 1:
+            extra_attrs = ',"line_count":%d' % batch.line_count
+
+        if not add_events_request.add_event_from_template(self.__get_event_template(batch.sampling_rate),
+                                                          batch.escaped_message, current_time=current_time,
+                                                          extra_attrs=extra_attrs):
+            return False
+        if add_thread and not add_events_request.add_thread(self.__thread_id, self.__thread_name):
+            add_events_request.set_position(events_position)
+            return False
+
+        batch.reset()
+        return True
+
+    def __add_repeat_summary(self, add_events_request, repeated_line, current_time):
+        """Adds the event summarizing the repeats of a copied line to the request.
+
+        The event has the same message and sampling rate as the line, along with the number of repeats and the times
+        of the first and last of them.
+
+        @param add_events_request: The request to add the event to.
+        @param repeated_line: The line whose repeats to summarize.
+        @param current_time: The current time.
+
+        @type add_events_request: scalyr_client.AddEventsRequest
+        @type repeated_line: RepeatedLine
+        @type current_time: float
+
+        @return: True if the event was added, or False if there was not enough room in the request.
+        @rtype: bool
+        """
+        extra_attrs = ',"repeat_count":%s,"repeat_first_time":%s,"repeat_last_time":%s' % (
+            json_lib.serialize(repeated_line.repeat_count), json_lib.serialize(repeated_line.first_time),
+            json_lib.serialize(repeated_line.last_time))
+        return add_events_request.add_event_from_template(self.__get_event_template(repeated_line.sampling_rate),
+                                                          repeated_line.escaped_line, current_time=current_time,
+                                                          extra_attrs=extra_attrs)
+
     def skip_to_end(self, message, error_code, current_time=None):
         """Advances the iterator to the end of the log file due to some error.
 
@@ -1329,6 +2676,7 @@ class LogFileProcessor(object):
         """
         if current_time is None:
             current_time = time.time()
+        self.__wake()
         skipped_bytes = self.__log_file_iterator.advance_to_end()
         self.__log_file_iterator.mark(current_time=current_time)
 
@@ -1339,14 +2687,209 @@ class LogFileProcessor(object):
         log.warn('Skipped copying %ld bytes in \'%s\' due to: %s', skipped_bytes, self.__path, message,
                  error_code=error_code)
 
-    def add_sampler(self, match_expression, sampling_rate):
+    def __read_events(self, current_time):
+        """Generator that reads the available lines from the log file, joining them into multi-line events if an
+        event assembler has been set.
+
+        If the last event may still have continuation lines written to it, the iterator is left positioned at the
+        start of that event so that it will be read again the next time, unless we have been waiting for more
+        than EVENT_COMPLETION_WAIT_TIME seconds.
+
+        If a line processing pool has been set, the sampling and redaction rules are applied to the events by its
+        workers a page at a time.  The counts and times the workers report for each event are left to the caller to
+        add to this processor's sampler and redacter as it uses the event.
+
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: A generator producing tuples of the event's contents, the contents escaped for JSON, the position of
+            the start of the event in the iterator, the number of lines in the event, and the results of applying the
+            rules to the event if that was done by the line processing pool (otherwise None).  See
+            'process_line_batch' for the results.
+        @rtype: generator of (str, str, LogFileIterator.Position, int, tuple or None)
+        """
+        assembler = self.__assembler
+        if assembler is not None:
+            assembler.reset()
+
+        pool = self.__line_processing_pool
+        if pool is not None and self.__rules.is_empty():
+            # There is nothing worth sending to the workers.
+            pool = None
+
+        # We take the lines from the iterator a page at a time to keep the per line overhead down.
+        while True:
+            lines = self.__log_file_iterator.read_lines(max_bytes=READ_PAGE_SIZE, current_time=current_time)
+
+            # This means we hit the end of the file, or at least there is not a new line yet available.
+            if len(lines) == 0:
+                break
+
+            # Escape the whole page at once rather than a line at a time.
+            escaped_lines = json_lib.escape_lines([line for (line, _, _) in lines])
+
+            if pool is None:
+                for i in xrange(len(lines)):
+                    (line, position, _) = lines[i]
+                    if assembler is None:
+                        yield line, escaped_lines[i], position, 1, None
+                    else:
+                        event = assembler.add_line(line, escaped_lines[i], position)
+                        if event is not None:
+                            self.__pending_event_time = None
+                            yield event + (None,)
+                continue
+
+            # Gather the page's events so that they can be sent to the workers together.
+            events = []
+            for i in xrange(len(lines)):
+                (line, position, _) = lines[i]
+                if assembler is None:
+                    events.append((line, escaped_lines[i], position, 1))
+                else:
+                    event = assembler.add_line(line, escaped_lines[i], position)
+                    if event is not None:
+                        self.__pending_event_time = None
+                        events.append(event)
+
+            results = pool.process_lines(self.__rules.specs, self.__path, [event[0] for event in events])
+            for i in xrange(len(events)):
+                if results is None:
+                    yield events[i] + (None,)
+                else:
+                    yield events[i] + (results[i],)
+
+        if assembler is None or not assembler.has_pending_event():
+            return
+
+        if self.__pending_event_time is None:
+            self.__pending_event_time = current_time
+
+        if (current_time - self.__pending_event_time >= EVENT_COMPLETION_WAIT_TIME or
+                self.__log_file_iterator.at_end):
+            self.__pending_event_time = None
+            yield assembler.take_event() + (None,)
+        else:
+            self.__log_file_iterator.seek(assembler.pending_event_position)
+
+    def skip_to_recent(self, message, error_code, current_time=None):
+        """Advances the iterator due to some error so that only the most recently written bytes of the log file
+        remain to be copied.
+
+        Rather than skipping all the way to the end of the log, this keeps the bytes written in the last
+        catch up window (CATCH_UP_WINDOW seconds by default), as long as there are no more than half of the maximum
+        log offset size of them.  This bounds the cost of recovering while still copying a useful window of the log.
+
+        @param message: The error message to include in the log to explain why we had to skip ahead.
+        @param error_code: The error code to include
+        @param current_time: If not None, the value to use as the current time.  Used for testing.
+
+        @type message: str
+        @type error_code: str
+        @type current_time: float
+        """
+        if current_time is None:
+            current_time = time.time()
+        skipped_bytes = self.__log_file_iterator.advance_to_time(current_time - self.__catch_up_window,
+                                                                 max_available=self.__max_log_offset_size / 2,
+                                                                 current_time=current_time)
+        self.__log_file_iterator.mark(current_time=current_time)
+
+        self.__lock.acquire()
+        self.__total_bytes_skipped += skipped_bytes
+        self.__lock.release()
+
+        if skipped_bytes > 0:
+            log.warn('Skipped copying %ld bytes written before %s in \'%s\' due to: %s', skipped_bytes,
+                     scalyr_util.format_time(current_time - self.__catch_up_window), self.__path, message,
+                     error_code=error_code)
+
+    def set_event_start_pattern(self, event_start_pattern, max_event_size=MAX_EVENT_SIZE):
+        """Enables the joining of multi-line events, such as stack traces, into single events.
+
+        Each line that matches event_start_pattern begins a new event, and all following lines that do not match
+        are added to it.  The events are then sampled and redacted as if they were single lines.
+
+        @param event_start_pattern: The regular expression that must match any portion of the first line of each
+            event.
+        @param max_event_size: The maximum size of an event in bytes.  Once an event would exceed this size, a new
+            event is begun.
+        @type event_start_pattern: str
+        @type max_event_size: int
+        """
+        self.__assembler = LogLineAssembler(event_start_pattern, max_event_size)
+
+    def set_rate_limit(self, bytes_per_second, burst_size=None):
+        """Limits the rate at which lines are copied from the log file.  Lines in excess of the limit are dropped.
+
+        @param bytes_per_second: The maximum steady state rate, in bytes per second.
+        @param burst_size: The maximum number of bytes that may be copied in a burst, or None to use bytes_per_second.
+        @type bytes_per_second: float
+        @type burst_size: int or None
+        """
+        if burst_size is None:
+            burst_size = bytes_per_second
+        self.__rate_limit_bytes_per_second = bytes_per_second
+        self.__rate_limit_burst_size = burst_size
+        self.__rate_limiter = None
+
+    def set_json_line_parsing(self, message_field='message', attribute_names=None):
+        """Enables sending the top-level fields of lines holding JSON objects as event attributes.
+
+        See JsonLineParser for details.  Lines are not parsed if they are being coalesced into multi-line events.
+
+        @param message_field: The name of the field holding the message.
+        @param attribute_names: The names of the fields to send as attributes, or None for all of them.
+
+        @type message_field: str
+        @type attribute_names: list of str or None
+        """
+        reserved_names = set(self.__log_attributes.keys())
+        reserved_names.update(['message', 'sample_rate'])
+        self.__json_line_parser = JsonLineParser(message_field=message_field, attribute_names=attribute_names,
+                                                 reserved_names=reserved_names)
+
+    def set_line_coalescing(self, max_lines, max_bytes=MAX_EVENT_SIZE):
+        """Enables packing consecutive lines into a single event, to save the overhead of sending each line's log
+        attributes, timestamp, etc.
+
+        The event's message holds the lines, including their newlines, and it has a ``line_count`` attribute with the
+        number of lines.  Only lines with the same sampling rate are packed together.
+
+        @param max_lines: The maximum number of lines in each event, or 0 to disable.
+        @param max_bytes: The maximum number of bytes of lines in each event.
+        @type max_lines: int
+        @type max_bytes: int
+        """
+        self.__coalesce_max_lines = max_lines
+        self.__coalesce_max_bytes = max_bytes
+
+    def set_dedup_window(self, dedup_window):
+        """Enables collapsing repeated lines into summary events.
+
+        When a copied line is repeated within dedup_window seconds, even with other lines in between, only the first
+        is copied.  The repeats are counted, and once dedup_window seconds have passed since the first line, a single
+        event is sent with the same message and a ``repeat_count`` attribute, along with the times of the first and
+        last repeats as ``repeat_first_time`` and ``repeat_last_time``.  Lines are only compared after sampling, rate
+        limiting, and redaction, and up to MAX_DEDUP_LINES distinct lines are tracked at once.
+
+        @param dedup_window: The maximum number of seconds to collapse repeats over, or 0 to disable.
+        @type dedup_window: float
+        """
+        self.__dedup_window = dedup_window
+        self.__repeated_lines.set_dedup_window(dedup_window)
+
+    def add_sampler(self, match_expression, sampling_rate, key_group=0):
         """Adds a new sampling rule that will be applied after all previously added sampling rules.
 
         @param match_expression: The regular expression that must match any portion of a log line
         @param sampling_rate: The rate to include any line that matches the expression in the results sent to the
             server.
+        @param key_group: If greater than 0, the number of the group in match_expression holding a key, such as a
+            request id, that decides whether or not the line is included.  All lines with the same key are either
+            included or dropped together.
         """
-        self.__sampler.add_rule(match_expression, sampling_rate)
+        self.set_rules(self.__rules.with_sampling_rule(match_expression, sampling_rate, key_group=key_group))
 
     def add_redacter(self, match_expression, replacement):
         """Adds a new redaction rule that will be applied after all previously added redaction rules.
@@ -1356,7 +2899,63 @@ class LogFileProcessor(object):
         @param replacement: The text to replace the matched expression with. You may use \1, \2, etc to use sub
             expressions from the match regular expression.
         """
-        self.__redacter.add_redaction_rule(match_expression, replacement)
+        self.set_rules(self.__rules.with_redaction_rule(match_expression, replacement))
+
+    def set_rules(self, rules):
+        """Sets the sampling and redaction rules to apply to the lines, replacing any that were added before.
+
+        The rules are not copied, so the same instance may be shared by many processors.  The counts of how often each
+        rule was applied are kept separately for each processor.
+
+        @param rules: The rules.
+        @type rules: LogLineRules
+        """
+        self.__rules = rules
+        self.__sampler = LogLineSampler(self.__path, rules=rules)
+        self.__redacter = LogLineRedacter(self.__path, rules=rules)
+        # The cached results are for the old rules.
+        if self.__rule_cache is not None:
+            self.__rule_cache = RuleResultCache(self.__rule_cache.max_size)
+
+    def set_rule_cache_size(self, max_size):
+        """Enables caching the results of applying the sampling and redaction rules to recently seen lines, so that
+        repeats of the same line, such as health checks, do not have to be searched for every rule again.
+
+        The cache turns itself off for a while if too few lines are found in it.
+
+        @param max_size: The maximum number of lines to cache the results for, or 0 to disable.
+        @type max_size: int
+        """
+        if max_size > 0:
+            self.__rule_cache = RuleResultCache(max_size)
+        else:
+            self.__rule_cache = None
+
+    def set_line_processing_pool(self, line_processing_pool):
+        """Sets the pool of worker processes used to apply the sampling and redaction rules to the lines.
+
+        The lines are still read, and the events added to the requests, by the calling thread.  Only pages of lines
+        for logs with sampling or redaction rules are sent to the workers.
+
+        @param line_processing_pool: The pool, or None to apply the rules in the calling thread.
+        @type line_processing_pool: LineProcessingPool or None
+        """
+        self.__line_processing_pool = line_processing_pool
+
+    def __get_event_template(self, sampling_rate):
+        """Returns the template for the events sent with the specified sampling rate.
+
+        @param sampling_rate: The sampling rate that had been used to decide if the event should be sent.
+        @type sampling_rate: float
+
+        @return: The template.
+        @rtype: EventTemplate
+        """
+        template = self.__event_templates.get(sampling_rate)
+        if template is None:
+            template = EventTemplate(self.__create_events_object('', sampling_rate))
+            self.__event_templates[sampling_rate] = template
+        return template
 
     def __create_events_object(self, event_message, sampling_rate):
         """Returns the events object that can be sent to the server for this log to insert the specified message.
@@ -1388,45 +2987,946 @@ class LogFileProcessor(object):
         It is useful to be invoked now and then to sync up the file system state with the in-memory data tracked
         about the file such as its current length.
 
+        Dormant processors are not woken up by this, so their pending byte counts are not known until they have
+        been processed once.
+
         @param current_time: If not None, the value to use as the current time.  Used for testing.
         @type current_time: float
         """
         if current_time is None:
             current_time = time.time()
+        if self.__log_file_iterator is None:
+            self.__lock.acquire()
+            self.__last_scan_time = current_time
+            self.__lock.release()
+            return
         self.__log_file_iterator.scan_for_new_bytes(current_time)
         self.__lock.acquire()
         self.__last_scan_time = current_time
         self.__total_bytes_pending = self.__log_file_iterator.available
         self.__lock.release()
 
-    def get_checkpoint(self):
-        return self.__log_file_iterator.get_checkpoint()
+    def get_checkpoint(self):
+        if self.__log_file_iterator is None:
+            result = self.__dormant_checkpoint
+        else:
+            result = self.__log_file_iterator.get_checkpoint()
+
+        # Include any repeats that have not been sent yet, so their summaries are not lost.
+        repeated_lines = self.__repeated_lines.to_checkpoint()
+        if len(repeated_lines) > 0:
+            result = dict(result.iteritems())
+            result['repeated_lines'] = repeated_lines
+        elif 'repeated_lines' in result:
+            result = dict(result.iteritems())
+            del result['repeated_lines']
+        return result
+
+    @staticmethod
+    def create_checkpoint(initial_position):
+        """Returns a checkpoint object that will begin reading a log file from the specified position.
+
+        @param initial_position: The byte position in the file where copying should begin.
+        """
+        return LogFileIterator.create_checkpoint(initial_position)
+
+    # Variables used to implement the static method ``generate_unique_thread_id``.
+    __thread_id_lock = threading.Lock()
+    __thread_id_counter = 0
+
+    @staticmethod
+    def generate_unique_thread_id():
+        """Generates and returns a unique thread id that has not been issued before by this agent.
+
+        This is used to assign a unique thread id to all events coming from a single LogFileProcessor instance.
+        @rtype: str
+        """
+        LogFileProcessor.__thread_id_lock.acquire()
+        LogFileProcessor.__thread_id_counter += 1
+        new_id = LogFileProcessor.__thread_id_counter
+        LogFileProcessor.__thread_id_lock.release()
+
+        return 'log_%d' % new_id
+
+
+# The sampling and redaction rules used by process_line_batch, keyed by the rules that were passed to it.  This is only
+# used in the worker processes of a LineProcessingPool.
+__worker_rule_sets = {}
+
+
+def process_line_batch(rules_and_lines):
+    """Applies sampling and redaction rules to lines.  This is run by the worker processes of a LineProcessingPool.
+
+    The sampler and redacter for the rules are only created once per worker and reused for later calls with the same
+    rules.
+
+    @param rules_and_lines: A tuple of the rules, the path of the log the lines came from, and the lines.  The rules
+        are a tuple of the sampling rules (each a tuple of the match expression, sampling rate and key group) and the
+        redaction rules (each a tuple of the match expression and the replacement).
+    @type rules_and_lines: ((tuple, tuple), str, list of str)
+
+    @return: A tuple for each line of the sampling rate it should be sent with (or None if it was dropped by
+        sampling), the redacted line, the redacted line escaped for JSON, and the counters returned by 'take_counters'
+        on the sampler and on the redacter for just that line.  The redacted lines are None if the line was not
+        changed by redaction.  The counters are kept per line so that the processor only counts the lines it uses.
+    @rtype: list of (float or None, str or None, str or None, tuple or None, tuple or None)
+    """
+    (rules, log_file_path, lines) = rules_and_lines
+    rule_set = __worker_rule_sets.get(rules)
+    if rule_set is None:
+        line_rules = LogLineRules(rules[0], rules[1])
+        rule_set = (LogLineSampler(log_file_path, rules=line_rules), LogLineRedacter(log_file_path, rules=line_rules))
+        __worker_rule_sets[rules] = rule_set
+
+    (sampler, redacter) = rule_set
+    sampler.set_log_file_path(log_file_path)
+    redacter.set_log_file_path(log_file_path)
+    # Discard anything left over from an earlier call that failed part way through.
+    sampler.take_counters()
+    redacter.take_counters()
+
+    results = []
+    for line in lines:
+        sample_result = sampler.process_line(line)
+        if sample_result is None:
+            results.append((None, None, None, sampler.take_counters(), None))
+            continue
+        (redacted_line, redacted) = redacter.process_line(line)
+        if redacted:
+            results.append((sample_result, redacted_line, json_lib.escape_lines([redacted_line])[0],
+                            sampler.take_counters(), redacter.take_counters()))
+        else:
+            results.append((sample_result, None, None, sampler.take_counters(), redacter.take_counters()))
+    return results
+
+
+class LineProcessingPool(object):
+    """A pool of worker processes that apply the sampling and redaction rules to the lines read by LogFileProcessors.
+
+    Since all of the processors run on the log copier thread, CPU heavy rules would otherwise limit the agent to a single
+    core.  Each page of lines is split among the workers, and the thread waits for all of their results.  If the
+    workers do not finish in time, they are replaced with new ones and the page is processed by the calling thread.
+    """
+
+    # Pages with fewer lines than this are processed by the calling thread, since sending them to the workers costs more
+    # than it saves.
+    MIN_LINES_TO_OFFLOAD = 64
+
+    # The maximum number of seconds to wait for the workers to process a page before processing it in the calling thread.
+    # A page is at most READ_PAGE_SIZE bytes, so this is only hit if the workers are stuck.
+    WORKER_TIMEOUT = 5
+
+    def __init__(self, worker_count):
+        """
+        @param worker_count: The number of worker processes to start.
+        @type worker_count: int
+        """
+        self.__worker_count = worker_count
+        # The pool of workers, or None if they could not be restarted and the lines are processed by the calling thread.
+        self.__pool = LineProcessingPool.__create_pool(worker_count)
+
+    @staticmethod
+    def __create_pool(worker_count):
+        """
+        @param worker_count: The number of worker processes to start.
+        @type worker_count: int
+        @return: A new pool of worker processes.
+        @rtype: multiprocessing.Pool
+        """
+        import multiprocessing
+        # Make sure the workers do not all generate the same random numbers for sampling.
+        return multiprocessing.Pool(processes=worker_count, initializer=random.seed)
+
+    def process_lines(self, rules, log_file_path, lines):
+        """Applies the rules to the lines using the workers.
+
+        @param rules: The rules, as described in 'process_line_batch'.
+        @param log_file_path: The path of the log the lines came from.
+        @param lines: The lines.
+
+        @type rules: (tuple, tuple)
+        @type log_file_path: str
+        @type lines: list of str
+
+        @return: The results for each line, as described in 'process_line_batch', or None if the lines should be
+            processed by the calling thread instead.
+        @rtype: list of (float or None, str or None, str or None, tuple or None, tuple or None) or None
+        """
+        import multiprocessing
+
+        if self.__pool is None or len(lines) < LineProcessingPool.MIN_LINES_TO_OFFLOAD:
+            return None
+
+        chunk_size = (len(lines) + self.__worker_count - 1) / self.__worker_count
+        chunks = [(rules, log_file_path, lines[i:i + chunk_size]) for i in xrange(0, len(lines), chunk_size)]
+        # noinspection PyBroadException
+        try:
+            chunk_results = self.__pool.map_async(process_line_batch, chunks).get(LineProcessingPool.WORKER_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            log.warn('The line processing workers did not finish within %d seconds.  Restarting them and processing '
+                     'the lines directly.', LineProcessingPool.WORKER_TIMEOUT, error_code='lineProcessingPoolTimeout',
+                     limit_once_per_x_secs=60, limit_key='line-processing-pool-timeout')
+            self.__restart()
+            return None
+        except Exception:
+            log.exception('Failed to process lines using the line processing workers.  Processing them directly.',
+                          error_code='lineProcessingPoolFailed')
+            return None
+
+        results = []
+        for chunk_result in chunk_results:
+            results.extend(chunk_result)
+        return results
+
+    def __restart(self):
+        """Replaces the worker processes with new ones, since the current ones may be stuck on a page.  If new ones
+        cannot be started, the lines are processed by the calling thread from now on.
+        """
+        self.close()
+        # noinspection PyBroadException
+        try:
+            self.__pool = LineProcessingPool.__create_pool(self.__worker_count)
+        except Exception:
+            log.exception('Failed to restart the line processing workers.  Lines will be processed directly.',
+                          error_code='lineProcessingPoolFailed')
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.__pool is None:
+            return
+        pool = self.__pool
+        self.__pool = None
+        pool.terminate()
+        pool.join()
+
+
+class JsonLineParser(object):
+    """Lifts the top-level fields of log lines holding JSON objects into event attributes.
+
+    Rather than building the whole object using json_lib's parser, the line is checked with a restricted scanner that
+    only finds the extent of each top-level field.  The fields' serialized values are then copied as is into the event,
+    so nothing has to be decoded or escaped again.  Only fields with string, number, true, false or null values are
+    lifted.
+
+    If the message field holds a string and every other field was lifted, the string is used as the event's message.
+    Otherwise, the whole line is still sent as the message, so that nothing is lost.
+
+    Lines that are not JSON objects, or that the scanner does not accept (such as ones with non-ASCII characters), are
+    not parsed, and should be sent as is.
+    """
+
+    __WHITESPACE = re.compile(r'[ \t\r\n]*')
+    __STRING = re.compile(r'"((?:[^"\\\x00-\x1f\x80-\xff]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*)"')
+    __SCALAR = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null')
+    # Matches the strings and brackets within an object or array, which are all we need to find its end.
+    __NESTED_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+    __NON_ASCII = re.compile(r'[\x80-\xff]')
+
+    def __init__(self, message_field='message', attribute_names=None, reserved_names=()):
+        """
+        @param message_field: The name of the field holding the message.
+        @param attribute_names: The names of the fields to lift into attributes, or None for all of them.
+        @param reserved_names: Names of attributes the events already have.  Fields with these names are not lifted.
+
+        @type message_field: str
+        @type attribute_names: list of str or None
+        @type reserved_names: collection of str
+        """
+        self.__message_field = message_field
+        self.__attribute_names = None
+        if attribute_names is not None:
+            self.__attribute_names = set(attribute_names)
+        self.__reserved_names = set(reserved_names)
+
+    def parse(self, line):
+        """
+        @param line: The line.
+        @type line: str
+
+        @return: None if the line is not a JSON object the scanner accepts.  Otherwise, a tuple of the event's message,
+            already escaped (or None if the whole line should be the message), and the serialized JSON for the lifted
+            fields, each preceded by a comma (see AddEventsRequest.add_event_from_template).
+        @rtype: (str or None, str) or None
+        """
+        if JsonLineParser.__NON_ASCII.search(line) is not None:
+            return None
+
+        fields = self.__scan_object(line)
+        if fields is None:
+            return None
+
+        message = None
+        all_lifted = True
+        extra_attrs = []
+        for (name, value, is_scalar) in fields:
+            if name == self.__message_field and value.startswith('"'):
+                message = value[1:-1]
+            elif (is_scalar and '\\' not in name and name not in self.__reserved_names and
+                    (self.__attribute_names is None or name in self.__attribute_names)):
+                extra_attrs.append(',"%s":%s' % (name, value))
+            else:
+                all_lifted = False
+
+        if not all_lifted:
+            message = None
+        return message, ''.join(extra_attrs)
+
+    def __scan_object(self, line):
+        """
+        @param line: The line.
+        @type line: str
+
+        @return: The top-level fields of the object in the line, as tuples of the field's name (still escaped), its
+            serialized value, and whether or not the value is a string, number, true, false or null.  None if the line
+            does not hold a single object.
+        @rtype: list of (str, str, bool) or None
+        """
+        pos = JsonLineParser.__WHITESPACE.match(line).end()
+        if line[pos:pos + 1] != '{':
+            return None
+        pos = JsonLineParser.__WHITESPACE.match(line, pos + 1).end()
+
+        fields = []
+        if line[pos:pos + 1] != '}':
+            while True:
+                name_match = JsonLineParser.__STRING.match(line, pos)
+                if name_match is None:
+                    return None
+                pos = JsonLineParser.__WHITESPACE.match(line, name_match.end()).end()
+                if line[pos:pos + 1] != ':':
+                    return None
+                pos = JsonLineParser.__WHITESPACE.match(line, pos + 1).end()
+
+                (value_end, is_scalar) = self.__scan_value(line, pos)
+                if value_end is None:
+                    return None
+                fields.append((name_match.group(1), line[pos:value_end], is_scalar))
+
+                pos = JsonLineParser.__WHITESPACE.match(line, value_end).end()
+                if line[pos:pos + 1] == '}':
+                    break
+                if line[pos:pos + 1] != ',':
+                    return None
+                pos = JsonLineParser.__WHITESPACE.match(line, pos + 1).end()
+
+        # Nothing but whitespace may follow the object.
+        if JsonLineParser.__WHITESPACE.match(line, pos + 1).end() != len(line):
+            return None
+        return fields
+
+    def __scan_value(self, line, pos):
+        """
+        @param line: The line.
+        @param pos: The position of the start of the value.
+
+        @type line: str
+        @type pos: int
+
+        @return: The position just after the end of the value (or None if it is not valid) and whether or not it is a
+            string, number, true, false or null.
+        @rtype: (int or None, bool)
+        """
+        first = line[pos:pos + 1]
+        if first == '"':
+            match = JsonLineParser.__STRING.match(line, pos)
+        elif first == '{' or first == '[':
+            return self.__scan_nested_value(line, pos), False
+        else:
+            match = JsonLineParser.__SCALAR.match(line, pos)
+
+        if match is None:
+            return None, True
+        return match.end(), True
+
+    def __scan_nested_value(self, line, pos):
+        """Finds the end of the object or array starting at pos by matching its brackets.
+
+        The contents are not otherwise validated, since they are only ever sent as part of the whole line.
+
+        @param line: The line.
+        @param pos: The position of the opening bracket.
+
+        @type line: str
+        @type pos: int
+
+        @return: The position just after the closing bracket, or None if the brackets do not match.
+        @rtype: int or None
+        """
+        expected_closers = []
+        for match in JsonLineParser.__NESTED_TOKEN.finditer(line, pos):
+            token = match.group(0)
+            if token == '{':
+                expected_closers.append('}')
+            elif token == '[':
+                expected_closers.append(']')
+            elif token == '}' or token == ']':
+                if len(expected_closers) == 0 or expected_closers.pop() != token:
+                    return None
+                if len(expected_closers) == 0:
+                    return match.end()
+        return None
+
+
+class LineBatch(object):
+    """Collects consecutive lines copied from a log file so that they can be sent to the server as a single event.
+
+    Lines are only collected together if they have the same sampling rate.
+    """
+
+    def __init__(self, max_lines, max_bytes):
+        """
+        @param max_lines: The maximum number of lines in the batch.
+        @param max_bytes: The maximum number of bytes of lines in the batch.  A single line larger than this is still
+            accepted by an empty batch.
+
+        @type max_lines: int
+        @type max_bytes: int
+        """
+        self.__max_lines = max_lines
+        self.__max_bytes = max_bytes
+        self.__escaped_lines = []
+        self.__size = 0
+        # The total number of lines in the batch.  This may be larger than the number of events added to it if
+        # multi-line events are being assembled.
+        self.line_count = 0
+        # The sampling rate shared by all of the lines.
+        self.sampling_rate = None
+
+    def can_add(self, line, line_count, sampling_rate):
+        """
+        @param line: The line.
+        @param line_count: The number of lines in it.
+        @param sampling_rate: The sampling rate it is being copied with.
+
+        @type line: str
+        @type line_count: int
+        @type sampling_rate: float
+
+        @return: True if the line may be added to the batch without exceeding its limits.
+        @rtype: bool
+        """
+        if len(self.__escaped_lines) == 0:
+            return True
+        return (sampling_rate == self.sampling_rate and self.line_count + line_count <= self.__max_lines and
+                self.__size + len(line) <= self.__max_bytes)
+
+    def add(self, line, escaped_line, line_count, sampling_rate):
+        """Adds the line to the batch.
+
+        @param line: The line.
+        @param escaped_line: The JSON escaped form of the line.
+        @param line_count: The number of lines in it.
+        @param sampling_rate: The sampling rate it is being copied with.
+
+        @type line: str
+        @type escaped_line: str
+        @type line_count: int
+        @type sampling_rate: float
+        """
+        self.__escaped_lines.append(escaped_line)
+        self.__size += len(line)
+        self.line_count += line_count
+        self.sampling_rate = sampling_rate
+
+    def is_empty(self):
+        """
+        @return: True if no lines have been added since the batch was last reset.
+        @rtype: bool
+        """
+        return len(self.__escaped_lines) == 0
+
+    @property
+    def event_count(self):
+        """
+        @return: The number of times 'add' was called since the batch was last reset.
+        @rtype: int
+        """
+        return len(self.__escaped_lines)
+
+    @property
+    def escaped_message(self):
+        """
+        @return: The JSON escaped form of all of the lines in the batch, concatenated together.
+        @rtype: str
+        """
+        return ''.join(self.__escaped_lines)
+
+    def reset(self):
+        """Removes all lines from the batch."""
+        self.__escaped_lines = []
+        self.__size = 0
+        self.line_count = 0
+        self.sampling_rate = None
+
+
+class RepeatedLine(object):
+    """Tracks the repeats of a line copied from a log file, so they can be sent as a single summary event."""
+
+    def __init__(self, escaped_line, sampling_rate, current_time):
+        """
+        @param escaped_line: The JSON escaped form of the line that was copied, after any redaction.
+        @param sampling_rate: The sampling rate the line was copied with.
+        @param current_time: The time the line was copied.
+
+        @type escaped_line: str
+        @type sampling_rate: float
+        @type current_time: float
+        """
+        self.escaped_line = escaped_line
+        self.sampling_rate = sampling_rate
+        self.repeat_count = 0
+        self.first_time = current_time
+        self.last_time = current_time
+
+    @property
+    def key(self):
+        """
+        @return: The key identifying the repeats of this line.  Only lines copied with the same sampling rate are
+            counted as repeats, so that the summary can carry that rate.
+        @rtype: (str, float)
+        """
+        return self.escaped_line, self.sampling_rate
+
+    def to_checkpoint(self):
+        """
+        @return: The state to store in the log's checkpoint.
+        @rtype: dict
+        """
+        return {'escaped_line': self.escaped_line, 'sampling_rate': self.sampling_rate,
+                'repeat_count': self.repeat_count, 'first_time': self.first_time, 'last_time': self.last_time}
+
+    @staticmethod
+    def from_checkpoint(checkpoint):
+        """
+        @param checkpoint: The state returned by 'to_checkpoint'.
+        @type checkpoint: dict
+
+        @return: The restored instance.
+        @rtype: RepeatedLine
+        """
+        escaped_line = checkpoint['escaped_line']
+        # The JSON parser returns unicode strings, but the escaped line is written as is into the request's buffer.
+        if isinstance(escaped_line, unicode):
+            escaped_line = escaped_line.encode('utf-8')
+        result = RepeatedLine(escaped_line, checkpoint['sampling_rate'], checkpoint['first_time'])
+        result.repeat_count = checkpoint['repeat_count']
+        result.last_time = checkpoint['last_time']
+        return result
+
+
+class RepeatedLineTracker(object):
+    """Tracks the lines recently copied from a log file so that their repeats within the dedup window can be collapsed
+    into summary events.
+
+    Each line is tracked from when it is first copied until dedup_window seconds later, so repeats are collapsed even
+    when other lines are interleaved with them.  Lines are compared after sampling, rate limiting, and redaction, so
+    only lines that would have been sent as is are counted as repeats.
+
+    Changes are recorded in a journal so that they can be rolled back to a mark when the lines that caused them are
+    going to be read again, such as when a request must be retried.
+    """
+
+    def __init__(self, dedup_window=0, max_lines=MAX_DEDUP_LINES):
+        """
+        @param dedup_window: The number of seconds after a line is first copied during which its repeats are counted.
+        @param max_lines: The maximum number of lines to track at once.
+
+        @type dedup_window: float
+        @type max_lines: int
+        """
+        self.__dedup_window = dedup_window
+        self.__max_lines = max_lines
+        # Maps the key of each tracked line to its RepeatedLine.
+        self.__lines = {}
+        # The changes made since the last commit, as tuples whose first element is the kind of change.  Used to undo
+        # them in rollback.
+        self.__journal = []
+
+    def set_dedup_window(self, dedup_window):
+        """
+        @param dedup_window: The number of seconds after a line is first copied during which its repeats are counted.
+        @type dedup_window: float
+        """
+        self.__dedup_window = dedup_window
+
+    def is_empty(self):
+        """
+        @return: True if no lines are being tracked.
+        @rtype: bool
+        """
+        return len(self.__lines) == 0
+
+    def count_repeat(self, escaped_line, sampling_rate, current_time):
+        """Counts the line as a repeat if an identical line was copied within the dedup window.
+
+        @param escaped_line: The JSON escaped form of the line, after any redaction.
+        @param sampling_rate: The sampling rate the line would be copied with.
+        @param current_time: The current time.
+
+        @type escaped_line: str
+        @type sampling_rate: float
+        @type current_time: float
+
+        @return: True if the line is a repeat and should not be copied.
+        @rtype: bool
+        """
+        repeated_line = self.__lines.get((escaped_line, sampling_rate))
+        if repeated_line is None or current_time - repeated_line.first_time >= self.__dedup_window:
+            return False
+        self.__journal.append(('repeat', repeated_line, repeated_line.last_time))
+        repeated_line.repeat_count += 1
+        repeated_line.last_time = current_time
+        return True
+
+    def add(self, escaped_line, sampling_rate, current_time):
+        """Starts tracking the repeats of a line that was just copied.
+
+        This does nothing if the maximum number of lines are already being tracked, or the line is still being tracked
+        because the summary for its repeats has not been sent yet.
+
+        @param escaped_line: The JSON escaped form of the line, after any redaction.
+        @param sampling_rate: The sampling rate the line was copied with.
+        @param current_time: The current time.
+
+        @type escaped_line: str
+        @type sampling_rate: float
+        @type current_time: float
+        """
+        key = (escaped_line, sampling_rate)
+        existing = self.__lines.get(key)
+        if existing is not None:
+            if existing.repeat_count > 0:
+                return
+            self.remove(existing)
+        elif len(self.__lines) >= self.__max_lines:
+            return
+        self.__lines[key] = RepeatedLine(escaped_line, sampling_rate, current_time)
+        self.__journal.append(('add', key))
+
+    def get_expired(self, current_time):
+        """
+        @param current_time: The current time.
+        @type current_time: float
+
+        @return: The tracked lines whose dedup window has passed, in the order they were first copied.  They should
+            be passed to 'remove' once their summary, if any, has been sent.
+        @rtype: list of RepeatedLine
+        """
+        result = []
+        for repeated_line in self.__lines.itervalues():
+            if current_time - repeated_line.first_time >= self.__dedup_window:
+                result.append(repeated_line)
+        result.sort(key=lambda x: x.first_time)
+        return result
+
+    def remove(self, repeated_line):
+        """Stops tracking the line.
+
+        @param repeated_line: The line, as returned by 'get_expired'.
+        @type repeated_line: RepeatedLine
+        """
+        del self.__lines[repeated_line.key]
+        self.__journal.append(('remove', repeated_line))
+
+    def mark(self):
+        """
+        @return: A mark that can be passed to 'rollback' to undo all changes made after this point.
+        @rtype: int
+        """
+        return len(self.__journal)
+
+    def rollback(self, mark):
+        """Undoes all changes made since the mark was returned.
+
+        @param mark: The value returned by 'mark' since the last commit.
+        @type mark: int
+        """
+        while len(self.__journal) > mark:
+            change = self.__journal.pop()
+            if change[0] == 'repeat':
+                change[1].repeat_count -= 1
+                change[1].last_time = change[2]
+            elif change[0] == 'add':
+                del self.__lines[change[1]]
+            else:
+                self.__lines[change[1].key] = change[1]
+
+    def commit(self):
+        """Forgets the changes made so far, so they can no longer be rolled back."""
+        self.__journal = []
+
+    def to_checkpoint(self):
+        """
+        @return: The state of the lines with repeats whose summary has not been sent, to store in the log's checkpoint.
+        @rtype: list of dict
+        """
+        result = []
+        for repeated_line in self.__lines.itervalues():
+            if repeated_line.repeat_count > 0:
+                result.append(repeated_line.to_checkpoint())
+        return result
+
+    def restore(self, checkpoint):
+        """Starts tracking the lines recorded in the checkpoint.
+
+        @param checkpoint: The state returned by 'to_checkpoint'.
+        @type checkpoint: list of dict
+        """
+        for state in checkpoint:
+            repeated_line = RepeatedLine.from_checkpoint(state)
+            self.__lines[repeated_line.key] = repeated_line
+
+
+class LogLineAssembler(object):
+    """Joins the lines of multi-line events, such as stack traces, into single events.
+
+    An event begins with a line that matches the event start pattern and includes all of the following lines that do
+    not match it (the continuation lines).  Since the end of an event is only known once the next one begins, the
+    last event added is held as the pending event until either a new event begins or take_event is invoked.
+    """
+
+    def __init__(self, event_start_pattern, max_event_size):
+        """Initializes an instance.
+
+        @param event_start_pattern: The regular expression that must match any portion of the first line of each
+            event.
+        @param max_event_size: The maximum size of an event in bytes.  If adding a continuation line would make the
+            event larger than this, then the line begins a new event instead.
+
+        @type event_start_pattern: str
+        @type max_event_size: int
+        """
+        self.__event_start_expression = re.compile(event_start_pattern)
+        self.__max_event_size = max_event_size
+        # The lines in the pending event, and their escaped forms.
+        self.__lines = []
+        self.__escaped_lines = []
+        # The total number of bytes in __lines.
+        self.__size = 0
+        # The position in the iterator of the first line in the pending event.
+        self.pending_event_position = None
+
+    def add_line(self, line, escaped_line, position):
+        """Adds the next line read from the log file.
+
+        @param line: The line.
+        @param escaped_line: The line, escaped for JSON.
+        @param position: The position of the start of the line.
+
+        @type line: str
+        @type escaped_line: str
+        @type position: LogFileIterator.Position
+
+        @return: If the line completed the pending event, then a tuple of the event's contents, its escaped contents,
+            its position, and the number of lines in it.  Otherwise, None.
+        @rtype: (str, str, LogFileIterator.Position, int) or None
+        """
+        result = None
+        if len(self.__lines) > 0 and (self.__size + len(line) > self.__max_event_size or
+                                      self.__event_start_expression.search(line) is not None):
+            result = self.take_event()
+
+        if len(self.__lines) == 0:
+            self.pending_event_position = position
+        self.__lines.append(line)
+        self.__escaped_lines.append(escaped_line)
+        self.__size += len(line)
+        return result
+
+    def has_pending_event(self):
+        """
+        @return: True if there is an event that has not been returned yet.
+        @rtype: bool
+        """
+        return len(self.__lines) > 0
+
+    def take_event(self):
+        """Returns the pending event, regardless of whether or not it has been completed.
+
+        @return: A tuple of the event's contents, its escaped contents, its position, and the number of lines in it.
+            None if there is no pending event.
+        @rtype: (str, str, LogFileIterator.Position, int) or None
+        """
+        if len(self.__lines) == 0:
+            return None
+        result = (''.join(self.__lines), ''.join(self.__escaped_lines), self.pending_event_position,
+                  len(self.__lines))
+        self.reset()
+        return result
+
+    def reset(self):
+        """Discards the pending event."""
+        self.__lines = []
+        self.__escaped_lines = []
+        self.__size = 0
+        self.pending_event_position = None
+
+
+class RuleResultCache(object):
+    """A bounded cache of the results of applying the sampling and redaction rules to recently seen lines.
+
+    Logs often repeat the exact same line, such as for health checks, and the regular expressions give the same results
+    for each repeat.  To keep the bookkeeping cheap, the cache is approximately least recently used:  lines are added
+    to the current generation, and once it is full, it becomes the previous generation and the oldest one is dropped.
+    A line found in the previous generation is moved back to the current one.
+
+    Since looking lines up and storing them is not free, the cache turns itself off for OFF_INTERVAL lines whenever
+    fewer than MIN_HIT_RATE of the last CHECK_INTERVAL lines were found in it.
+    """
+
+    # The number of lookups between checks of the hit rate.
+    CHECK_INTERVAL = 1000
+    # The fraction of lookups that must be hits to keep the cache on.
+    MIN_HIT_RATE = 0.2
+    # The number of lines to skip the cache for once it is turned off.
+    OFF_INTERVAL = 100000
+
+    def __init__(self, max_size):
+        """
+        @param max_size: The maximum number of lines to hold results for.
+        @type max_size: int
+        """
+        self.max_size = max_size
+        self.__generation_size = max(max_size / 2, 1)
+        self.__current = {}
+        self.__previous = {}
+        self.hits = 0L
+        self.misses = 0L
+        # The number of lookups and hits since the hit rate was last checked.
+        self.__lookups_since_check = 0
+        self.__hits_since_check = 0
+        # The number of lines left to skip while the cache is off.
+        self.__lines_until_on = 0
+
+    def is_enabled(self):
+        """
+        @return: True if the cache is currently on.
+        @rtype: bool
+        """
+        return self.__lines_until_on == 0
+
+    def lookup(self, line):
+        """Returns the cached results for the line.
+
+        If the line is not in the cache, empty results are added for it, which the caller fills in as the rules are
+        applied.
+
+        @param line: The line.
+        @type line: str
+
+        @return: The results, or None if the cache is off.
+        @rtype: CachedRuleResult or None
+        """
+        if self.__lines_until_on > 0:
+            self.__lines_until_on -= 1
+            return None
+
+        result = self.__current.get(line)
+        if result is None:
+            result = self.__previous.pop(line, None)
+            if result is not None:
+                self.__store(line, result)
+
+        if result is not None:
+            self.hits += 1L
+            self.__hits_since_check += 1
+        else:
+            self.misses += 1L
+            result = CachedRuleResult()
+            self.__store(line, result)
+
+        self.__lookups_since_check += 1
+        if self.__lookups_since_check >= RuleResultCache.CHECK_INTERVAL:
+            if self.__hits_since_check < RuleResultCache.MIN_HIT_RATE * self.__lookups_since_check:
+                self.__lines_until_on = RuleResultCache.OFF_INTERVAL
+                self.__current = {}
+                self.__previous = {}
+            self.__lookups_since_check = 0
+            self.__hits_since_check = 0
+        return result
+
+    def __store(self, line, result):
+        """Adds the results for the line to the current generation, starting a new one if it is full.
+
+        @param line: The line.
+        @param result: The results.
+        @type line: str
+        @type result: CachedRuleResult
+        """
+        if len(self.__current) >= self.__generation_size:
+            self.__previous = self.__current
+            self.__current = {}
+        self.__current[line] = result
+
+
+class CachedRuleResult(object):
+    """The results of applying the sampling and redaction rules to a line, for RuleResultCache.
+
+    Each is filled in when it is first needed, since lines dropped by sampling are never redacted.
+    """
+
+    def __init__(self):
+        # The index of the first sampling rule to match the line (or -1 if none did) and its sampling key, as returned
+        # by LogLineSampler.find_rule, or None if not known yet.
+        self.rule_match = None
+        # A tuple of the redacted line, whether or not it was changed, and the redacted line escaped for JSON if it
+        # was changed, or None if not known yet.
+        self.redaction = None
+
 
-    @staticmethod
-    def create_checkpoint(initial_position):
-        """Returns a checkpoint object that will begin reading a log file from the specified position.
+class LogLineRules(object):
+    """The compiled sampling and redaction rules for the lines of a log.
 
-        @param initial_position: The byte position in the file where copying should begin.
+    Compiling the rules, along with building the matcher used to find the first sampling rule that matches a line, is
+    done once for each log entry in the configuration and shared by all of the processors for the files it matches,
+    since a glob may match thousands of them.  For this reason, instances are never modified once created.  The counts
+    of how often each rule was applied are kept by the LogLineSampler and LogLineRedacter using the rules.
+    """
+
+    def __init__(self, sampling_rules=(), redaction_rules=()):
         """
-        return LogFileIterator.create_checkpoint(initial_position)
+        @param sampling_rules: The sampling rules, each a tuple of the match expression, sampling rate and key group.
+        @param redaction_rules: The redaction rules, each a tuple of the match expression and replacement text.
 
-    # Variables used to implement the static method ``generate_unique_thread_id``.
-    __thread_id_lock = threading.Lock()
-    __thread_id_counter = 0
+        @type sampling_rules: tuple of (str, float, int)
+        @type redaction_rules: tuple of (str, str)
+        """
+        # The rules as a hashable value that can be sent to the workers of a LineProcessingPool.
+        self.specs = (tuple(sampling_rules), tuple(redaction_rules))
+        self.sampling_rules = tuple([SamplingRule(match_expression, sampling_rate, key_group=key_group)
+                                     for (match_expression, sampling_rate, key_group) in sampling_rules])
+        self.redaction_rules = tuple([RedactionRule(match_expression, replacement)
+                                      for (match_expression, replacement) in redaction_rules])
+        # The matcher used to find the first sampling rule that matches a line.
+        self.sampling_matcher = MultiPatternMatcher([rule.match_expression.pattern for rule in self.sampling_rules])
+
+    def is_empty(self):
+        """
+        @return: True if there are no sampling or redaction rules.
+        @rtype: bool
+        """
+        return len(self.sampling_rules) == 0 and len(self.redaction_rules) == 0
 
-    @staticmethod
-    def generate_unique_thread_id():
-        """Generates and returns a unique thread id that has not been issued before by this agent.
+    def with_sampling_rule(self, match_expression, sampling_rate, key_group=0):
+        """
+        @param match_expression: The regular expression that must match any portion of a line to activate the rule.
+        @param sampling_rate: The sampling rate, expressed as a number between 0 and 1 inclusive.
+        @param key_group: If greater than 0, the number of the group in match_expression holding the sampling key.
 
-        This is used to assign a unique thread id to all events coming from a single LogFileProcessor instance.
-        @rtype: str
+        @return: A new instance with the sampling rule appended to these rules.
+        @rtype: LogLineRules
         """
-        LogFileProcessor.__thread_id_lock.acquire()
-        LogFileProcessor.__thread_id_counter += 1
-        new_id = LogFileProcessor.__thread_id_counter
-        LogFileProcessor.__thread_id_lock.release()
+        return LogLineRules(self.specs[0] + ((match_expression, sampling_rate, key_group),), self.specs[1])
 
-        return 'log_%d' % new_id
+    def with_redaction_rule(self, redaction_expression, replacement_text):
+        """
+        @param redaction_expression: The regular expression that must match some portion of the line.
+        @param replacement_text: The text to replace the matched text with.
+
+        @return: A new instance with the redaction rule appended to these rules.
+        @rtype: LogLineRules
+        """
+        return LogLineRules(self.specs[0], self.specs[1] + ((redaction_expression, replacement_text),))
 
 
 class LogLineSampler(object):
@@ -1438,16 +3938,43 @@ class LogLineSampler(object):
     line, then its pass rate is used to determine if that line should be included in the output.  A random number
     is generated and if it is greater than the filter's pass rate, then the line is included.  The first filter that
     matches a line is used.
+
+    A filter may instead name a group of its regular expression to use as a sampling key, such as a request or trace
+    id.  The key is hashed and the line is included if the hash falls below the filter's pass rate, so all lines with
+    the same key are either included or dropped together.
+
+    Since the filters may be combined into a single regular expression, they are timed by searching for each of them
+    on its own in one of every timing_interval lines.  The estimated time is how long each filter would take if it
+    were searched for in every line.
     """
 
-    def __init__(self, log_file_path):
+    def __init__(self, log_file_path, rules=None, timing_interval=RULE_TIMING_INTERVAL):
         """Initializes an instance for a single file.
 
         @param log_file_path: The full path for the log file that the sampler will be applied to.
+        @param rules: The rules holding the sampling rules to apply, which may be shared with other samplers.  If None,
+            there are no rules until they are added with add_rule.
+        @param timing_interval: The rules are timed on one in this many lines.  If 0, they are not timed.
+
+        @type log_file_path: str
+        @type rules: LogLineRules
+        @type timing_interval: int
         """
         self.__log_file_path = log_file_path
-        self.__sampling_rules = []
+        if rules is None:
+            rules = LogLineRules()
+        self.__rules = rules
+        # The number of lines matched and passed by each of the sampling rules.
+        self.rule_matches = [0L] * len(rules.sampling_rules)
+        self.rule_passes = [0L] * len(rules.sampling_rules)
+        # The estimated number of seconds spent on each of the sampling rules.
+        self.rule_times = [0.0] * len(rules.sampling_rules)
         self.total_passes = 0L
+        # Whether or not any of the counts or times have changed since they were last taken by take_counters.
+        self.__counted = False
+        self.__timing_interval = timing_interval
+        # The number of lines left to process before the rules are next timed.
+        self.__lines_until_timing = timing_interval
 
     def process_line(self, input_line):
         """Performs all configured sampling operations on the input line and returns whether or not it should
@@ -1462,42 +3989,164 @@ class LogLineSampler(object):
             it to be included.  Otherwise, None.
         """
 
-        if len(self.__sampling_rules) == 0:
+        return self.sample(self.find_rule(input_line))
+
+    def find_rule(self, input_line):
+        """Returns the index of the first sampling rule that matches the input line, along with the line's sampling key
+        if the rule has one.  The key is taken from the same search that found the rule.
+
+        @param input_line: The input line.
+        @type input_line: str
+
+        @return: The index of the rule (or -1 if no rule matches) and the text of the rule's key group (or None if the
+            rule has no key group or it did not participate in the match).
+        @rtype: (int, str or None)
+        """
+        if len(self.__rules.sampling_rules) == 0:
+            return -1, None
+
+        if self.__timing_interval > 0:
+            self.__lines_until_timing -= 1
+            if self.__lines_until_timing <= 0:
+                self.__lines_until_timing = self.__timing_interval
+                self.__time_rules(input_line)
+
+        first_match = self.__rules.sampling_matcher.find_first_match(input_line)
+        if first_match is None:
+            return -1, None
+
+        (index, match) = first_match
+        key_group = self.__rules.sampling_rules[index].key_group
+        if key_group > 0:
+            # Expressions with groups are never combined with others, so the match is always the rule's own.
+            return index, match.group(key_group)
+        return index, None
+
+    def sample(self, rule_match):
+        """Decides whether or not to keep a line, given the first rule that matches it.
+
+        @param rule_match: The index of the rule and the sampling key returned by find_rule for the line.
+        @type rule_match: (int, str or None)
+
+        @return: The same as process_line.
+        @rtype: float or None
+        """
+        (index, key) = rule_match
+        sampling_rules = self.__rules.sampling_rules
+        if len(sampling_rules) == 0:
             self.total_passes += 1L
+            self.__counted = True
             return 1.0
 
-        sampling_rule = self.__find_first_match(input_line)
-        if sampling_rule is None:
+        if index < 0:
             return 1.0
         else:
-            sampling_rule.total_matches += 1L
-            if self.__flip_biased_coin(sampling_rule.sampling_rate):
-                sampling_rule.total_passes += 1L
+            sampling_rule = sampling_rules[index]
+            self.rule_matches[index] += 1L
+            self.__counted = True
+            if sampling_rule.key_group > 0:
+                keep = self.__hash_key(sampling_rule, key)
+            else:
+                keep = self.__flip_biased_coin(sampling_rule.sampling_rate)
+            if keep:
+                self.rule_passes[index] += 1L
                 self.total_passes += 1L
                 return sampling_rule.sampling_rate
         return None
 
-    def add_rule(self, match_expression, sample_rate):
+    def add_rule(self, match_expression, sample_rate, key_group=0):
         """Appends a new sampling rule.  Any line that contains a match for match expression will be sampled with
         the specified rate.
 
         @param match_expression: The regular expression that much match any part of a line to activie the rule.
         @param sample_rate: The sampling rate, expressed as a number between 0 and 1 inclusive.
+        @param key_group: If greater than 0, the number of the group in match_expression whose text is hashed to
+            decide whether or not to keep the line, rather than a random number.
+        """
+        self.__rules = self.__rules.with_sampling_rule(match_expression, sample_rate, key_group=key_group)
+        self.rule_matches.append(0L)
+        self.rule_passes.append(0L)
+        self.rule_times.append(0.0)
+
+    def set_log_file_path(self, log_file_path):
+        """Sets the path of the log file named in the warnings about slow rules.
+
+        @param log_file_path: The full path for the log file the sampler is being applied to.
+        @type log_file_path: str
         """
-        self.__sampling_rules.append(SamplingRule(match_expression, sample_rate))
+        self.__log_file_path = log_file_path
 
-    def __find_first_match(self, line):
-        """Returns the first sampling rule to match the line, if any.
+    def take_counters(self):
+        """Returns the counts and times accumulated since the last call, and resets them to zero.
 
-        @param line: The input line to match against.
+        This is used by the workers of a LineProcessingPool to report what they did for each line back to the
+        processor's sampler.
 
-        @return: The first sampling rule to match any portion of line.  If none
-            match, then returns None.
+        @return: A tuple of the number of lines matched, passed and the estimated time spent for each of the rules,
+            followed by the total number of lines passed, or None if none of them have changed.
+        @rtype: (list of long, list of long, list of float, long) or None
         """
-        for sampling_rule in self.__sampling_rules:
-            if sampling_rule.match_expression.search(line) is not None:
-                return sampling_rule
-        return None
+        if not self.__counted:
+            return None
+        self.__counted = False
+        result = (self.rule_matches, self.rule_passes, self.rule_times, self.total_passes)
+        rule_count = len(self.__rules.sampling_rules)
+        self.rule_matches = [0L] * rule_count
+        self.rule_passes = [0L] * rule_count
+        self.rule_times = [0.0] * rule_count
+        self.total_passes = 0L
+        return result
+
+    def add_counters(self, counters):
+        """Adds counts and times returned by 'take_counters' on a sampler using the same rules to this one's.
+
+        @param counters: The counters.
+        @type counters: (list of long, list of long, list of float, long)
+        """
+        (rule_matches, rule_passes, rule_times, total_passes) = counters
+        for index in xrange(len(rule_matches)):
+            self.rule_matches[index] += rule_matches[index]
+            self.rule_passes[index] += rule_passes[index]
+            self.rule_times[index] += rule_times[index]
+        self.total_passes += total_passes
+
+    def __time_rules(self, line):
+        """Times a search for each of the sampling rules in the line and adds the estimated times to rule_times.
+
+        @param line: The line.
+        @type line: str
+        """
+        sampling_rules = self.__rules.sampling_rules
+        for index in xrange(len(sampling_rules)):
+            match_expression = sampling_rules[index].match_expression
+            start_time = time.time()
+            match_expression.search(line)
+            elapsed = time.time() - start_time
+            self.rule_times[index] += elapsed * self.__timing_interval
+            if elapsed > SLOW_RULE_THRESHOLD:
+                warn_slow_rule('sampling', match_expression.pattern, self.__log_file_path, elapsed)
+        self.__counted = True
+
+    def __hash_key(self, sampling_rule, key):
+        """Decides whether or not to keep a line matched by a rule with a sampling key by hashing the key.
+
+        A CRC32 is used since it is cheaper to compute than a random number and is the same across processes and
+        hosts, unlike Python's hash.  If the key group did not participate in the match, a random number is used.
+
+        @param sampling_rule: The rule that matched the line.
+        @param key: The text of the rule's key group in the line, or None if it did not participate in the match.
+
+        @type sampling_rule: SamplingRule
+        @type key: str or None
+
+        @return: True if the line should be kept.
+        @rtype: bool
+        """
+        if key is None:
+            return self.__flip_biased_coin(sampling_rule.sampling_rate)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return (zlib.crc32(key) & 0xffffffff) < sampling_rule.key_threshold
 
     def __flip_biased_coin(self, bias):
         """Flip a biased coin and return True if it comes up head.
@@ -1525,11 +4174,177 @@ class LogLineSampler(object):
 class SamplingRule(object):
     """Encapsulates all data for one sampling rule."""
 
-    def __init__(self, match_expression, sampling_rate):
+    def __init__(self, match_expression, sampling_rate, key_group=0):
         self.match_expression = re.compile(match_expression)
         self.sampling_rate = sampling_rate
-        self.total_matches = 0
-        self.total_passes = 0
+        # The group holding the sampling key, or 0 if a random number is used instead.
+        self.key_group = key_group
+        # A line is kept if the 32-bit hash of its key is less than this.
+        self.key_threshold = long(sampling_rate * 0x100000000)
+
+
+class MultiPatternMatcher(object):
+    """Finds the first of a list of regular expressions that matches any portion of a line, using as few regular
+    expression searches as possible.
+
+    Runs of consecutive expressions are combined into a single regular expression.  Each expression becomes a
+    lookahead in an alternation anchored at the start of the line, so the alternatives are still tried in order and
+    the first expression to match anywhere in the line wins, just as if each had been searched for separately.
+    Expressions that cannot safely be combined, such as ones with groups (which may be referred to by number) or
+    inline flags (which would apply to all of the others), are searched for on their own.
+
+    In addition, a literal string that must appear in any match is extracted from each expression where possible.
+    If a line contains none of the literals for a run, the run's expression is not searched at all.
+    """
+
+    # The maximum number of expressions combined into one.  Python's regular expressions only support 100 groups.
+    MAX_COMBINED_EXPRESSIONS = 90
+
+    def __init__(self, match_expressions):
+        """
+        @param match_expressions: The regular expressions, in the order they should be tried.
+        @type match_expressions: list of str
+        """
+        # The runs of expressions.  Each entry is a tuple of the indexes of the expressions in the run, the literals
+        # that at least one of must appear in the line for any of them to match (or None if there is no such
+        # requirement), and the expression to search with.
+        self.__runs = []
+        run = []
+        for index in xrange(len(match_expressions)):
+            match_expression = match_expressions[index]
+            if MultiPatternMatcher.__can_combine(match_expression):
+                run.append(index)
+                if len(run) == MultiPatternMatcher.MAX_COMBINED_EXPRESSIONS:
+                    self.__add_run(match_expressions, run)
+                    run = []
+            else:
+                self.__add_run(match_expressions, run)
+                run = []
+                self.__add_run(match_expressions, [index])
+        self.__add_run(match_expressions, run)
+
+    def find_first(self, line):
+        """
+        @param line: The line to match against.
+        @type line: str
+
+        @return: The index of the first expression to match any portion of the line, or None if none match.
+        @rtype: int or None
+        """
+        first_match = self.find_first_match(line)
+        if first_match is None:
+            return None
+        return first_match[0]
+
+    def find_first_match(self, line):
+        """Like find_first, but also returns the match, so that the groups of the expression can be used without
+        searching for it again.
+
+        @param line: The line to match against.
+        @type line: str
+
+        @return: The index of the first expression to match any portion of the line and its match object, or None if
+            none match.  The match object is None if the expression was combined with others, which is only done for
+            expressions without groups.
+        @rtype: (int, re.MatchObject or None) or None
+        """
+        for (indexes, literals, expression) in self.__runs:
+            if literals is not None:
+                for literal in literals:
+                    if literal in line:
+                        break
+                else:
+                    continue
+
+            if len(indexes) == 1:
+                match = expression.search(line)
+                if match is not None:
+                    return indexes[0], match
+            else:
+                match = expression.match(line)
+                if match is not None:
+                    # Each alternative ends with an empty group, so the last group to match tells us which one it was.
+                    return indexes[match.lastindex - 1], None
+        return None
+
+    def __add_run(self, match_expressions, indexes):
+        """Adds a run of expressions to search for together.
+
+        @param match_expressions: All of the regular expressions.
+        @param indexes: The indexes of the expressions in the run.  If empty, nothing is added.
+
+        @type match_expressions: list of str
+        @type indexes: list of int
+        """
+        if len(indexes) == 0:
+            return
+
+        literals = []
+        for index in indexes:
+            literal = MultiPatternMatcher.extract_required_literal(match_expressions[index])
+            if literal is None:
+                literals = None
+                break
+            literals.append(literal)
+
+        if len(indexes) == 1:
+            expression = re.compile(match_expressions[indexes[0]])
+        else:
+            alternatives = ['(?=[\\s\\S]*?(?:%s))()' % match_expressions[index] for index in indexes]
+            expression = re.compile('(?:%s)' % '|'.join(alternatives))
+        self.__runs.append((indexes, literals, expression))
+
+    @staticmethod
+    def __can_combine(match_expression):
+        """
+        @param match_expression: The regular expression.
+        @type match_expression: str
+        @return: True if the expression can be combined with others into a single regular expression without
+            changing what it matches.
+        @rtype: bool
+        """
+        try:
+            parsed = sre_parse.parse(match_expression)
+        except (sre_constants.error, OverflowError):
+            return False
+        return parsed.pattern.flags == 0 and parsed.pattern.groups == 1
+
+    @staticmethod
+    def extract_required_literal(match_expression):
+        """Returns a string that must appear in any text matched by the regular expression, if one can be found.
+
+        Only the ASCII literal characters at the top level of the expression are considered, and the longest
+        consecutive run of them is returned.  Since it is pure ASCII, the result may be searched for in both str and
+        unicode lines.
+
+        @param match_expression: The regular expression.
+        @type match_expression: str
+        @return: The literal, or None if none could be found.
+        @rtype: str or None
+        """
+        try:
+            parsed = sre_parse.parse(match_expression)
+        except (sre_constants.error, OverflowError):
+            return None
+        if parsed.pattern.flags & (sre_parse.SRE_FLAG_IGNORECASE | sre_parse.SRE_FLAG_LOCALE |
+                                   sre_parse.SRE_FLAG_UNICODE):
+            return None
+
+        best = ''
+        current = []
+        for (op, av) in parsed:
+            if op == sre_constants.LITERAL and av < 128:
+                current.append(chr(av))
+            else:
+                if len(current) > len(best):
+                    best = ''.join(current)
+                current = []
+        if len(current) > len(best):
+            best = ''.join(current)
+
+        if len(best) == 0:
+            return None
+        return best
 
 
 class LogLineRedacter(object):
@@ -1541,16 +4356,38 @@ class LogLineRedacter(object):
     include portions of the matched text using the $1, etc operators from the regular expression.
 
     Redaction rules can match each line multiple times.
+
+    The rules are timed as they are applied to one of every timing_interval lines, and the time taken multiplied by the
+    interval to estimate the total time spent on each.
     """
 
-    def __init__(self, log_file_path):
+    def __init__(self, log_file_path, rules=None, timing_interval=RULE_TIMING_INTERVAL):
         """Initializes an instance for a single file.
 
         @param log_file_path: The full path for the log file that the sampler will be applied to.
+        @param rules: The rules holding the redaction rules to apply, which may be shared with other redacters.  If
+            None, there are no rules until they are added with add_redaction_rule.
+        @param timing_interval: The rules are timed on one in this many lines.  If 0, they are not timed.
+
+        @type log_file_path: str
+        @type rules: LogLineRules
+        @type timing_interval: int
         """
         self.__log_file_path = log_file_path
-        self.__redaction_rules = []
+        if rules is None:
+            rules = LogLineRules()
+        self.__rules = rules
+        # The number of lines redacted by each of the redaction rules, and the number of redactions they made.
+        self.rule_lines = [0] * len(rules.redaction_rules)
+        self.rule_redactions = [0] * len(rules.redaction_rules)
+        # The estimated number of seconds spent on each of the redaction rules.
+        self.rule_times = [0.0] * len(rules.redaction_rules)
         self.total_redactions = 0
+        # Whether or not any of the counts or times have changed since they were last taken by take_counters.
+        self.__counted = False
+        self.__timing_interval = timing_interval
+        # The number of lines left to process before the rules are next timed.
+        self.__lines_until_timing = timing_interval
 
     def process_line(self, input_line):
         """Performs all configured redaction rules on the input line and returns the results.
@@ -1563,13 +4400,36 @@ class LogLineRedacter(object):
             indicating if a redaction was applied.
         """
 
-        if len(self.__redaction_rules) == 0:
+        redaction_rules = self.__rules.redaction_rules
+        if len(redaction_rules) == 0:
             return input_line, False
 
         modified_it = False
 
-        for redaction_rule in self.__redaction_rules:
-            (input_line, redaction) = self.__apply_redaction_rule(input_line, redaction_rule)
+        timed = False
+        if self.__timing_interval > 0:
+            self.__lines_until_timing -= 1
+            if self.__lines_until_timing <= 0:
+                self.__lines_until_timing = self.__timing_interval
+                timed = True
+
+        for index in xrange(len(redaction_rules)):
+            redaction_rule = redaction_rules[index]
+            # Most lines contain none of the sensitive text, so skip the regular expression if the literal text
+            # it requires is not in the line.
+            if redaction_rule.required_literal is not None and redaction_rule.required_literal not in input_line:
+                continue
+            if timed:
+                start_time = time.time()
+                (input_line, redaction) = self.__apply_redaction_rule(input_line, index)
+                elapsed = time.time() - start_time
+                self.rule_times[index] += elapsed * self.__timing_interval
+                self.__counted = True
+                if elapsed > SLOW_RULE_THRESHOLD:
+                    warn_slow_rule('redaction', redaction_rule.redaction_expression.pattern, self.__log_file_path,
+                                   elapsed)
+            else:
+                (input_line, redaction) = self.__apply_redaction_rule(input_line, index)
             modified_it = modified_it or redaction
 
         return input_line, modified_it
@@ -1581,34 +4441,100 @@ class LogLineRedacter(object):
         @param replacement_text: The text to replace the matched text with. May include \1 etc to use a portion of the
             matched text.
         """
-        self.__redaction_rules.append(RedactionRule(redaction_expression, replacement_text))
+        self.__rules = self.__rules.with_redaction_rule(redaction_expression, replacement_text)
+        self.rule_lines.append(0)
+        self.rule_redactions.append(0)
+        self.rule_times.append(0.0)
+
+    def set_log_file_path(self, log_file_path):
+        """Sets the path of the log file named in the warnings about slow rules.
+
+        @param log_file_path: The full path for the log file the redacter is being applied to.
+        @type log_file_path: str
+        """
+        self.__log_file_path = log_file_path
+
+    def take_counters(self):
+        """Returns the counts and times accumulated since the last call, and resets them to zero.
+
+        This is used by the workers of a LineProcessingPool to report what they did for each line back to the
+        processor's redacter.
+
+        @return: A tuple of the number of lines redacted, the number of redactions made and the estimated time spent
+            for each of the rules, followed by the total number of redactions, or None if none of them have changed.
+        @rtype: (list of int, list of int, list of float, int) or None
+        """
+        if not self.__counted:
+            return None
+        self.__counted = False
+        result = (self.rule_lines, self.rule_redactions, self.rule_times, self.total_redactions)
+        rule_count = len(self.__rules.redaction_rules)
+        self.rule_lines = [0] * rule_count
+        self.rule_redactions = [0] * rule_count
+        self.rule_times = [0.0] * rule_count
+        self.total_redactions = 0
+        return result
+
+    def add_counters(self, counters):
+        """Adds counts and times returned by 'take_counters' on a redacter using the same rules to this one's.
 
-    def __apply_redaction_rule(self, line, redaction_rule):
+        @param counters: The counters.
+        @type counters: (list of int, list of int, list of float, int)
+        """
+        (rule_lines, rule_redactions, rule_times, total_redactions) = counters
+        for index in xrange(len(rule_lines)):
+            self.rule_lines[index] += rule_lines[index]
+            self.rule_redactions[index] += rule_redactions[index]
+            self.rule_times[index] += rule_times[index]
+        self.total_redactions += total_redactions
+
+    def __apply_redaction_rule(self, line, index):
         """Applies the specified redaction rule on line and returns the result.
 
         @param line: The input line
-        @param redaction_rule: The redaction rule.
+        @param index: The index of the redaction rule.
 
         @return: A sequence of two elements, the line with the redaction applied (if any) and True or False
             indicating if a redaction was applied.
         """
+        redaction_rule = self.__rules.redaction_rules[index]
         (result, matches) = redaction_rule.redaction_expression.subn(
             redaction_rule.replacement_text, line)
         if matches > 0:
             self.total_redactions += 1
-            redaction_rule.total_lines += 1
-            redaction_rule.total_redactions += matches
+            self.rule_lines[index] += 1
+            self.rule_redactions[index] += matches
+            self.__counted = True
         return result, matches > 0
 
 
+def warn_slow_rule(kind, match_expression, log_file_path, elapsed):
+    """Logs a warning that a rule took more than SLOW_RULE_THRESHOLD seconds to apply to a single line.
+
+    @param kind: The kind of rule, either 'sampling' or 'redaction'.
+    @param match_expression: The rule's regular expression.
+    @param log_file_path: The path of the log the line came from.
+    @param elapsed: The number of seconds the rule took.
+
+    @type kind: str
+    @type match_expression: str
+    @type log_file_path: str
+    @type elapsed: float
+    """
+    log.warn('The %s rule "%s" took %.1f ms to apply to a line from %s, which is over the budget of %.1f ms.  Its '
+             'regular expression may need to be rewritten to avoid backtracking.', kind, match_expression,
+             elapsed * 1000, log_file_path, SLOW_RULE_THRESHOLD * 1000, limit_once_per_x_secs=300,
+             limit_key=('slow-rule-%s-%s' % (kind, match_expression)))
+
+
 class RedactionRule(object):
     """Encapsulates all data for one redaction rule."""
 
     def __init__(self, redaction_expression, replacement_text):
         self.redaction_expression = re.compile(redaction_expression)
         self.replacement_text = replacement_text
-        self.total_lines = 0
-        self.total_redactions = 0
+        # Text that must appear in the line for the expression to match, or None if it could not be determined.
+        self.required_literal = MultiPatternMatcher.extract_required_literal(redaction_expression)
 
 
 class LogMatcher(object):
@@ -1637,6 +4563,14 @@ class LogMatcher(object):
         self.__processors = []
         # The lock that protects the __processor and __last_check vars.
         self.__lock = threading.Lock()
+        # The compiled sampling and redaction rules, shared by the processors for all of the matched files.
+        sampling_rules = []
+        for rule in self.__log_entry_config['sampling_rules']:
+            sampling_rules.append((rule['match_expression'], rule['sampling_rate'], rule['sampling_key_group']))
+        redaction_rules = []
+        for rule in self.__log_entry_config['redaction_rules']:
+            redaction_rules.append((rule['match_expression'], rule['replacement']))
+        self.__rules = LogLineRules(sampling_rules, redaction_rules)
 
     def generate_status(self):
         """
@@ -1659,7 +4593,7 @@ class LogMatcher(object):
         finally:
             self.__lock.release()
 
-    def find_matches(self, existing_processors, previous_state, copy_at_index_zero=False):
+    def find_matches(self, existing_processors, previous_state, copy_at_index_zero=False, file_system=None):
         """Determine if there are any files that match the log file for this matcher that are not
         already handled by other processors, and if so, return a processor for it.
 
@@ -1671,10 +4605,13 @@ class LogMatcher(object):
             then if copy_at_index_zero is True, the file will be processed from the first byte in the file.  Otherwise,
             the processing will skip over all bytes currently in the file and only process bytes added after this
             point.
+        @param file_system: The object the new processors should use to access the file system.  If None, each
+            processor creates its own FileSystem instance.
 
         @type existing_processors: dict of str to LogFileProcessor
         @type previous_state: dict of str to json_lib.JsonObject
         @type copy_at_index_zero: bool
+        @type file_system: FileSystem
 
         @return: A list of the processors to handle the newly matched files.
         @rtype: list of LogFileProcessor
@@ -1693,10 +4630,12 @@ class LogMatcher(object):
             # Only process it if we have permission to read it and it is not already being processed.
             if not matched_file in existing_processors and self.__can_read_file(matched_file):
                 checkpoint_state = None
+                restoring = False
                 # Get the last checkpoint state if it exists.
                 if matched_file in previous_state:
                     checkpoint_state = previous_state[matched_file]
                     del previous_state[matched_file]
+                    restoring = True
                 elif copy_at_index_zero:
                     # If we don't have a checkpoint and we are suppose to start copying the file at index zero,
                     # then create a checkpoint to represent that.
@@ -1709,12 +4648,35 @@ class LogMatcher(object):
                 if 'logfile' not in log_attributes and 'filename' not in log_attributes:
                     log_attributes['logfile'] = matched_file
 
-                # Create the processor to handle this log.
-                new_processor = LogFileProcessor(matched_file, log_attributes, checkpoint=checkpoint_state)
-                for rule in self.__log_entry_config['redaction_rules']:
-                    new_processor.add_redacter(rule['match_expression'], rule['replacement'])
-                for rule in self.__log_entry_config['sampling_rules']:
-                    new_processor.add_sampler(rule['match_expression'], rule['sampling_rate'])
+                # Create the processor to handle this log.  If we are restoring it from a previous checkpoint, we leave
+                # it dormant until it is first processed, since there may be thousands of them.
+                new_processor = LogFileProcessor(matched_file, log_attributes, file_system=file_system,
+                                                 checkpoint=checkpoint_state,
+                                                 use_mmap=self.__log_entry_config['use_mmap'], dormant=restoring,
+                                                 read_compressed=self.__log_entry_config['read_compressed'])
+                if len(self.__log_entry_config['event_start_pattern']) > 0:
+                    new_processor.set_event_start_pattern(self.__log_entry_config['event_start_pattern'],
+                                                          max_event_size=self.__log_entry_config['max_event_size'])
+                if self.__log_entry_config['rate_limit_bytes_per_second'] > 0:
+                    burst_size = self.__log_entry_config['rate_limit_burst_size']
+                    if burst_size <= 0:
+                        burst_size = None
+                    new_processor.set_rate_limit(self.__log_entry_config['rate_limit_bytes_per_second'],
+                                                 burst_size=burst_size)
+                if self.__log_entry_config['parse_json_lines']:
+                    attribute_names = None
+                    if len(self.__log_entry_config['json_attributes']) > 0:
+                        attribute_names = [str(x) for x in self.__log_entry_config['json_attributes']]
+                    new_processor.set_json_line_parsing(message_field=self.__log_entry_config['json_message_field'],
+                                                        attribute_names=attribute_names)
+                if self.__log_entry_config['coalesce_max_lines'] > 0:
+                    new_processor.set_line_coalescing(self.__log_entry_config['coalesce_max_lines'],
+                                                      max_bytes=self.__log_entry_config['coalesce_max_bytes'])
+                if self.__log_entry_config['dedup_window'] > 0:
+                    new_processor.set_dedup_window(self.__log_entry_config['dedup_window'])
+                new_processor.set_rules(self.__rules)
+                if self.__log_entry_config['rule_cache_size'] > 0:
+                    new_processor.set_rule_cache_size(self.__log_entry_config['rule_cache_size'])
                 result.append(new_processor)
                 self.__lock.acquire()
                 self.__processors.append(new_processor)
@@ -1766,16 +4728,63 @@ class FileSystem(object):
 
     def __init__(self):
         self.trust_inodes = sys.platform != 'win32'
+        # A dict from directory path to a tuple of the directory's modification time and a dict mapping the inodes
+        # of the files in that directory to their paths.  Used by find_path_by_inode.
+        self.__inode_indexes = {}
 
-    def open(self, file_path):
+    def open(self, file_path, decompress=False):
         """Returns a file object to read the file at file_path.
 
         @param file_path: The path of the file to open
+        @param decompress: If True and the file is gzip compressed (as determined by is_compressed_path), then the
+            returned file object reads the uncompressed bytes.  All offsets and sizes for it are in terms of the
+            uncompressed bytes.
 
         @return: The file object
         """
+        if decompress and self.is_compressed_path(file_path):
+            return FileSystem.CompressedFile(file_path)
         return open(file_path, 'rb')
 
+    def is_compressed_path(self, file_path):
+        """
+        @param file_path: The path of the file.
+        @return: True if the file at file_path is gzip compressed, based on its name.
+        @rtype: bool
+        """
+        return file_path.endswith('.gz')
+
+    def get_compressed_size_hint(self, file_path):
+        """Returns the uncompressed size recorded in the trailer of the gzip compressed file, without decompressing it.
+
+        This is only a hint.  The size is modulo 2^32 and, if the file is still being written, the trailer is
+        whatever bytes happen to be last.  Use get_file_size on an open file to verify the size.
+
+        @param file_path: The path of the file.
+        @type file_path: str
+
+        @return: The uncompressed size modulo 2^32, or None if the file is too short to be complete.
+        @rtype: int or None
+        """
+        file_object = open(file_path, 'rb')
+        try:
+            file_object.seek(0, 2)
+            # The smallest gzip file is a 10 byte header and an 8 byte trailer.
+            if file_object.tell() < 18:
+                return None
+            file_object.seek(-4, 2)
+            return struct.unpack('<I', file_object.read(4))[0]
+        finally:
+            file_object.close()
+
+    def is_compressed(self, file_object):
+        """
+        @param file_object: The file.
+        @return: True if the file object was opened for a compressed file.
+        @rtype: bool
+        """
+        return isinstance(file_object, gzip.GzipFile)
+
     def readlines(self, file_object, max_bytes=None):
         """Reads lines from the file_object, up to max_bytes bytes.
 
@@ -1808,10 +4817,37 @@ class FileSystem(object):
         @param file_object: The file.
         @param max_bytes: The maximum number of bytes to read.
 
-        @return: A string containing the bytes.
+        @return: A string containing the bytes, or None if the bytes could not be decompressed.
         """
+        if self.is_compressed(file_object):
+            try:
+                return file_object.read(max_bytes)
+            except (IOError, EOFError, zlib.error), e:
+                log.warn('Could not decompress file: %s', str(e), limit_once_per_x_secs=60,
+                         limit_key='decompress-failed')
+                return None
         return file_object.read(max_bytes)
 
+    def mmap(self, file_object, length):
+        """Returns a read-only memory mapping of the first length bytes of the file.
+
+        @param file_object: The open file handle for the file.
+        @param length: The number of bytes to map.  Must be greater than zero.
+
+        @return: The mapping.  It should be released by passing it to 'close'.
+        @rtype: mmap.mmap
+        """
+        return mmap.mmap(file_object.fileno(), length, access=mmap.ACCESS_READ)
+
+    def fstat(self, file_object):
+        """Performs a stat on the open file and returns the result.
+
+        @param file_object: The open file handle for the file.
+
+        @return: The stat object for the file (see os.fstat)
+        """
+        return os.fstat(file_object.fileno())
+
     def stat(self, file_path):
         """Performs a stat on the file at file_path and returns the result.
 
@@ -1821,6 +4857,100 @@ class FileSystem(object):
         """
         return os.stat(file_path)
 
+    def advise_sequential(self, file_object):
+        """Hints to the operating system that the file will be read sequentially, so it can read ahead more
+        aggressively.  This is a no-op on platforms that do not support posix_fadvise.
+
+        @param file_object: The open file handle for the file.
+        """
+        scalyr_util.posix_fadvise(file_object.fileno(), 0, 0, scalyr_util.POSIX_FADV_SEQUENTIAL)
+
+    def advise_will_need(self, file_object, offset, length):
+        """Hints to the operating system that the specified portion of the file will be read soon, so it can begin
+        reading it in.  This is a no-op on platforms that do not support posix_fadvise.
+
+        @param file_object: The open file handle for the file.
+        @param offset: The offset of the first byte that will be read.
+        @param length: The number of bytes that will be read.
+        """
+        # The offsets of compressed files do not correspond to the bytes on disk.
+        if self.is_compressed(file_object):
+            return
+        scalyr_util.posix_fadvise(file_object.fileno(), offset, length, scalyr_util.POSIX_FADV_WILLNEED)
+
+    def find_path_by_inode(self, directory_path, inode, force_rebuild=False):
+        """Returns the path of the file in the specified directory with the specified inode.
+
+        This uses an index from inode to path for the directory, which is only rebuilt when the modification time of
+        the directory changes (which happens whenever a file is added, removed, or renamed in it).  This avoids
+        listing the directory and stat'ing every file in it each time a rotated log file must be found.
+
+        @param directory_path: The path of the directory.
+        @param inode: The inode of the file.
+        @param force_rebuild: If True, the index is rebuilt even if the directory does not appear to have changed.
+
+        @type directory_path: str
+        @type inode: int
+        @type force_rebuild: bool
+
+        @return: The full path of the file, or None if no file in the directory has that inode.
+        @rtype: str or None
+
+        @raise OSError: If the directory could not be read.
+        """
+        modification_time = self.stat(directory_path).st_mtime
+        entry = self.__inode_indexes.get(directory_path)
+        if entry is None or force_rebuild or entry[0] != modification_time:
+            index = {}
+            for file_name in listdir(directory_path):
+                full_path = join(directory_path, file_name)
+                try:
+                    stat_result = self.stat(full_path)
+                except OSError:
+                    # The file was removed while we were listing the directory.
+                    continue
+                if stat.S_ISREG(stat_result.st_mode):
+                    index[stat_result.st_ino] = full_path
+
+            # The modification time may only have a granularity of one second, so if the directory was changed very
+            # recently, another change could still happen without altering it.  We do not keep the index in that case.
+            if time.time() - modification_time > 2:
+                self.__inode_indexes[directory_path] = (modification_time, index)
+            else:
+                self.__inode_indexes.pop(directory_path, None)
+        else:
+            index = entry[1]
+
+        return index.get(inode)
+
+    def watched_stat(self, file_path, current_time=None):
+        """Performs a stat on a file whose path is polled repeatedly for changes, such as the path of a log file
+        being copied.
+
+        Implementations that are notified of file system changes may return a cached result if the file has not
+        changed since it was last stat'ed.
+
+        @param file_path: The path of the file to stat.
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+
+        @return: The stat object for the file (see os.stat)
+        @raise OSError: If the file could not be stat'ed, such as when it does not exist.
+        """
+        return self.stat(file_path)
+
+    def process_change_notifications(self, current_time=None):
+        """Processes any pending notifications of changes to the files passed to `watched_stat`.
+
+        This should be called once per iteration of the copying loop, before the log files are read.
+
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+        """
+        pass
+
+    def release(self):
+        """Releases any resources held by this instance.  It should not be used afterwards."""
+        pass
+
     def close(self, file_object):
         """Closes the file.
 
@@ -1865,6 +4995,9 @@ class FileSystem(object):
         @return: The size of the file in bytes.
         @rtype: int
         """
+        if self.is_compressed(file_object):
+            return self.__get_uncompressed_size(file_object)
+
         original_position = None
         try:
             # We have to seek to the end of the file to get its length.
@@ -1873,4 +5006,290 @@ class FileSystem(object):
             return file_object.tell()
         finally:
             if original_position is not None:
-                file_object.seek(original_position)
\ No newline at end of file
+                file_object.seek(original_position)
+
+    def __get_uncompressed_size(self, file_object):
+        """Returns the uncompressed size of the gzip compressed file, or 0 if it has not been completely written.
+
+        The size recorded in the trailer of a file that is still being written, such as by logrotate's compress
+        option, is whatever bytes happen to be last, so the file is decompressed in full to verify it is complete
+        and count its bytes.  The result is kept on the file object until the size of the file on disk changes, so
+        this is only done once for a complete file.
+
+        @param file_object: The open file handle for the file.
+        @type file_object: FileSystem.CompressedFile
+
+        @return: The size of the uncompressed file in bytes.
+        @rtype: int
+        """
+        raw_file = file_object.fileobj
+        original_position = raw_file.tell()
+        try:
+            raw_file.seek(0, 2)
+            compressed_size = raw_file.tell()
+        finally:
+            raw_file.seek(original_position)
+
+        if file_object.verified_size is None or file_object.verified_size[0] != compressed_size:
+            file_object.verified_size = (compressed_size, self.__decompress_to_count(file_object.path))
+        return file_object.verified_size[1]
+
+    def __decompress_to_count(self, file_path):
+        """Decompresses the entire gzip compressed file at file_path, checking its trailer.
+
+        @param file_path: The path of the file.
+        @type file_path: str
+
+        @return: The number of uncompressed bytes in the file, or 0 if it is incomplete or corrupt.
+        @rtype: int
+        """
+        decompressing = None
+        size = 0
+        try:
+            decompressing = gzip.GzipFile(file_path, 'rb')
+            while True:
+                chunk = decompressing.read(MAX_READ_PAGE_SIZE)
+                if len(chunk) == 0:
+                    return size
+                size += len(chunk)
+        except (IOError, EOFError, zlib.error, struct.error), e:
+            log.warn('Compressed file \'%s\' is incomplete or corrupt and will not be read until it changes: %s',
+                     file_path, str(e), limit_once_per_x_secs=60, limit_key=('incomplete-compressed-' + file_path))
+            return 0
+        finally:
+            if decompressing is not None:
+                decompressing.close()
+
+    class CompressedFile(gzip.GzipFile):
+        """A file object reading the uncompressed bytes of a gzip compressed file, returned by `open`."""
+        def __init__(self, file_path):
+            """
+            @param file_path: The path of the file.
+            @type file_path: str
+            """
+            gzip.GzipFile.__init__(self, file_path, 'rb')
+            self.path = file_path
+            # The size of the file on disk when it was last verified to be complete, and its uncompressed size at
+            # that time.  Set by FileSystem.get_file_size.
+            self.verified_size = None
+
+
+class InotifyFileSystem(FileSystem):
+    """A FileSystem that uses Linux's inotify to avoid repeatedly stat'ing log paths that have not changed.
+
+    The results of `watched_stat` are cached for each path and are only refreshed once an inotify event reports
+    the file may have changed, or the cached result is older than the resync interval.  The periodic resync guards
+    against changes inotify does not report, such as writes made through a hard link in another directory.
+
+    Only the stat of the log's path is cached.  The sizes of the file handles a LogFileIterator has open are still
+    checked with `get_file_size` each time it looks for new bytes, since those handles may no longer correspond to
+    the file at the path, such as after a rotation.
+
+    Rather than watching each file individually, the parent directory of each path is watched.  Events for the
+    files in a directory identify them by name, so a single watch covers all of the log files in that directory,
+    which keeps the number of watches well under the kernel's per user limit.  Paths that cannot be watched,
+    such as symlinks or files whose directory does not yet exist, are stat'ed on every call just like the
+    base FileSystem.  Watching them is retried every resync interval.
+
+    Note, cached results are only invalidated when `process_change_notifications` is invoked.
+    """
+
+    # The events for a watched directory that indicate a file in it may have changed, or the directory itself was
+    # moved or deleted.
+    DIRECTORY_EVENTS = (inotify_watcher.IN_MODIFY | inotify_watcher.IN_ATTRIB | inotify_watcher.IN_CREATE |
+                        inotify_watcher.IN_DELETE | inotify_watcher.IN_MOVED_FROM | inotify_watcher.IN_MOVED_TO |
+                        inotify_watcher.IN_DELETE_SELF | inotify_watcher.IN_MOVE_SELF | inotify_watcher.IN_ONLYDIR)
+
+    def __init__(self, resync_interval=30.0):
+        """Initializes the file system.
+
+        @param resync_interval: The maximum number of seconds a cached stat result will be used before the file is
+            stat'ed again, even if no events have been received for it.
+        @type resync_interval: float
+
+        @raise OSError: If an inotify instance could not be created.
+        """
+        FileSystem.__init__(self)
+        self.__watcher = inotify_watcher.InotifyWatcher()
+        self.__resync_interval = resync_interval
+        # A dict from file path to the WatchedPath tracking its cached stat result.
+        self.__watched_paths = {}
+        # A dict from directory path to the watch descriptor for it.
+        self.__directory_watches = {}
+        # A dict from watch descriptor to a dict mapping file names in the watched directory to their WatchedPath.
+        self.__watch_entries = {}
+        # The last time we removed entries for paths that are no longer being stat'ed.
+        self.__last_prune_time = None
+
+    def watched_stat(self, file_path, current_time=None):
+        """Performs a stat on a file whose path is polled repeatedly for changes, returning the cached result if no
+        change has been reported for it since it was last stat'ed.
+
+        @param file_path: The path of the file to stat.
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+
+        @return: The stat object for the file (see os.stat)
+        @raise OSError: If the file could not be stat'ed, such as when it does not exist.
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        entry = self.__watched_paths.get(file_path)
+        if entry is None:
+            entry = InotifyFileSystem.WatchedPath(file_path)
+            self.__watched_paths[file_path] = entry
+
+        entry.last_used_time = current_time
+        stale = entry.stat_time is None or current_time - entry.stat_time >= self.__resync_interval
+
+        if entry.watch_descriptor is None:
+            if stale:
+                # Be sure the watch is in place before doing the stat, otherwise we could miss changes made in
+                # between.  If it cannot be watched, we will not try again until the resync interval has passed.
+                entry.stat_time = current_time
+                self.__add_watch(entry)
+            if entry.watch_descriptor is None:
+                return self.stat(file_path)
+
+        if entry.dirty or stale:
+            # Clear the flag before the stat so that any change reported after this point is not lost.
+            entry.dirty = False
+            entry.stat_time = current_time
+            try:
+                entry.stat_result = self.stat(file_path)
+                entry.stat_error = None
+            except OSError, e:
+                entry.stat_result = None
+                entry.stat_error = e
+
+        if entry.stat_error is not None:
+            raise entry.stat_error
+        return entry.stat_result
+
+    def process_change_notifications(self, current_time=None):
+        """Reads all pending inotify events and marks the paths they refer to as changed.
+
+        @param current_time: If not None, the value to use for the current_time.  Used for testing purposes.
+        """
+        if current_time is None:
+            current_time = time.time()
+
+        try:
+            events = self.__watcher.read_events()
+        except OSError, e:
+            log.warn('Failed to read inotify events, will stat all log files: %s', str(e),
+                     limit_once_per_x_secs=300, limit_key='inotify-read-failure')
+            self.__mark_all_dirty()
+            events = []
+
+        for (watch_descriptor, mask, name) in events:
+            if mask & inotify_watcher.IN_Q_OVERFLOW:
+                # Events were dropped by the kernel, so we have no idea what changed.
+                self.__mark_all_dirty()
+            elif mask & (inotify_watcher.IN_DELETE_SELF | inotify_watcher.IN_MOVE_SELF | inotify_watcher.IN_IGNORED):
+                # The directory itself was moved or deleted (or the kernel dropped our watch), so the events for its
+                # files can no longer be relied upon.  Its paths will be re-watched the next time they are stat'ed.
+                self.__remove_watch(watch_descriptor)
+            elif name is not None:
+                entries = self.__watch_entries.get(watch_descriptor)
+                if entries is not None and name in entries:
+                    entries[name].dirty = True
+
+        if self.__last_prune_time is None:
+            self.__last_prune_time = current_time
+        elif current_time - self.__last_prune_time >= self.__resync_interval:
+            self.__last_prune_time = current_time
+            self.__prune_unused_paths(current_time - 2 * self.__resync_interval)
+
+    def release(self):
+        """Releases the inotify instance along with all of its watches."""
+        self.__watcher.close()
+        self.__watched_paths = {}
+        self.__directory_watches = {}
+        self.__watch_entries = {}
+
+    def __add_watch(self, entry):
+        """Attempts to watch the parent directory of the entry's path.  If successful, the watch descriptor is recorded
+        in the entry and it is marked as dirty.
+
+        @param entry: The entry for the path.
+        @type entry: InotifyFileSystem.WatchedPath
+        """
+        # Events are reported for the symlink's directory entry, not the file it points to, so we cannot watch them.
+        if os.path.islink(entry.path):
+            return
+
+        directory = os.path.dirname(os.path.abspath(entry.path))
+        watch_descriptor = self.__directory_watches.get(directory)
+        if watch_descriptor is None:
+            try:
+                watch_descriptor = self.__watcher.add_watch(directory, InotifyFileSystem.DIRECTORY_EVENTS)
+            except OSError, e:
+                if e.errno == errno.ENOSPC:
+                    log.warn('Reached the limit on the number of inotify watches.  Log files in "%s" will be polled '
+                             'instead.  Consider increasing fs.inotify.max_user_watches', directory,
+                             limit_once_per_x_secs=300, limit_key='inotify-watch-limit')
+                return
+            self.__directory_watches[directory] = watch_descriptor
+
+        self.__watch_entries.setdefault(watch_descriptor, {})[entry.name] = entry
+        entry.watch_descriptor = watch_descriptor
+        entry.dirty = True
+
+    def __remove_watch(self, watch_descriptor):
+        """Stops using the specified watch, marking all paths that relied on it as unwatched.
+
+        @param watch_descriptor: The watch descriptor.
+        @type watch_descriptor: int
+        """
+        entries = self.__watch_entries.pop(watch_descriptor, None)
+        if entries is None:
+            return
+
+        for entry in entries.itervalues():
+            entry.watch_descriptor = None
+            entry.stat_time = None
+
+        for directory in [d for d, wd in self.__directory_watches.iteritems() if wd == watch_descriptor]:
+            del self.__directory_watches[directory]
+        self.__watcher.remove_watch(watch_descriptor)
+
+    def __mark_all_dirty(self):
+        """Marks all watched paths as needing to be stat'ed again."""
+        for entry in self.__watched_paths.itervalues():
+            entry.dirty = True
+
+    def __prune_unused_paths(self, cutoff_time):
+        """Removes the entries for all paths that have not been stat'ed since cutoff_time, such as the paths for log
+        files that are no longer being copied.  Directory watches that are no longer needed are also removed.
+
+        @param cutoff_time: The time before which the paths must have been last used to be removed.
+        @type cutoff_time: float
+        """
+        for entry in self.__watched_paths.values():
+            if entry.last_used_time >= cutoff_time:
+                continue
+            del self.__watched_paths[entry.path]
+            entries = self.__watch_entries.get(entry.watch_descriptor)
+            if entries is not None:
+                entries.pop(entry.name, None)
+                if len(entries) == 0:
+                    self.__remove_watch(entry.watch_descriptor)
+
+    class WatchedPath(object):
+        """Tracks the cached stat result for a single path."""
+        def __init__(self, path):
+            self.path = path
+            # The name of the file within its directory, as reported in the inotify events.
+            self.name = os.path.basename(path)
+            # The descriptor for the watch on the parent directory, or None if it is not being watched.
+            self.watch_descriptor = None
+            # True if an event has been received for this path since it was last stat'ed.
+            self.dirty = True
+            # The result of the last stat.  If it failed, then stat_error holds the exception raised.
+            self.stat_result = None
+            self.stat_error = None
+            # The last time the path was actually stat'ed, or None if it has not been.
+            self.stat_time = None
+            # The last time the cached result was requested.
+            self.last_used_time = None
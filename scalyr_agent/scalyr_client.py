@@ -585,6 +585,58 @@ class AddEventsRequest(object):
         self.__events_added += 1
         return True
 
+    def add_event_from_template(self, template, escaped_message, current_time=None, timestamp=None, extra_attrs=None):
+        """Adds an event created from the template if it does not cause the maximum request size to be exceeded.
+
+        This is the cheapest way to add an event, since only the message and timestamp have to be written.  Its 'ts'
+        field is set to a new timestamp, just as for 'add_event'.
+
+        @param template: The template holding all of the serialized fields of the event other than its message and
+            timestamp.
+        @param escaped_message: The message for the event, already escaped using the fast encoding.
+        @param current_time: If not None, the current time to base the timestamp on.  Callers adding many events at
+            once can pass the same time for all of them to avoid looking up the time for each one.  The timestamps
+            are still guaranteed to increase.
+        @param timestamp: The timestamp to use for the event. This should only be used for testing.
+        @param extra_attrs: If not None, the serialized JSON for additional fields to add to the event's attrs, each
+            preceded by a comma, such as ',"status":200'.  The names must not be the same as any of the template's.
+
+        @type template: EventTemplate
+        @type escaped_message: str
+        @type current_time: float or None
+        @type extra_attrs: str or None
+
+        @return: True if the event's serialized JSON was added to the request, or False if that would have resulted
+            in the maximum request size being exceeded so it did not.
+        """
+        start_pos = self.__buffer.tell()
+        # If we already added an event before us, then make sure we add in a comma to separate us from the last event.
+        if self.__events_added > 0:
+            self.__buffer.write(',')
+
+        if timestamp is None:
+            timestamp = self.__get_timestamp(current_time)
+
+        self.__buffer.write(template.prefix)
+        self.__buffer.write(escaped_message)
+        if extra_attrs is None:
+            self.__buffer.write(template.middle)
+        else:
+            # The extra fields go right after the message's closing quote.
+            self.__buffer.write('"')
+            self.__buffer.write(extra_attrs)
+            self.__buffer.write(template.middle_after_message)
+        self.__buffer.write(str(timestamp))
+        self.__buffer.write(template.suffix)
+
+        # Check if we exceeded the size, if so chop off what we just added.
+        if self.__current_size > self.__max_size:
+            self.__buffer.truncate(start_pos)
+            return False
+
+        self.__events_added += 1
+        return True
+
     def set_client_time(self, current_time):
         """Update the 'client_time' field in the request.
 
@@ -639,14 +691,19 @@ class AddEventsRequest(object):
         """
         self.__body = None
 
-    def __get_timestamp(self):
+    def __get_timestamp(self, current_time=None):
         """
+        @param current_time: If not None, the current time to base the timestamp on.
+        @type current_time: float or None
+
         @return: The next timestamp to use for events.  This is guaranteed to be monotonically increasing.
         @rtype: long
         """
         global __last_time_stamp__
 
-        base_timestamp = long(time.time() * 1000000000L)
+        if current_time is None:
+            current_time = time.time()
+        base_timestamp = long(current_time * 1000000000L)
         if __last_time_stamp__ is not None and base_timestamp <= __last_time_stamp__:
             base_timestamp = __last_time_stamp__ + 1L
         __last_time_stamp__ = base_timestamp
@@ -682,6 +739,38 @@ class AddEventsRequest(object):
             self.postfix_buffer_position = postfix_buffer_position
 
 
+class EventTemplate(object):
+    """The serialized JSON for all of the fields of an event other than its message and timestamp.
+
+    Many events share all of their fields except those two, such as the lines copied from a single log file.  With a
+    template, those fields are only serialized once instead of for each event.  See
+    AddEventsRequest.add_event_from_template.
+    """
+
+    # The placeholders for the message and timestamp.  Since they contain raw null characters, they cannot be
+    # confused with any serialized values.
+    __MESSAGE_PLACEHOLDER = '\0message\0'
+    __TIMESTAMP_PLACEHOLDER = '\0ts\0'
+
+    def __init__(self, event):
+        """
+        @param event: The event object, usually a dict.  It must have an 'attrs' field.  Any values for the
+            'attrs.message' and 'ts' fields are ignored.
+        @type event: dict
+        """
+        event = dict(event)
+        event['attrs'] = dict(event['attrs'])
+        event['attrs']['message'] = json_lib.EscapedString(EventTemplate.__MESSAGE_PLACEHOLDER)
+        event['ts'] = json_lib.EscapedString(EventTemplate.__TIMESTAMP_PLACEHOLDER)
+
+        serialized = json_lib.serialize(event, use_fast_encoding=True)
+        (self.prefix, remaining) = serialized.split(EventTemplate.__MESSAGE_PLACEHOLDER)
+        (self.middle, self.suffix) = remaining.split(EventTemplate.__TIMESTAMP_PLACEHOLDER)
+        # The middle always begins with the quote closing the message.  This is what follows it, which is where any
+        # additional attrs fields may be inserted.
+        self.middle_after_message = self.middle[1:]
+
+
 # This is used down below by PostFixBuffer.
 def _calculate_per_thread_extra_bytes():
     """Calculates how many extra bytes are added to the serialized form of the threads JSON array
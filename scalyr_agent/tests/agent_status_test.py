@@ -165,7 +165,17 @@ class TestReportStatus(unittest.TestCase):
         process_status.total_bytes_dropped_by_sampling = 5
         process_status.total_lines_copied = 214324
         process_status.total_lines_dropped_by_sampling = 10
+        process_status.total_bytes_dropped_by_rate_limit = 20
+        process_status.total_lines_dropped_by_rate_limit = 2
+        process_status.adaptive_sampling_rate = 0.25
         process_status.total_redactions = 10
+        process_status.rule_times = [('sampling', 'INFO', 0.0), ('redaction', 'password=.*', 1.25)]
+        process_status.rule_cache_hits = 75
+        process_status.rule_cache_misses = 25
+        process_status.rule_cache_enabled = False
+        process_status.total_page_reads = 7
+        process_status.current_page_size = 65536
+        process_status.largest_page_size = 262144
 
         # One more glob that doesn't have any matches.
         log_matcher = LogMatcherStatus()
@@ -241,7 +251,7 @@ Path /var/logs/tomcat6/catalina.log: copied 2341234 bytes (214324 lines), 1243 b
 
 Glob: /var/logs/cron/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
   /var/logs/cron/logrotate.log: copied 2341234 bytes (214324 lines), 1243 bytes pending, 12 bytes skipped, 1432 bytes failed, last checked Fri Sep  5 23:12:13 2014 UTC
-  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 10 redactions, last checked Fri Sep  5 23:12:13 2014 UTC
+  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 20 bytes dropped by rate limit (2 lines), sampling 25% of lines to catch up, 10 redactions, rule times (redaction "password=.*" 1.250 secs), rule cache hit rate 75% (100 lines), rule cache off for low hit rate, 7 page reads (65536 bytes per page, largest 262144), last checked Fri Sep  5 23:12:13 2014 UTC
 Glob: /var/logs/silly/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
 
 
@@ -303,7 +313,7 @@ Path /var/logs/tomcat6/catalina.log: copied 2341234 bytes (214324 lines), 1243 b
 
 Glob: /var/logs/cron/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
   /var/logs/cron/logrotate.log: copied 2341234 bytes (214324 lines), 1243 bytes pending, 12 bytes skipped, 1432 bytes failed, last checked Fri Sep  5 23:12:13 2014 UTC
-  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 10 redactions, last checked Fri Sep  5 23:12:13 2014 UTC
+  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 20 bytes dropped by rate limit (2 lines), sampling 25% of lines to catch up, 10 redactions, rule times (redaction "password=.*" 1.250 secs), rule cache hit rate 75% (100 lines), rule cache off for low hit rate, 7 page reads (65536 bytes per page, largest 262144), last checked Fri Sep  5 23:12:13 2014 UTC
 Glob: /var/logs/silly/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
 
 
@@ -370,7 +380,7 @@ Path /var/logs/tomcat6/catalina.log: copied 2341234 bytes (214324 lines), 1243 b
 
 Glob: /var/logs/cron/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
   /var/logs/cron/logrotate.log: copied 2341234 bytes (214324 lines), 1243 bytes pending, 12 bytes skipped, 1432 bytes failed, last checked Fri Sep  5 23:12:13 2014 UTC
-  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 10 redactions, last checked Fri Sep  5 23:12:13 2014 UTC
+  /var/logs/cron/ohno.log: copied 23434 bytes (214324 lines), 12943 bytes pending, 12 bytes skipped, 1432 bytes failed, 5 bytes dropped by sampling (10 lines), 20 bytes dropped by rate limit (2 lines), sampling 25% of lines to catch up, 10 redactions, rule times (redaction "password=.*" 1.250 secs), rule cache hit rate 75% (100 lines), rule cache off for low hit rate, 7 page reads (65536 bytes per page, largest 262144), last checked Fri Sep  5 23:12:13 2014 UTC
 Glob: /var/logs/silly/*.log:: last scanned for glob matches at Fri Sep  5 23:14:03 2014 UTC
 
 
@@ -50,6 +50,12 @@ class TestConfiguration(unittest.TestCase):
         self.assertEquals(config.implicit_metric_monitor, True)
         self.assertEquals(config.implicit_agent_log_collection, True)
         self.assertFalse(config.use_unsafe_debugging)
+        self.assertFalse(config.use_inotify)
+        self.assertEquals(config.inotify_resync_interval, 30.0)
+        self.assertEquals(config.log_hibernation_threshold, 0.0)
+        self.assertEquals(config.max_log_hibernation_poll_interval, 60.0)
+        self.assertEquals(config.adaptive_sampling_threshold, 0)
+        self.assertEquals(config.line_processing_workers, 0)
         self.assertEquals(config.scalyr_server, 'https://agent.scalyr.com')
         self.assertEquals(len(config.server_attributes), 1)
         self.assertTrue('serverHost' in config.server_attributes)
@@ -77,6 +83,19 @@ class TestConfiguration(unittest.TestCase):
         self.assertEquals(config.logs[0].config.get_json_object('attributes'), JsonObject())
         self.assertEquals(config.logs[0].config.get_json_array('sampling_rules'), JsonArray())
         self.assertEquals(config.logs[0].config.get_json_array('redaction_rules'), JsonArray())
+        self.assertFalse(config.logs[0].config.get_bool('use_mmap'))
+        self.assertFalse(config.logs[0].config.get_bool('read_compressed'))
+        self.assertEquals(config.logs[0].config.get_string('event_start_pattern'), '')
+        self.assertEquals(config.logs[0].config.get_int('max_event_size'), 32 * 1024)
+        self.assertEquals(config.logs[0].config.get_float('rate_limit_bytes_per_second'), 0.0)
+        self.assertEquals(config.logs[0].config.get_int('rate_limit_burst_size'), 0)
+        self.assertEquals(config.logs[0].config.get_float('dedup_window'), 0.0)
+        self.assertEquals(config.logs[0].config.get_int('rule_cache_size'), 0)
+        self.assertEquals(config.logs[0].config.get_int('coalesce_max_lines'), 0)
+        self.assertEquals(config.logs[0].config.get_int('coalesce_max_bytes'), 32 * 1024)
+        self.assertFalse(config.logs[0].config.get_bool('parse_json_lines'))
+        self.assertEquals(config.logs[0].config.get_json_array('json_attributes'), JsonArray())
+        self.assertEquals(config.logs[0].config.get_string('json_message_field'), 'message')
         self.assertPathEquals(config.logs[1].config.get_string('path'), '/var/log/scalyr-agent-2/agent.log')
         self.assertPathEquals(config.logs[2].config.get_string('path'),
                               '/var/log/scalyr-agent-2/linux_system_metrics.log')
@@ -120,6 +139,12 @@ class TestConfiguration(unittest.TestCase):
             implicit_metric_monitor: false,
             implicit_agent_log_collection: false,
             use_unsafe_debugging: true,
+            use_inotify: true,
+            inotify_resync_interval: 10.0,
+            log_hibernation_threshold: 600.0,
+            max_log_hibernation_poll_interval: 30.0,
+            adaptive_sampling_threshold: 1000000,
+            line_processing_workers: 4,
             scalyr_server: "noland.scalyr.com",
             max_allowed_request_size: 2000000,
             min_allowed_request_size: 7000,
@@ -149,6 +174,12 @@ class TestConfiguration(unittest.TestCase):
         self.assertEquals(config.implicit_metric_monitor, False)
         self.assertEquals(config.implicit_agent_log_collection, False)
         self.assertTrue(config.use_unsafe_debugging)
+        self.assertTrue(config.use_inotify)
+        self.assertEquals(config.inotify_resync_interval, 10.0)
+        self.assertEquals(config.log_hibernation_threshold, 600.0)
+        self.assertEquals(config.max_log_hibernation_poll_interval, 30.0)
+        self.assertEquals(config.adaptive_sampling_threshold, 1000000)
+        self.assertEquals(config.line_processing_workers, 4)
         self.assertEquals(config.scalyr_server, 'noland.scalyr.com')
         self.assertEquals(len(config.server_attributes), 2)
         self.assertEquals(config.server_attributes['region'], 'us-east')
@@ -222,7 +253,8 @@ class TestConfiguration(unittest.TestCase):
             logs: [ {
               path:"/var/log/tomcat6/access.log",
               sampling_rules: [ { match_expression: "INFO", sampling_rate: 0},
-                                { match_expression: ".*error.*=foo", sampling_rate: 0.2 } ],
+                                { match_expression: ".*error.*=foo", sampling_rate: 0.2 },
+                                { match_expression: "id=(\\\\w+)", sampling_rate: 0.1, sampling_key_group: 1 } ],
             }]
           }
         """)
@@ -231,11 +263,14 @@ class TestConfiguration(unittest.TestCase):
 
         self.assertEquals(len(config.logs), 4)
         sampling_rules = config.logs[0].config.get_json_array('sampling_rules')
-        self.assertEquals(len(sampling_rules), 2)
+        self.assertEquals(len(sampling_rules), 3)
         self.assertEquals(sampling_rules.get_json_object(0).get_string("match_expression"), "INFO")
         self.assertEquals(sampling_rules.get_json_object(0).get_float("sampling_rate"), 0)
         self.assertEquals(sampling_rules.get_json_object(1).get_string("match_expression"), ".*error.*=foo")
         self.assertEquals(sampling_rules.get_json_object(1).get_float("sampling_rate"), 0.2)
+        self.assertEquals(sampling_rules.get_json_object(1).get_int("sampling_key_group"), 0)
+        self.assertEquals(sampling_rules.get_json_object(2).get_string("match_expression"), "id=(\\w+)")
+        self.assertEquals(sampling_rules.get_json_object(2).get_int("sampling_key_group"), 1)
 
     def test_bad_sampling_rules(self):
         # Missing match_expression.
@@ -293,6 +328,17 @@ class TestConfiguration(unittest.TestCase):
         config = self.__create_test_configuration_instance()
         self.assertRaises(BadConfiguration, config.parse)
 
+        # Key group not in the expression.
+        self.__write_file_with_separator_conversion(""" {
+            api_key: "hi there",
+            logs: [ {
+              path:"/var/log/tomcat6/access.log",
+              sampling_rules: [ { match_expression: "id=(\\\\w+)", sampling_rate: 0.5, sampling_key_group: 2} ]
+          }] }
+        """)
+        config = self.__create_test_configuration_instance()
+        self.assertRaises(BadConfiguration, config.parse)
+
     def test_redaction_rules(self):
         self.__write_file_with_separator_conversion(""" {
             api_key: "hi there",
@@ -18,41 +18,70 @@ import sys
 
 __author__ = 'czerwin@scalyr.com'
 
+import gzip
 import os
 import shutil
 import tempfile
+import time
 import unittest
 
 from scalyr_agent.log_processing import LogFileIterator, LogLineSampler, LogLineRedacter, LogFileProcessor
-from scalyr_agent.log_processing import FileSystem
+from scalyr_agent.log_processing import MultiPatternMatcher, LineProcessingPool, JsonLineParser, LogLineRules
+from scalyr_agent.log_processing import RuleResultCache, RepeatedLineTracker, process_line_batch
+from scalyr_agent.log_processing import FileSystem, InotifyFileSystem
+from scalyr_agent import inotify_watcher
+from scalyr_agent import json_lib
 
 
 class TestLogFileIterator(unittest.TestCase):
+    # Whether or not the iterator under test should use memory mappings.  Overridden by subclasses.
+    use_mmap = False
+    # Whether or not the iterator under test should use inotify to detect changes.  Overridden by subclasses.
+    use_inotify = False
 
     def setUp(self):
         self.__tempdir = tempfile.mkdtemp()
-        self.__file_system = FileSystem()
+        if self.use_inotify and inotify_watcher.is_supported():
+            # Use a long resync interval so the cached stat results are actually exercised.
+            self.__file_system = InotifyFileSystem(resync_interval=1000.0)
+        else:
+            self.__file_system = FileSystem()
         self.__path = os.path.join(self.__tempdir, 'text.txt')
         self.__fake_time = 10
 
         self.write_file(self.__path, '')
-        self.log_file = LogFileIterator(self.__path, self.__file_system)
-        self.log_file.set_parameters(max_line_length=5, page_size=20)
+        self.log_file = LogFileIterator(self.__path, self.__file_system, use_mmap=self.use_mmap)
+        self.log_file.set_parameters(max_line_length=5, page_size=20, check_buffer_invariants=True)
         self.mark(time_advance=0)
 
     def tearDown(self):
         self.log_file.close()
+        self.__file_system.release()
         shutil.rmtree(self.__tempdir)
 
     def readline(self, time_advance=10):
         self.__fake_time += time_advance
+        self.__file_system.process_change_notifications(current_time=self.__fake_time)
 
         return self.log_file.readline(current_time=self.__fake_time)
 
+    def read_lines(self, time_advance=10, max_bytes=None, max_lines=None):
+        self.__fake_time += time_advance
+        self.__file_system.process_change_notifications(current_time=self.__fake_time)
+
+        return [x[0] for x in self.log_file.read_lines(max_bytes=max_bytes, max_lines=max_lines,
+                                                        current_time=self.__fake_time)]
+
     def mark(self, time_advance=10):
         self.__fake_time += time_advance
+        self.__file_system.process_change_notifications(current_time=self.__fake_time)
         self.log_file.mark(current_time=self.__fake_time)
 
+    def scan_for_new_bytes(self, time_advance=10):
+        self.__fake_time += time_advance
+        self.__file_system.process_change_notifications(current_time=self.__fake_time)
+        self.log_file.scan_for_new_bytes(current_time=self.__fake_time)
+
     def test_initial_scan(self):
         self.append_file(self.__path,
                          'L1\n',
@@ -390,6 +419,220 @@ class TestLogFileIterator(unittest.TestCase):
         self.assertEquals(self.readline(), 'L007\n')
         self.assertEquals(self.readline(), 'L008\n')
 
+    def test_advance_to_time(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n')
+        self.mark(time_advance=10)
+        first_write_time = self.__fake_time
+        self.append_file(self.__path, 'L003\n', 'L004\n')
+        self.mark(time_advance=60)
+        self.append_file(self.__path, 'L005\n')
+        self.mark(time_advance=60)
+
+        self.assertEquals(self.log_file.advance_to_time(first_write_time + 1, current_time=self.__fake_time), 10L)
+        self.assertEquals(self.readline(), 'L003\n')
+        self.assertEquals(self.readline(), 'L004\n')
+        self.assertEquals(self.readline(), 'L005\n')
+
+    def test_advance_to_time_with_nothing_old_enough(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n')
+        self.mark()
+
+        self.assertEquals(self.log_file.advance_to_time(0, current_time=self.__fake_time), 0L)
+        self.assertEquals(self.readline(), 'L001\n')
+
+    def test_advance_to_time_with_max_available(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n', 'L003\n', 'L004\n')
+        self.mark()
+
+        # The limit puts us in the middle of a line, so we should skip the rest of it.
+        self.assertEquals(self.log_file.advance_to_time(0, max_available=8, current_time=self.__fake_time), 15L)
+        self.assertEquals(self.readline(), 'L004\n')
+
+        self.append_file(self.__path, 'L005\n', 'L006\n')
+        self.mark()
+        self.assertEquals(self.log_file.advance_to_time(0, max_available=5, current_time=self.__fake_time), 5L)
+        self.assertEquals(self.readline(), 'L006\n')
+
+    def test_advance_to_time_with_long_line(self):
+        self.append_file(self.__path, 'L001\n', 'ABCDEFGHIJ\n', 'L003\n')
+        self.mark()
+
+        # The target is in a line longer than max_line_length, so we have to skip more than one chunk of it.
+        self.assertEquals(self.log_file.advance_to_time(0, max_available=14, current_time=self.__fake_time), 16L)
+        self.assertEquals(self.readline(), 'L003\n')
+
+    def test_advance_to_time_with_partial_last_line(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n', 'L0')
+        self.mark()
+
+        # The target is in the last line, which has not been completely written, so we back up to its start.
+        self.assertEquals(self.log_file.advance_to_time(0, max_available=1, current_time=self.__fake_time), 10L)
+        self.assertEquals(self.readline(), '')
+
+        self.append_file(self.__path, '03\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L003\n')
+
+    def test_growth_index_in_checkpoint(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n')
+        self.mark(time_advance=10)
+        first_write_time = self.__fake_time
+        self.append_file(self.__path, 'L003\n', 'L004\n')
+        self.mark(time_advance=60)
+
+        checkpoint = json_lib.parse(json_lib.serialize(self.log_file.get_checkpoint()))
+        self.log_file.close()
+        self.log_file = LogFileIterator(self.__path, self.__file_system, checkpoint=checkpoint)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+
+        self.assertEquals(self.log_file.advance_to_time(first_write_time + 1, current_time=self.__fake_time), 10L)
+        self.assertEquals(self.readline(), 'L003\n')
+
+    def test_partial_line_time_in_checkpoint(self):
+        self.append_file(self.__path, 'L001\n', 'L002')
+        self.assertEquals(self.readline(), 'L001\n')
+        self.assertEquals(self.readline(), '')
+        self.mark(time_advance=200)
+
+        checkpoint = json_lib.parse(json_lib.serialize(self.log_file.get_checkpoint()))
+        self.log_file.close()
+        self.log_file = LogFileIterator(self.__path, self.__file_system, checkpoint=checkpoint)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+
+        # We should not have to wait for the partial line all over again.
+        self.mark(time_advance=100)
+        self.assertEquals(self.readline(), 'L002')
+
+    def test_fingerprint_in_checkpoint(self):
+        self.append_file(self.__path, 'L001\n', 'L002\n')
+        self.assertEquals(self.readline(), 'L001\n')
+        self.assertEquals(self.readline(), 'L002\n')
+        self.mark()
+
+        checkpoint = json_lib.parse(json_lib.serialize(self.log_file.get_checkpoint()))
+        self.log_file.close()
+
+        # Replace the contents of the file.  Since it is the same file, only the fingerprint can tell us that we
+        # should not pick up at the same offset.
+        self.write_file(self.__path, 'X001\n', 'X002\n', 'X003\n')
+        self.log_file = LogFileIterator(self.__path, self.__file_system, checkpoint=checkpoint)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+        self.mark()
+
+        self.assertEquals(self.readline(), 'X001\n')
+        self.assertEquals(self.readline(), 'X002\n')
+        self.assertEquals(self.readline(), 'X003\n')
+
+    def test_compressed_log_file(self):
+        compressed_path = self.__path + '.2.gz'
+        self.write_compressed_file(compressed_path, 'L001\n', 'L002\n', 'L003\n', 'L004\n', 'L005\n')
+
+        self.log_file.close()
+        self.log_file = LogFileIterator(compressed_path, self.__file_system, use_mmap=self.use_mmap,
+                                        checkpoint=LogFileIterator.create_checkpoint(5), read_compressed=True)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+        self.mark()
+
+        self.assertEquals(self.log_file.available, 20L)
+        self.assertEquals(self.readline(), 'L002\n')
+        self.assertEquals(self.readline(), 'L003\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L004\n')
+        self.assertEquals(self.readline(), 'L005\n')
+        self.assertEquals(self.readline(), '')
+
+    def test_incomplete_compressed_file(self):
+        compressed_path = self.__path + '.2.gz'
+        self.write_compressed_file(compressed_path, 'L001\n', 'L002\n', 'L003\n')
+        contents = open(compressed_path, 'rb').read()
+
+        # Leave off the trailer, as if the file were still being compressed.
+        self.write_file(compressed_path, contents[:-8])
+        file_object = self.__file_system.open(compressed_path, decompress=True)
+        try:
+            self.assertEquals(self.__file_system.get_file_size(file_object), 0)
+
+            # Once it is completely written, its size is known.
+            self.write_file(compressed_path, contents)
+            self.assertEquals(self.__file_system.get_file_size(file_object), 15)
+        finally:
+            self.__file_system.close(file_object)
+
+    def test_rotated_file_compressed_between_checkpoints(self):
+        # Since it cannot keep file handles open when they are moved, win32 cannot handle this case:
+        if sys.platform == 'win32':
+            return
+
+        self.append_file(self.__path, 'L001\n', 'L002\n', 'L003\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L001\n')
+
+        self.move_file(self.__path, self.__path + '.1')
+        self.write_file(self.__path, 'L004\n')
+        self.mark()
+        saved_checkpoint = self.log_file.get_checkpoint()
+        self.log_file.close()
+
+        # Compress the rotated file, which is what logrotate does.  The rotated file no longer exists, so the
+        # unread lines must be read from the compressed copy.
+        contents = open(self.__path + '.1', 'rb').read()
+        os.remove(self.__path + '.1')
+        self.write_compressed_file(self.__path + '.1.gz', contents)
+
+        self.log_file = LogFileIterator(self.__path, self.__file_system, checkpoint=saved_checkpoint,
+                                        use_mmap=self.use_mmap, read_compressed=True)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+
+        # The compressed copy is recorded by its path so that it can be reopened.
+        self.assertEquals(self.log_file.get_checkpoint()['pending_files'][0]['path'], self.__path + '.1.gz')
+
+        self.mark()
+        self.assertEquals(self.readline(), 'L002\n')
+        self.assertEquals(self.readline(), 'L003\n')
+        self.assertEquals(self.readline(), 'L004\n')
+        self.assertEquals(self.readline(), '')
+
+    def test_compressed_rotation_lookup_skips_other_archives(self):
+        if sys.platform == 'win32':
+            return
+
+        self.append_file(self.__path, 'L001\n', 'L002\n', 'L003\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L001\n')
+
+        self.move_file(self.__path, self.__path + '.1')
+        self.write_file(self.__path, 'L004\n')
+        self.mark()
+        saved_checkpoint = self.log_file.get_checkpoint()
+        self.log_file.close()
+
+        contents = open(self.__path + '.1', 'rb').read()
+        os.remove(self.__path + '.1')
+        self.write_compressed_file(self.__path + '.1.gz', contents)
+        # An older rotation of the same size, a rotation of a different size, and another log's archive.
+        self.write_compressed_file(self.__path + '.2.gz', 'X001\n', 'X002\n', 'X003\n')
+        old_time = time.time() - 3600
+        os.utime(self.__path + '.2.gz', (old_time, old_time))
+        self.write_compressed_file(self.__path + '.3.gz', 'X001\n')
+        self.write_compressed_file(self.__path + 'x.1.gz', contents)
+
+        decompressed_paths = []
+
+        class CountingFileSystem(FileSystem):
+            def open(self, file_path, decompress=False):
+                if decompress and self.is_compressed_path(file_path):
+                    decompressed_paths.append(file_path)
+                return FileSystem.open(self, file_path, decompress=decompress)
+
+        file_system = CountingFileSystem()
+        self.log_file = LogFileIterator(self.__path, file_system, checkpoint=saved_checkpoint,
+                                        use_mmap=self.use_mmap, read_compressed=True)
+        self.log_file.set_parameters(max_line_length=5, page_size=20)
+
+        self.assertEquals(decompressed_paths, [self.__path + '.1.gz'])
+        self.log_file.mark(current_time=self.__fake_time)
+        self.assertEquals(self.log_file.readline(current_time=self.__fake_time), 'L002\n')
+
     def test_skip_to_end_with_buffer(self):
         self.append_file(self.__path,
                          'L001\n',
@@ -420,27 +663,133 @@ class TestLogFileIterator(unittest.TestCase):
 
         self.assertEquals(self.log_file.bytes_between_positions(pos1, pos2), 10)
 
+    def test_page_size_adapts_to_backlog(self):
+        self.log_file.set_parameters(max_page_size=80)
+        lines = []
+        for i in range(40):
+            lines.append('L%03d\n' % i)
+        self.append_file(self.__path, *lines)
+        self.mark()
+
+        # We are 200 bytes behind, so the page should start to grow.
+        self.assertEquals(self.readline(), 'L000\n')
+        self.assertEquals(self.log_file.page_size, 40)
+
+        for i in range(1, 40):
+            self.assertEquals(self.readline(), 'L%03d\n' % i)
+        self.assertEquals(self.log_file.largest_page_size, 80)
+        page_reads = self.log_file.page_reads
+        self.assertTrue(page_reads < 10)
+
+        # Once we have caught up, the page size should shrink back to normal.
+        self.assertEquals(self.readline(), '')
+        self.append_file(self.__path, 'L040\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L040\n')
+        self.assertEquals(self.log_file.page_size, 40)
+        self.append_file(self.__path, 'L041\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L041\n')
+        self.assertEquals(self.log_file.page_size, 20)
+
+    def test_page_size_does_not_grow_when_tailing(self):
+        self.log_file.set_parameters(max_page_size=80)
+        for i in range(10):
+            self.append_file(self.__path, 'L%03d\n' % i)
+            self.mark()
+            self.assertEquals(self.readline(), 'L%03d\n' % i)
+            self.assertEquals(self.log_file.page_size, 20)
+        self.assertEquals(self.log_file.largest_page_size, 20)
+
     def test_scan_for_new_bytes(self):
         self.append_file(self.__path,
                          'L001\n',
                          'L002\n',
                          'L003\n',
                          'L004\n')
-        self.log_file.scan_for_new_bytes()
+        self.scan_for_new_bytes()
         self.assertEquals(self.log_file.available, 20L)
         self.append_file(self.__path,
                          'L005\n',
                          'L006\n')
-        self.log_file.scan_for_new_bytes()
+        self.scan_for_new_bytes()
         self.assertEquals(self.log_file.available, 30L)
 
         self.move_file(self.__path, self.__path + '.1')
         self.write_file(self.__path,
                         'L007\n',
                         'L008\n')
-        self.log_file.scan_for_new_bytes()
+        self.scan_for_new_bytes()
         self.assertEquals(self.log_file.available, 40L)
 
+    def test_read_lines(self):
+        self.append_file(self.__path,
+                         'L001\n',
+                         'L002\n',
+                         'L003\n',
+                         'L004\n',
+                         'L005\n',
+                         'L006\n')
+
+        self.assertEquals(self.read_lines(), ['L001\n', 'L002\n', 'L003\n', 'L004\n', 'L005\n', 'L006\n'])
+        self.assertEquals(self.read_lines(), [])
+        self.assertEquals(self.log_file.available, 0L)
+
+    def test_read_lines_with_limits(self):
+        self.append_file(self.__path,
+                         'L001\n',
+                         'L002\n',
+                         'L003\n',
+                         'L004\n')
+
+        self.assertEquals(self.read_lines(max_lines=1), ['L001\n'])
+        self.assertEquals(self.read_lines(max_bytes=6), ['L002\n', 'L003\n'])
+        self.assertEquals(self.readline(), 'L004\n')
+
+    def test_read_lines_positions(self):
+        self.append_file(self.__path,
+                         'L001\n',
+                         'L002\n',
+                         'L003\n')
+
+        lines = self.log_file.read_lines()
+        self.assertEquals(len(lines), 3)
+        self.assertEquals(self.log_file.bytes_between_positions(lines[0][1], lines[0][2]), 5)
+        self.assertEquals(self.log_file.bytes_between_positions(lines[0][1], lines[2][2]), 15)
+
+        # Pretend we could only consume the first line and roll back to the start of the second.
+        self.log_file.seek(lines[1][1])
+        self.assertEquals(self.readline(), 'L002\n')
+        self.assertEquals(self.read_lines(), ['L003\n'])
+
+    def test_read_lines_partial_line(self):
+        self.append_file(self.__path, 'L001\n', 'L00')
+        self.assertEquals(self.read_lines(), ['L001\n'])
+        self.assertEquals(self.read_lines(time_advance=200), [])
+        self.assertEquals(self.read_lines(time_advance=100), ['L00'])
+
+    def test_read_lines_exceeding_maximum_line_length(self):
+        self.append_file(self.__path,
+                         'L00001\n',
+                         'L002\n')
+        self.assertEquals(self.read_lines(), ['L0000', '1\n', 'L002\n'])
+
+    def test_read_lines_across_rotation(self):
+        # Since it cannot keep file handles open when they are moved/deleted, win32 cannot handle this case:
+        if sys.platform == 'win32':
+            return
+
+        self.append_file(self.__path,
+                         'L001\n',
+                         'L002\n')
+        self.move_file(self.__path, self.__path + '.1')
+        self.write_file(self.__path,
+                        'L003\n',
+                        'L004\n')
+        self.mark()
+
+        self.assertEquals(self.read_lines(), ['L001\n', 'L002\n', 'L003\n', 'L004\n'])
+
     def write_file(self, path, *lines):
         contents = ''.join(lines)
         file_handle = open(path, 'wb')
@@ -466,92 +815,433 @@ class TestLogFileIterator(unittest.TestCase):
         file_handle.truncate(0)
         file_handle.close()
 
+    def write_compressed_file(self, path, *lines):
+        file_handle = gzip.GzipFile(path, 'wb')
+        file_handle.write(''.join(lines))
+        file_handle.close()
 
-class TestLogLineRedactor(unittest.TestCase):
 
-    def run_test_case(self, redactor, line, expected_line, expected_redaction):
-        (result_line, redacted) = redactor.process_line(line)
-        self.assertEquals(result_line, expected_line)
-        self.assertEquals(redacted, expected_redaction)
+class TestLogFileIteratorWithMmap(TestLogFileIterator):
+    """Runs all of the LogFileIterator tests again, but with the iterator reading through memory mappings."""
+    use_mmap = True
 
-    def test_basic_redaction(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule('password', 'fake')
+    def test_line_spanning_rotation(self):
+        if sys.platform == 'win32':
+            return
 
-        self.run_test_case(redactor, "auth=password", "auth=fake", True)
-        self.run_test_case(redactor, "another line password", "another line fake", True)
-        self.run_test_case(redactor, "do not touch", "do not touch", False)
+        path = self.log_file_path()
+        self.append_file(path, 'L001\n', 'L0')
+        self.assertEquals(self.readline(), 'L001\n')
 
-    def test_multiple_redactions_in_line(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule('password', 'fake')
+        # The partial line at the end of the rotated file must be completed using the bytes in the new file, which
+        # means the iterator has to stitch the two files together.
+        self.move_file(path, path + '.1')
+        self.write_file(path, '2\n', 'L003\n')
+        self.mark()
 
-        self.run_test_case(redactor, "auth=password foo=password", "auth=fake foo=fake", True)
+        self.assertEquals(self.readline(), 'L02\n')
+        self.assertEquals(self.readline(), 'L003\n')
+        self.assertEquals(self.readline(), '')
 
-    def test_regular_expression_redaction(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule('password=.*', 'password=fake')
+    def test_mapping_grows_with_file(self):
+        path = self.log_file_path()
+        self.append_file(path, 'L001\n')
+        self.assertEquals(self.readline(), 'L001\n')
+        self.assertEquals(self.readline(), '')
 
-        self.run_test_case(redactor, "login attempt password=czerwin", "login attempt password=fake", True)
+        self.append_file(path, 'L002\n', 'L003\n', 'L004\n', 'L005\n', 'L006\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'L002\n')
+        self.assertEquals(self.readline(), 'L003\n')
+        self.assertEquals(self.readline(), 'L004\n')
+        self.assertEquals(self.readline(), 'L005\n')
+        self.assertEquals(self.readline(), 'L006\n')
+        self.assertEquals(self.readline(), '')
 
-    def test_regular_expression_with_capture_group(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule('secret(.*)=.*', 'secret\\1=fake')
+    def test_truncated_between_mark_and_read(self):
+        path = self.log_file_path()
+        self.append_file(path, 'L001\n', 'L002\n', 'L003\n', 'L004\n', 'L005\n', 'L006\n', 'L007\n', 'L008\n')
+        self.mark()
+        # Read the first page, leaving the file mapped and ready to have the next page sliced out of it.
+        self.assertEquals(self.read_lines(max_lines=4), ['L001\n', 'L002\n', 'L003\n', 'L004\n'])
 
-        self.run_test_case(redactor, "foo secretoption=czerwin", "foo secretoption=fake", True)
+        # Truncate the file in place after the mark, as logrotate's copytruncate option does.  The next page must not
+        # be taken from the mapping, since touching it past the end of the file would kill the process.  The unread
+        # lines are lost along with the old contents.
+        self.mark()
+        self.truncate_file(path)
+        self.append_file(path, 'N001\n')
 
-    def test_multiple_redactions(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule('secret(.*)=.*', 'secret\\1=fake')
-        redactor.add_redaction_rule('password=.* ', '')
+        self.assertEquals(self.readline(), 'N001\n')
+        self.assertEquals(self.readline(), '')
 
-        self.run_test_case(redactor, "foo password=steve secretoption=czerwin", "foo secretoption=fake", True)
+        self.append_file(path, 'N002\n')
+        self.mark()
+        self.assertEquals(self.readline(), 'N002\n')
 
-    def test_customer_case(self):
-        redactor = LogLineRedacter('/var/fake_log')
-        redactor.add_redaction_rule(
-            "(access_token|ccNumber|ccSecurityCode|ccExpirationMonth|ccExpirationYear|pwdField|passwordConfirm|"
-            "challengeAnswer|code|taxVat|password[0-9]?|pwd|newpwd[0-9]?Field|currentField|security_answer[0-9]|"
-            "tinnumber)=[^&]*", "")
+    def log_file_path(self):
+        return self._TestLogFileIterator__path
 
-        self.run_test_case(redactor, "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
-                           "access_token=E|foo&catId=10179&mode=basic HTTP/1.1\" 200 2045",
-                           "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
-                           "&catId=10179&mode=basic HTTP/1.1\" 200 2045", True)
 
-        self.run_test_case(redactor, "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
-                           "access_token=E|foo&newpwd5Field=10179&mode=basic HTTP/1.1\" 200 2045",
-                           "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?&&mode=basic"
-                           " HTTP/1.1\" 200 2045", True)
+class TestLogFileIteratorWithInotify(TestLogFileIterator):
+    """Runs all of the LogFileIterator tests again, but with changes to the file detected using inotify."""
+    use_inotify = True
 
 
-class TestLogLineSampler(unittest.TestCase):
-    class TestableLogLineSampler(LogLineSampler):
-        """
-        A subclass of LogLineSampler that allows us to fix the generated random numbers to help with testing.
-        """
-        def __init__(self):
-            super(TestLogLineSampler.TestableLogLineSampler, self).__init__('/fakefile')
-            self.__pending_numbers = []
+class TestInotifyFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.__tempdir = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__tempdir, 'text.txt')
+        self.__file_system = None
+        if inotify_watcher.is_supported():
+            self.__file_system = TestInotifyFileSystem.CountingFileSystem(resync_interval=60.0)
+        self.__fake_time = 10
 
-        def _get_next_random(self):
-            if len(self.__pending_numbers) > 0:
-                return self.__pending_numbers.pop(0)
-            else:
-                return 0
+    def tearDown(self):
+        if self.__file_system is not None:
+            self.__file_system.release()
+        shutil.rmtree(self.__tempdir)
 
-        def insert_next_number(self, random_number):
-            self.__pending_numbers.append(random_number)
+    def test_unchanged_file_not_stated(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
 
-    def setUp(self):
-        self.sampler = TestLogLineSampler.TestableLogLineSampler()
+        self.assertEquals(self.watched_stat().st_size, 5)
+        self.assertEquals(self.watched_stat().st_size, 5)
+        self.assertEquals(self.watched_stat().st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 1)
 
-    def test_no_sampling_rules(self):
-        sampler = self.sampler
+    def test_modification(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
+        self.assertEquals(self.watched_stat().st_size, 5)
 
-        self.assertEquals(sampler.process_line('One line\n'), 1.0)
+        self.append_file(self.__path, 'L002\n')
+        self.assertEquals(self.watched_stat().st_size, 10)
+        self.assertEquals(self.watched_stat().st_size, 10)
+        self.assertEquals(self.__file_system.stat_count, 2)
 
-    def test_all_pass_rule(self):
+    def test_changes_to_other_files_ignored(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
+        self.assertEquals(self.watched_stat().st_size, 5)
+
+        self.append_file(os.path.join(self.__tempdir, 'other.txt'), 'L002\n')
+        self.assertEquals(self.watched_stat().st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 1)
+
+    def test_rotation(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
+        original_inode = self.watched_stat().st_ino
+
+        os.rename(self.__path, self.__path + '.1')
+        self.assertRaises(OSError, self.watched_stat)
+
+        self.append_file(self.__path, 'L002\n', 'L003\n')
+        stat_result = self.watched_stat()
+        self.assertEquals(stat_result.st_size, 10)
+        self.assertNotEquals(stat_result.st_ino, original_inode)
+
+    def test_deletion(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
+        self.assertEquals(self.watched_stat().st_size, 5)
+
+        os.remove(self.__path)
+        self.assertRaises(OSError, self.watched_stat)
+        self.assertRaises(OSError, self.watched_stat)
+        self.assertEquals(self.__file_system.stat_count, 2)
+
+    def test_resync(self):
+        if self.__file_system is None:
+            return
+        self.append_file(self.__path, 'L001\n')
+        self.assertEquals(self.watched_stat().st_size, 5)
+        self.assertEquals(self.watched_stat(time_advance=30).st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 1)
+
+        self.assertEquals(self.watched_stat(time_advance=30).st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 2)
+
+    def test_directory_created_later(self):
+        if self.__file_system is None:
+            return
+        directory = os.path.join(self.__tempdir, 'later')
+        path = os.path.join(directory, 'text.txt')
+        self.assertRaises(OSError, self.watched_stat, path)
+
+        os.mkdir(directory)
+        self.append_file(path, 'L001\n')
+        # The directory is not watched until the resync interval has passed, so until then it is polled.
+        self.assertEquals(self.watched_stat(path).st_size, 5)
+        self.assertEquals(self.watched_stat(path).st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 3)
+
+        self.assertEquals(self.watched_stat(path, time_advance=60).st_size, 5)
+        self.assertEquals(self.watched_stat(path).st_size, 5)
+        self.assertEquals(self.__file_system.stat_count, 4)
+
+    def test_directory_moved(self):
+        if self.__file_system is None:
+            return
+        directory = os.path.join(self.__tempdir, 'logs')
+        path = os.path.join(directory, 'text.txt')
+        os.mkdir(directory)
+        self.append_file(path, 'L001\n')
+        self.assertEquals(self.watched_stat(path).st_size, 5)
+
+        os.rename(directory, directory + '.old')
+        self.assertRaises(OSError, self.watched_stat, path)
+
+    def watched_stat(self, path=None, time_advance=0):
+        if path is None:
+            path = self.__path
+        self.__fake_time += time_advance
+        self.__file_system.process_change_notifications(current_time=self.__fake_time)
+        return self.__file_system.watched_stat(path, current_time=self.__fake_time)
+
+    def append_file(self, path, *lines):
+        contents = ''.join(lines)
+        file_handle = open(path, 'ab')
+        file_handle.write(contents)
+        file_handle.close()
+
+    class CountingFileSystem(InotifyFileSystem):
+        """An InotifyFileSystem that counts the number of times a file is actually stat'ed."""
+        def __init__(self, resync_interval):
+            InotifyFileSystem.__init__(self, resync_interval=resync_interval)
+            self.stat_count = 0
+
+        def stat(self, file_path):
+            self.stat_count += 1
+            return InotifyFileSystem.stat(self, file_path)
+
+
+class TestFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.__tempdir = tempfile.mkdtemp()
+        self.__file_system = TestFileSystem.CountingFileSystem()
+
+    def tearDown(self):
+        shutil.rmtree(self.__tempdir)
+
+    def test_find_path_by_inode(self):
+        first_path = self.create_file('first.log')
+        second_path = self.create_file('second.log')
+        os.mkdir(os.path.join(self.__tempdir, 'archive'))
+        self.age_directory()
+
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, self.inode(first_path)), first_path)
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, self.inode(second_path)), second_path)
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, -1), None)
+
+        # The directory should only have been listed the first time.
+        self.assertEquals(self.__file_system.stat_count, 6)
+
+    def test_index_invalidated_by_rename(self):
+        path = self.create_file('first.log')
+        inode = self.inode(path)
+        self.age_directory(age=100)
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, inode), path)
+
+        os.rename(path, path + '.1')
+        self.age_directory(age=50)
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, inode), path + '.1')
+
+    def test_recently_changed_directory_not_cached(self):
+        path = self.create_file('first.log')
+        inode = self.inode(path)
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, inode), path)
+
+        os.rename(path, path + '.1')
+        self.assertEquals(self.__file_system.find_path_by_inode(self.__tempdir, inode), path + '.1')
+
+    def create_file(self, name):
+        path = os.path.join(self.__tempdir, name)
+        file_handle = open(path, 'wb')
+        file_handle.write('L001\n')
+        file_handle.close()
+        return path
+
+    def age_directory(self, age=100):
+        past = os.stat(self.__tempdir).st_mtime - age
+        os.utime(self.__tempdir, (past, past))
+
+    def inode(self, path):
+        return os.stat(path).st_ino
+
+    class CountingFileSystem(FileSystem):
+        """A FileSystem that counts the number of stats performed."""
+        def __init__(self):
+            FileSystem.__init__(self)
+            self.stat_count = 0
+
+        def stat(self, file_path):
+            self.stat_count += 1
+            return FileSystem.stat(self, file_path)
+
+
+class TestLogLineRedactor(unittest.TestCase):
+
+    def run_test_case(self, redactor, line, expected_line, expected_redaction):
+        (result_line, redacted) = redactor.process_line(line)
+        self.assertEquals(result_line, expected_line)
+        self.assertEquals(redacted, expected_redaction)
+
+    def test_basic_redaction(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('password', 'fake')
+
+        self.run_test_case(redactor, "auth=password", "auth=fake", True)
+        self.run_test_case(redactor, "another line password", "another line fake", True)
+        self.run_test_case(redactor, "do not touch", "do not touch", False)
+
+    def test_multiple_redactions_in_line(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('password', 'fake')
+
+        self.run_test_case(redactor, "auth=password foo=password", "auth=fake foo=fake", True)
+
+    def test_regular_expression_redaction(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('password=.*', 'password=fake')
+
+        self.run_test_case(redactor, "login attempt password=czerwin", "login attempt password=fake", True)
+
+    def test_regular_expression_with_capture_group(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('secret(.*)=.*', 'secret\\1=fake')
+
+        self.run_test_case(redactor, "foo secretoption=czerwin", "foo secretoption=fake", True)
+
+    def test_multiple_redactions(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('secret(.*)=.*', 'secret\\1=fake')
+        redactor.add_redaction_rule('password=.* ', '')
+
+        self.run_test_case(redactor, "foo password=steve secretoption=czerwin", "foo secretoption=fake", True)
+
+    def test_customer_case(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule(
+            "(access_token|ccNumber|ccSecurityCode|ccExpirationMonth|ccExpirationYear|pwdField|passwordConfirm|"
+            "challengeAnswer|code|taxVat|password[0-9]?|pwd|newpwd[0-9]?Field|currentField|security_answer[0-9]|"
+            "tinnumber)=[^&]*", "")
+
+        self.run_test_case(redactor, "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
+                           "access_token=E|foo&catId=10179&mode=basic HTTP/1.1\" 200 2045",
+                           "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
+                           "&catId=10179&mode=basic HTTP/1.1\" 200 2045", True)
+
+        self.run_test_case(redactor, "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?"
+                           "access_token=E|foo&newpwd5Field=10179&mode=basic HTTP/1.1\" 200 2045",
+                           "[11/May/2012:16:20:54 -0400] \"GET /api2/profiles/api_contractor?&&mode=basic"
+                           " HTTP/1.1\" 200 2045", True)
+
+    def test_rules_see_earlier_redactions(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('pwd', 'password')
+        redactor.add_redaction_rule('password=[^ ]*', 'password=fake')
+
+        # The second rule's required literal only appears after the first rule is applied.
+        self.run_test_case(redactor, "user=steve pwd=czerwin", "user=steve password=fake", True)
+        self.run_test_case(redactor, "user=steve", "user=steve", False)
+        self.assertEquals(redactor.total_redactions, 2)
+
+    def test_case_insensitive_redaction(self):
+        redactor = LogLineRedacter('/var/fake_log')
+        redactor.add_redaction_rule('(?i)password=[^ ]*', 'password=fake')
+
+        self.run_test_case(redactor, "PASSWORD=czerwin", "password=fake", True)
+
+    def test_rule_times(self):
+        redactor = LogLineRedacter('/var/fake_log', timing_interval=2)
+        redactor.add_redaction_rule('password', 'fake')
+        redactor.add_redaction_rule('secret=(a*)*b', 'secret=fake')
+
+        self.run_test_case(redactor, "password=foo secret=" + "a" * 16, "fake=foo secret=" + "a" * 16, True)
+        self.assertEquals(redactor.rule_times, [0.0, 0.0])
+        # Only every second line is timed.
+        self.run_test_case(redactor, "password=foo secret=" + "a" * 16, "fake=foo secret=" + "a" * 16, True)
+        self.assertTrue(redactor.rule_times[0] > 0)
+        self.assertTrue(redactor.rule_times[1] > redactor.rule_times[0])
+
+    def test_shared_rules(self):
+        rules = LogLineRules(redaction_rules=[('password', 'fake'), ('secret', 'fake')])
+        first_redactor = LogLineRedacter('/var/fake_log', rules=rules)
+        second_redactor = LogLineRedacter('/var/other_fake_log', rules=rules)
+
+        self.run_test_case(first_redactor, "password=secret", "fake=fake", True)
+        self.run_test_case(second_redactor, "secret secret", "fake fake", True)
+
+        # Each redacter counts the redactions it made on its own.
+        self.assertEquals(first_redactor.rule_lines, [1, 1])
+        self.assertEquals(second_redactor.rule_lines, [0, 1])
+        self.assertEquals(second_redactor.rule_redactions, [0, 2])
+
+
+class TestJsonLineParser(unittest.TestCase):
+    def test_parse(self):
+        parser = JsonLineParser()
+
+        self.assertEquals(parser.parse('{"message":"hi\\nthere","a":1.5e3,"b":true,"c":null,"d":"x"}\n'),
+                          ('hi\\nthere', ',"a":1.5e3,"b":true,"c":null,"d":"x"'))
+        self.assertEquals(parser.parse(' { } '), (None, ''))
+        self.assertEquals(parser.parse('{"a":[1,{"b":"]"}],"c":-2}'), (None, ',"c":-2'))
+
+    def test_selected_and_reserved_fields(self):
+        parser = JsonLineParser(message_field='msg', attribute_names=['a', 'logfile'], reserved_names=['logfile'])
+
+        self.assertEquals(parser.parse('{"msg":"hi","a":1}'), ('hi', ',"a":1'))
+        self.assertEquals(parser.parse('{"msg":"hi","a":1,"b":2}'), (None, ',"a":1'))
+        self.assertEquals(parser.parse('{"msg":"hi","logfile":"x"}'), (None, ''))
+
+    def test_rejected_lines(self):
+        parser = JsonLineParser()
+
+        self.assertTrue(parser.parse('Not JSON\n') is None)
+        self.assertTrue(parser.parse('[1, 2]') is None)
+        self.assertTrue(parser.parse('{"a":1} trailing') is None)
+        self.assertTrue(parser.parse('{"a":1,}') is None)
+        self.assertTrue(parser.parse('{"a":tru}') is None)
+        self.assertTrue(parser.parse('{"a":"\t"}') is None)
+        self.assertTrue(parser.parse('{"a":[1}') is None)
+        self.assertTrue(parser.parse('{"a":"\xc3\xa9"}') is None)
+
+
+class TestLogLineSampler(unittest.TestCase):
+    class TestableLogLineSampler(LogLineSampler):
+        """
+        A subclass of LogLineSampler that allows us to fix the generated random numbers to help with testing.
+        """
+        def __init__(self):
+            super(TestLogLineSampler.TestableLogLineSampler, self).__init__('/fakefile')
+            self.__pending_numbers = []
+
+        def _get_next_random(self):
+            if len(self.__pending_numbers) > 0:
+                return self.__pending_numbers.pop(0)
+            else:
+                return 0
+
+        def insert_next_number(self, random_number):
+            self.__pending_numbers.append(random_number)
+
+    def setUp(self):
+        self.sampler = TestLogLineSampler.TestableLogLineSampler()
+
+    def test_no_sampling_rules(self):
+        sampler = self.sampler
+
+        self.assertEquals(sampler.process_line('One line\n'), 1.0)
+
+    def test_all_pass_rule(self):
         sampler = self.sampler
         sampler.add_rule('INFO', 1.0)
 
@@ -582,6 +1272,215 @@ class TestLogLineSampler(unittest.TestCase):
         self.assertTrue(sampler.process_line('INFO Another\n') is None)
         self.assertEquals(sampler.process_line('INFO Here is a line\n'), 0.2)
 
+    def test_first_rule_wins(self):
+        sampler = self.sampler
+        sampler.add_rule('ERROR', 0.0)
+        sampler.add_rule('INFO', 1.0)
+
+        # INFO appears earlier in the line, but the ERROR rule comes first.
+        self.assertTrue(sampler.process_line('INFO then ERROR\n') is None)
+        self.assertEquals(sampler.process_line('INFO only\n'), 1.0)
+        self.assertEquals(sampler.total_passes, 1L)
+
+    def test_rules_that_cannot_be_combined(self):
+        sampler = self.sampler
+        sampler.add_rule('(a)\\1', 0.0)
+        sampler.add_rule('(?i)info', 0.0)
+        sampler.add_rule('ERROR', 1.0)
+
+        self.assertTrue(sampler.process_line('xaa\n') is None)
+        self.assertTrue(sampler.process_line('Info line\n') is None)
+        self.assertEquals(sampler.process_line('ERROR a line\n'), 1.0)
+        self.assertEquals(sampler.process_line('INFO ERROR\n'), None)
+
+    def test_rule_times(self):
+        sampler = LogLineSampler('/fakefile', timing_interval=1)
+        sampler.add_rule('INFO', 1.0)
+        sampler.add_rule('id=(a*)*b', 1.0)
+
+        self.assertEquals(sampler.process_line('INFO id=' + 'a' * 16 + '\n'), 1.0)
+        # Every rule is timed, even though the first one matched the line.
+        self.assertTrue(sampler.rule_times[0] > 0)
+        self.assertTrue(sampler.rule_times[1] > sampler.rule_times[0])
+
+    def test_counters(self):
+        sampler = self.sampler
+        sampler.add_rule('INFO', 1.0)
+        sampler.process_line('INFO Here is a line\n')
+        sampler.process_line('Another\n')
+
+        other = LogLineSampler('/fakefile', rules=LogLineRules(sampling_rules=[('INFO', 1.0, 0)]))
+        other.add_counters(sampler.take_counters())
+        # Nothing has been counted since the counters were taken.
+        self.assertTrue(sampler.take_counters() is None)
+
+        self.assertEquals(other.rule_matches, [1L])
+        self.assertEquals(other.rule_passes, [1L])
+        self.assertEquals(other.total_passes, 1L)
+        self.assertEquals(sampler.rule_matches, [0L])
+
+    def test_process_line_batch(self):
+        rules = ((('DEBUG', 0.0, 0),), (('password=[^&]+', 'password=foo'),))
+        results = process_line_batch((rules, '/fakefile', ['DEBUG 1\n', 'GET password=secret&x=1\n', 'GET\n']))
+
+        # The counters are reported for each line, and only for the lines that changed them.
+        self.assertEquals(results, [
+            (None, None, None, ([1L], [0L], [0.0], 0L), None),
+            (1.0, 'GET password=foo&x=1\n', 'GET password=foo&x=1\\n', None, ([1], [1], [0.0], 1)),
+            (1.0, None, None, None, None)])
+
+    def test_sampling_key(self):
+        sampler = self.sampler
+        sampler.add_rule('request=(\\w+)', 0.5, key_group=1)
+
+        # The random numbers are not used, so every line with the same key gets the same decision.
+        sampler.insert_next_number(1.0)
+        kept = [sampler.process_line('GET request=%d\n' % i) is not None for i in range(1000)]
+        for i in range(1000):
+            self.assertEquals(sampler.process_line('POST request=%d done\n' % i) is not None, kept[i])
+        self.assertTrue(400 < kept.count(True) < 600)
+
+    def test_sampling_key_with_all_or_none(self):
+        sampler = self.sampler
+        sampler.add_rule('drop=(\\w+)', 0.0, key_group=1)
+        sampler.add_rule('keep=(\\w+)', 1.0, key_group=1)
+
+        self.assertTrue(sampler.process_line('drop=abc\n') is None)
+        self.assertEquals(sampler.process_line('keep=abc\n'), 1.0)
+
+    def test_find_rule_with_key(self):
+        sampler = self.sampler
+        sampler.add_rule('ERROR', 1.0)
+        sampler.add_rule('request=(\\w+)', 0.5, key_group=1)
+
+        self.assertEquals(sampler.find_rule('GET request=abc\n'), (1, 'abc'))
+        self.assertEquals(sampler.find_rule('ERROR request=abc\n'), (0, None))
+        self.assertEquals(sampler.find_rule('GET\n'), (-1, None))
+
+    def test_sampling_key_missing(self):
+        sampler = self.sampler
+        sampler.add_rule('INFO( id=(\\w+))?', 0.2, key_group=2)
+        sampler.insert_next_number(0.4)
+        sampler.insert_next_number(0.1)
+
+        # Without a key, the line is sampled randomly.
+        self.assertTrue(sampler.process_line('INFO Another\n') is None)
+        self.assertEquals(sampler.process_line('INFO Here is a line\n'), 0.2)
+
+
+class TestMultiPatternMatcher(unittest.TestCase):
+    def test_find_first(self):
+        matcher = MultiPatternMatcher(['ERROR', 'WARN|INFO', '^DEBUG', 'x+y'])
+
+        self.assertEquals(matcher.find_first('INFO and ERROR'), 0)
+        self.assertEquals(matcher.find_first('an INFO line'), 1)
+        self.assertEquals(matcher.find_first('DEBUG line'), 2)
+        self.assertEquals(matcher.find_first('a DEBUG line'), None)
+        self.assertEquals(matcher.find_first('xxxy'), 3)
+        self.assertEquals(matcher.find_first(''), None)
+
+    def test_find_first_match(self):
+        matcher = MultiPatternMatcher(['ERROR', 'WARN', 'id=(\\w+)'])
+
+        self.assertEquals(matcher.find_first_match('WARN id=abc'), (1, None))
+        (index, match) = matcher.find_first_match('INFO id=abc')
+        self.assertEquals(index, 2)
+        self.assertEquals(match.group(1), 'abc')
+        self.assertTrue(matcher.find_first_match('INFO') is None)
+
+    def test_many_patterns(self):
+        matcher = MultiPatternMatcher(['pattern%d;' % i for i in range(250)])
+
+        self.assertEquals(matcher.find_first('pattern249; pattern120;'), 120)
+        self.assertEquals(matcher.find_first('pattern0;'), 0)
+        self.assertEquals(matcher.find_first('pattern250;'), None)
+
+    def test_extract_required_literal(self):
+        self.assertEquals(MultiPatternMatcher.extract_required_literal('password=[^&]*'), 'password=')
+        self.assertEquals(MultiPatternMatcher.extract_required_literal('ab\\d+abcd'), 'abcd')
+        self.assertEquals(MultiPatternMatcher.extract_required_literal('abc*'), 'ab')
+        self.assertTrue(MultiPatternMatcher.extract_required_literal('INFO|WARN') is None)
+        self.assertTrue(MultiPatternMatcher.extract_required_literal('(?i)INFO') is None)
+        self.assertTrue(MultiPatternMatcher.extract_required_literal('.*') is None)
+
+
+class TestRuleResultCache(unittest.TestCase):
+    def test_lookup(self):
+        cache = RuleResultCache(4)
+
+        result = cache.lookup('First\n')
+        result.rule_match = (1, None)
+        self.assertEquals(cache.lookup('First\n').rule_match, (1, None))
+        self.assertTrue(cache.lookup('Second\n').rule_match is None)
+        self.assertEquals(cache.hits, 1L)
+        self.assertEquals(cache.misses, 2L)
+
+    def test_least_recently_used_dropped(self):
+        cache = RuleResultCache(4)
+        cache.lookup('First\n').rule_match = (1, None)
+        cache.lookup('Second\n').rule_match = (2, None)
+        cache.lookup('Third\n').rule_match = (3, None)
+        # Using the first line again keeps it in the cache.
+        self.assertEquals(cache.lookup('First\n').rule_match, (1, None))
+        cache.lookup('Fourth\n')
+        cache.lookup('Fifth\n')
+
+        self.assertEquals(cache.lookup('First\n').rule_match, (1, None))
+        self.assertTrue(cache.lookup('Second\n').rule_match is None)
+
+    def test_turns_off_for_low_hit_rate(self):
+        cache = RuleResultCache(100)
+        for i in range(RuleResultCache.CHECK_INTERVAL):
+            self.assertTrue(cache.lookup('Line %d\n' % i) is not None)
+
+        self.assertFalse(cache.is_enabled())
+        self.assertTrue(cache.lookup('Line 0\n') is None)
+
+    def test_stays_on_for_high_hit_rate(self):
+        cache = RuleResultCache(100)
+        for i in range(RuleResultCache.CHECK_INTERVAL):
+            cache.lookup('Line %d\n' % (i % 10))
+
+        self.assertTrue(cache.is_enabled())
+        self.assertEquals(cache.hits, RuleResultCache.CHECK_INTERVAL - 10)
+
+
+class TestRepeatedLineTracker(unittest.TestCase):
+    def test_rollback(self):
+        tracker = RepeatedLineTracker(60)
+        tracker.add('First', 1.0, 10)
+        tracker.commit()
+
+        mark = tracker.mark()
+        self.assertTrue(tracker.count_repeat('First', 1.0, 20))
+        tracker.add('Second', 1.0, 20)
+        # Lines copied with a different sampling rate are not repeats.
+        self.assertFalse(tracker.count_repeat('First', 0.5, 20))
+        tracker.rollback(mark)
+
+        self.assertEquals(tracker.to_checkpoint(), [])
+        self.assertFalse(tracker.count_repeat('Second', 1.0, 20))
+
+        # Removing the expired line can be undone as well.
+        mark = tracker.mark()
+        self.assertTrue(tracker.count_repeat('First', 1.0, 20))
+        expired = tracker.get_expired(70)
+        self.assertEquals(len(expired), 1)
+        tracker.remove(expired[0])
+        self.assertTrue(tracker.is_empty())
+        tracker.rollback(mark)
+        self.assertFalse(tracker.is_empty())
+        self.assertEquals(tracker.to_checkpoint(), [])
+
+    def test_max_lines(self):
+        tracker = RepeatedLineTracker(60, max_lines=2)
+        tracker.add('First', 1.0, 10)
+        tracker.add('Second', 1.0, 10)
+        tracker.add('Third', 1.0, 10)
+
+        self.assertTrue(tracker.count_repeat('Second', 1.0, 10))
+        self.assertFalse(tracker.count_repeat('Third', 1.0, 10))
+
 
 class TestLogFileProcessor(unittest.TestCase):
 
@@ -602,6 +1501,210 @@ class TestLogFileProcessor(unittest.TestCase):
             TestLogFileProcessor.TestAddEventsRequest(), current_time=self.__fake_time)
         self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
 
+    def test_skip_to_recent_when_stale(self):
+        log_processor = self.log_processor
+        log_processor.set_parameters(copy_staleness_threshold=900, catch_up_window=300)
+        self.append_file(self.__path, 'First line\n')
+        log_processor.scan_for_new_bytes(current_time=self.__fake_time + 20)
+        self.append_file(self.__path, 'Second line\n')
+        log_processor.scan_for_new_bytes(current_time=self.__fake_time + 1000)
+
+        # We have not had a success in 1200 seconds, so we should skip over the lines written more than 300
+        # seconds ago.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(
+            events, current_time=self.__fake_time + 1200)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'Second line\n')
+        self.assertEquals(11L, log_processor.generate_status().total_bytes_skipped)
+
+    def test_skip_to_recent_when_too_far_behind(self):
+        log_processor = self.log_processor
+        log_processor.set_parameters(max_log_offset_size=20)
+        self.append_file(self.__path, 'L001\n', 'L002\n', 'L003\n', 'L004\n', 'L005\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # We should only be left with half of the maximum offset.
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'L004\n')
+        self.assertEquals(events.get_message(1), 'L005\n')
+
+    def test_dormant_restore(self):
+        self.append_file(self.__path, 'First line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = self.log_processor.perform_processing(
+            events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        checkpoint = self.log_processor.get_checkpoint()
+
+        self.append_file(self.__path, 'Second line\n')
+        log_processor = LogFileProcessor(self.__path, file_system=self.__file_system, log_attributes={},
+                                         checkpoint=checkpoint, dormant=True)
+
+        # The checkpoint is passed through untouched until the processor is used.
+        self.assertTrue(log_processor.is_dormant)
+        log_processor.scan_for_new_bytes(current_time=self.__fake_time)
+        self.assertTrue(log_processor.is_dormant)
+        self.assertTrue(log_processor.get_checkpoint() is checkpoint)
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertFalse(log_processor.is_dormant)
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'Second line\n')
+
+    def test_dormant_restore_without_changes(self):
+        self.append_file(self.__path, 'First line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = self.log_processor.perform_processing(
+            events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.log_processor.scan_for_new_bytes(current_time=self.__fake_time)
+        checkpoint = self.log_processor.get_checkpoint()
+
+        log_processor = LogFileProcessor(self.__path, file_system=self.__file_system, log_attributes={},
+                                         checkpoint=checkpoint, dormant=True)
+
+        # The log file has not changed, so it is not opened.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertTrue(log_processor.is_dormant)
+        self.assertEquals(0, events.total_events())
+
+        self.append_file(self.__path, 'Second line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertFalse(log_processor.is_dormant)
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'Second line\n')
+
+    def test_hibernation(self):
+        log_processor = self.log_processor
+        log_processor.set_parameters(hibernation_threshold=60, max_hibernation_poll_interval=4)
+        self.append_file(self.__path, 'First line\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertFalse(log_processor.is_hibernating)
+
+        # Once the file has not grown for long enough, the processor lets go of it.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(
+            events, current_time=self.__fake_time + 100)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(0, events.total_events())
+        self.assertTrue(log_processor.is_hibernating)
+        self.assertTrue(log_processor.is_dormant)
+
+        # The file is not looked at again until the next poll, which is a second later.
+        self.append_file(self.__path, 'Second line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(
+            events, current_time=self.__fake_time + 100.5)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(0, events.total_events())
+        self.assertTrue(log_processor.is_hibernating)
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(
+            events, current_time=self.__fake_time + 101)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertFalse(log_processor.is_hibernating)
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'Second line\n')
+
+    def test_hibernation_poll_interval_backs_off(self):
+        log_processor = self.log_processor
+        log_processor.set_parameters(hibernation_threshold=60, max_hibernation_poll_interval=4)
+
+        current_time = self.__fake_time + 100
+        log_processor.perform_processing(TestLogFileProcessor.TestAddEventsRequest(), current_time=current_time)
+        self.assertTrue(log_processor.is_hibernating)
+
+        # The file does not change, so each poll waits twice as long as the last, up to the maximum.
+        for interval in [1, 2, 4, 4]:
+            current_time += interval
+            log_processor.perform_processing(TestLogFileProcessor.TestAddEventsRequest(), current_time=current_time)
+            self.assertTrue(log_processor.is_hibernating)
+
+        self.append_file(self.__path, 'First line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=current_time + 3)
+        self.assertTrue(log_processor.is_hibernating)
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=current_time + 4)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertFalse(log_processor.is_hibernating)
+        self.assertEquals(events.get_message(0), 'First line\n')
+
+    def test_event_assembly(self):
+        log_processor = self.log_processor
+        log_processor.set_event_start_pattern('^ERROR')
+        self.append_file(self.__path, 'ERROR first\n', '  at line 1\n', '  at line 2\n', 'ERROR second\n',
+                         '  at line 3\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # The second event may still get more lines, so it is held back.
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'ERROR first\n  at line 1\n  at line 2\n')
+        self.assertEquals(3L, log_processor.generate_status().total_lines_copied)
+
+        self.append_file(self.__path, '  at line 4\n', 'ERROR third\n')
+        log_processor.scan_for_new_bytes(current_time=self.__fake_time)
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'ERROR second\n  at line 3\n  at line 4\n')
+
+    def test_event_assembly_flushes_after_wait(self):
+        log_processor = self.log_processor
+        log_processor.set_event_start_pattern('^ERROR')
+        self.append_file(self.__path, 'ERROR first\n', '  at line 1\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(0, events.total_events())
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(
+            events, current_time=self.__fake_time + 10)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'ERROR first\n  at line 1\n')
+
+    def test_event_assembly_max_event_size(self):
+        log_processor = self.log_processor
+        log_processor.set_event_start_pattern('^ERROR', max_event_size=30)
+        self.append_file(self.__path, 'ERROR first\n', '  at line 1\n', '  at line 2\n', 'ERROR second\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'ERROR first\n  at line 1\n')
+        self.assertEquals(events.get_message(1), '  at line 2\n')
+
     def test_basic_usage(self):
         log_processor = self.log_processor
         self.append_file(self.__path, 'First line\nSecond line\n')
@@ -690,6 +1793,31 @@ class TestLogFileProcessor(unittest.TestCase):
         self.assertEquals(1, events.total_events())
         self.assertEquals(events.get_message(0), 'Third line\n')
 
+    def test_request_filled(self):
+        log_processor = self.log_processor
+        self.append_file(self.__path, 'First line\nSecond line\nThird line\n')
+
+        # Only the first line fits, so the rest should be picked up on the next call.
+        events = TestLogFileProcessor.TestAddEventsRequest(limit=1)
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+
+        self.assertTrue(buffer_full)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'First line\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+
+        self.assertFalse(buffer_full)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'Second line\n')
+        self.assertEquals(events.get_message(1), 'Third line\n')
+
+        status = log_processor.generate_status()
+        self.assertEquals(34L, status.total_bytes_copied)
+
     def test_sampling_rule(self):
         log_processor = self.log_processor
         log_processor.add_sampler('INFO', 0)
@@ -715,6 +1843,446 @@ class TestLogFileProcessor(unittest.TestCase):
         self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
         self.assertEquals(events.get_message(0), 'GET /foo&password=foo&start=true\n')
 
+    def test_shared_rules(self):
+        rules = LogLineRules(sampling_rules=[('INFO', 0.0, 0)], redaction_rules=[('password=[^&]+', 'password=foo')])
+        other_path = os.path.join(self.__tempdir, 'other.txt')
+        self.write_file(other_path, '')
+        other_processor = LogFileProcessor(other_path, file_system=self.__file_system, log_attributes={},
+                                           checkpoint=LogFileProcessor.create_checkpoint(0))
+        self.log_processor.set_rules(rules)
+        other_processor.set_rules(rules)
+
+        self.append_file(self.__path, 'INFO First line\nGET /foo&password=FakePassword&x\n')
+        self.append_file(other_path, 'GET /bar\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = self.log_processor.perform_processing(events,
+                                                                                   current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'GET /foo&password=foo&x\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = other_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'GET /bar\n')
+
+        self.assertEquals(1L, self.log_processor.generate_status().total_redactions)
+        self.assertEquals(0L, other_processor.generate_status().total_redactions)
+        self.assertEquals([('sampling', 'INFO'), ('redaction', 'password=[^&]+')],
+                          [rule_time[0:2] for rule_time in other_processor.generate_status().rule_times])
+
+    def test_rule_cache(self):
+        log_processor = self.log_processor
+        log_processor.set_rule_cache_size(100)
+        log_processor.add_sampler('DEBUG', 0.0)
+        log_processor.add_redacter('password=[^&]+', 'password=foo')
+
+        self.append_file(self.__path, 'GET /health&password=bar&x\n', 'DEBUG check\n', 'GET /health&password=bar&x\n',
+                         'DEBUG check\n', 'GET /other\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(3, events.total_events())
+        self.assertEquals(events.get_message(0), 'GET /health&password=foo&x\n')
+        self.assertEquals(events.get_message(1), 'GET /health&password=foo&x\n')
+        self.assertEquals(events.get_message(2), 'GET /other\n')
+
+        status = log_processor.generate_status()
+        self.assertEquals(2L, status.total_redactions)
+        self.assertEquals(2L, status.total_lines_dropped_by_sampling)
+        self.assertEquals(2, status.rule_cache_hits)
+        self.assertEquals(3, status.rule_cache_misses)
+        self.assertTrue(status.rule_cache_enabled)
+
+    def test_rate_limit(self):
+        log_processor = self.log_processor
+        log_processor.set_rate_limit(10, burst_size=25)
+
+        self.append_file(self.__path, 'First line\n', 'Second line\n', 'Third line\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # Only the first two lines fit in the burst.
+        self.assertEquals(2, events.total_events())
+        status = log_processor.generate_status()
+        self.assertEquals(11L, status.total_bytes_dropped_by_rate_limit)
+        self.assertEquals(1L, status.total_lines_dropped_by_rate_limit)
+
+        # After a second, there is room for another line.
+        self.append_file(self.__path, 'Fourth line\n', 'Fifth line\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 1)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'Fourth line\n')
+        self.assertEquals(2L, log_processor.generate_status().total_lines_dropped_by_rate_limit)
+
+    def test_rate_limit_retry(self):
+        log_processor = self.log_processor
+        log_processor.set_rate_limit(10, burst_size=25)
+
+        self.append_file(self.__path, 'First line\n', 'Second line\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertEquals(2, events.total_events())
+        self.assertFalse(completion_callback(LogFileProcessor.FAIL_AND_RETRY))
+
+        # The lines were not charged against the rate limit since they were not sent, so they can be sent now.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(0L, log_processor.generate_status().total_lines_dropped_by_rate_limit)
+
+    def test_rate_limit_line_longer_than_burst(self):
+        log_processor = self.log_processor
+        log_processor.set_rate_limit(10, burst_size=10)
+
+        self.append_file(self.__path, 'A line longer than the burst size\n', 'Next\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # The long line uses up the whole burst, so the next line is dropped.
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'A line longer than the burst size\n')
+        self.assertEquals(1L, log_processor.generate_status().total_lines_dropped_by_rate_limit)
+
+    def test_dedup(self):
+        log_processor = self.log_processor
+        log_processor.set_dedup_window(60)
+
+        self.append_file(self.__path, 'Retrying\n', 'Retrying\n', 'Retrying\n', 'Done\n', 'Done\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'Retrying\n')
+        self.assertEquals(events.get_message(1), 'Done\n')
+
+        # The repeats are remembered in the checkpoint until their summaries are sent.
+        repeated_lines = log_processor.get_checkpoint()['repeated_lines']
+        self.assertEquals(sorted([(x['escaped_line'], x['repeat_count']) for x in repeated_lines]),
+                          [('Done\\n', 1), ('Retrying\\n', 2)])
+
+        # Once the window passes, the summaries are sent even though no new lines were written.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 61)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(sorted([(events.escaped_messages[i], events.events[i]['attrs']['repeat_count'])
+                                  for i in range(2)]), [('Done\\n', 1), ('Retrying\\n', 2)])
+        self.assertEquals(events.events[0]['attrs']['repeat_first_time'], self.__fake_time)
+        self.assertFalse('repeated_lines' in log_processor.get_checkpoint())
+
+    def test_dedup_interleaved(self):
+        log_processor = self.log_processor
+        log_processor.set_dedup_window(60)
+
+        self.append_file(self.__path, 'A\n', 'B\n', 'A\n', 'B\n', 'A\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'A\n')
+        self.assertEquals(events.get_message(1), 'B\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 61)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(sorted([(events.get_message(i), events.events[i]['attrs']['repeat_count'])
+                                  for i in range(2)]), [('A\n', 2), ('B\n', 1)])
+
+    def test_dedup_after_redaction(self):
+        log_processor = self.log_processor
+        log_processor.set_dedup_window(60)
+        log_processor.add_redacter('password=[^&]+', 'password=foo')
+
+        self.append_file(self.__path, 'GET /foo&password=first&x=1\n', 'GET /foo&password=second&x=1\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # The lines only differ in what was redacted, so the second is a repeat of the first.
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.get_message(0), 'GET /foo&password=foo&x=1\n')
+        self.assertEquals(log_processor.get_checkpoint()['repeated_lines'][0]['repeat_count'], 1)
+
+    def test_dedup_retry(self):
+        log_processor = self.log_processor
+        log_processor.set_dedup_window(60)
+
+        self.append_file(self.__path, 'Retrying\n', 'Retrying\n', 'Done\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertEquals(2, events.total_events())
+        self.assertFalse(completion_callback(LogFileProcessor.FAIL_AND_RETRY))
+        self.assertFalse('repeated_lines' in log_processor.get_checkpoint())
+
+        # The same events are generated again.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.get_message(0), 'Retrying\n')
+        self.assertEquals(events.get_message(1), 'Done\n')
+        self.assertEquals(log_processor.get_checkpoint()['repeated_lines'][0]['repeat_count'], 1)
+
+        # A failed attempt to send the summary is retried as well.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 61)
+        self.assertEquals(1, events.total_events())
+        self.assertFalse(completion_callback(LogFileProcessor.FAIL_AND_RETRY))
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 62)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.events[0]['attrs']['repeat_count'], 1)
+
+    def test_line_coalescing(self):
+        log_processor = self.log_processor
+        log_processor.set_line_coalescing(3)
+
+        self.append_file(self.__path, 'Line 1\n', 'Line 2\n', 'Line 3\n', 'Line 4\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.escaped_messages[0], 'Line 1\\nLine 2\\nLine 3\\n')
+        self.assertEquals(events.events[0]['attrs']['line_count'], 3)
+        self.assertEquals(events.get_message(1), 'Line 4\n')
+        self.assertFalse('line_count' in events.events[1]['attrs'])
+        self.assertEquals(4L, log_processor.generate_status().total_lines_copied)
+
+    def test_line_coalescing_buffer_full(self):
+        log_processor = self.log_processor
+        log_processor.set_line_coalescing(2)
+
+        self.append_file(self.__path, 'Line 1\n', 'Line 2\n', 'Line 3\n', 'Line 4\n', 'Line 5\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest(limit=1)
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertTrue(buffer_full)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(1, events.total_events())
+        self.assertEquals(events.events[0]['attrs']['line_count'], 2)
+        status = log_processor.generate_status()
+        self.assertEquals(2L, status.total_lines_copied)
+        self.assertEquals(0L, status.total_bytes_skipped)
+
+        # The rest of the lines are sent with the next request.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(buffer_full)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.escaped_messages[0], 'Line 3\\nLine 4\\n')
+        self.assertEquals(events.get_message(1), 'Line 5\n')
+        self.assertEquals(5L, log_processor.generate_status().total_lines_copied)
+
+    def test_adaptive_sampling(self):
+        log_processor = self.log_processor
+        log_processor.set_parameters(adaptive_sampling_threshold=10)
+
+        self.append_file(self.__path, 'First line\n', 'Second line\n')
+
+        # Over the threshold, the sampling rate is halved.
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(0.5, log_processor.generate_status().adaptive_sampling_rate)
+        for event in events.events:
+            self.assertEquals(0.5, event['attrs']['sample_rate'])
+
+        # It is not changed again until the next update interval.
+        self.append_file(self.__path, 'Third line\n', 'Fourth line\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 1)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(0.5, log_processor.generate_status().adaptive_sampling_rate)
+        status = log_processor.generate_status()
+        self.assertEquals(4L, status.total_lines_copied + status.total_lines_dropped_by_sampling)
+
+        # Once the backlog has cleared, the rate is gradually raised back to 1.0.
+        for i in range(5):
+            events = TestLogFileProcessor.TestAddEventsRequest()
+            (completion_callback, buffer_full) = log_processor.perform_processing(
+                events, current_time=self.__fake_time + 10 * (i + 1))
+            self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1.0, log_processor.generate_status().adaptive_sampling_rate)
+
+        self.append_file(self.__path, 'Fifth\n')
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                              current_time=self.__fake_time + 60)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        self.assertEquals(1, events.total_events())
+        self.assertFalse('sample_rate' in events.events[0]['attrs'])
+
+    def test_line_processing_pool(self):
+        log_processor = self.log_processor
+        log_processor.add_redacter('password=[^&]+', 'password=foo')
+        log_processor.add_sampler('DEBUG', 0.0)
+
+        lines = []
+        for i in range(100):
+            lines.append('GET /foo?id=%d&password=secret&x=\t\n' % i)
+            lines.append('DEBUG %d\n' % i)
+        self.append_file(self.__path, *lines)
+
+        pool = LineProcessingPool(2)
+        try:
+            log_processor.set_line_processing_pool(pool)
+            events = TestLogFileProcessor.TestAddEventsRequest(limit=200)
+            (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                                  current_time=self.__fake_time)
+            self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        finally:
+            pool.close()
+
+        self.assertEquals(100, events.total_events())
+        for i in range(100):
+            self.assertEquals(events.get_message(i), 'GET /foo?id=%d&password=foo&x=\t\n' % i)
+            self.assertEquals(events.escaped_messages[i], 'GET /foo?id=%d&password=foo&x=\\t\\n' % i)
+        status = log_processor.generate_status()
+        self.assertEquals(100L, status.total_redactions)
+        self.assertEquals(100L, status.total_lines_dropped_by_sampling)
+
+    def test_line_processing_pool_counts_used_lines(self):
+        # A second processor applies the same rules on this thread, so the counts can be compared.
+        local_processor = LogFileProcessor(self.__path, file_system=self.__file_system, log_attributes={})
+        (completion_callback, buffer_full) = local_processor.perform_processing(
+            TestLogFileProcessor.TestAddEventsRequest(), current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        for processor in [self.log_processor, local_processor]:
+            processor.add_redacter('password=[^&]+', 'password=foo')
+            processor.add_sampler('DEBUG', 1.0)
+
+        lines = []
+        for i in range(100):
+            lines.append('GET /foo?id=%d&password=secret&x=1\n' % i)
+            lines.append('DEBUG %d\n' % i)
+        self.append_file(self.__path, *lines)
+
+        pool = LineProcessingPool(2)
+        try:
+            self.log_processor.set_line_processing_pool(pool)
+            for processor in [self.log_processor, local_processor]:
+                # The request fills part way through the page, so the rest of it is read again next time.
+                for limit in [50, 200]:
+                    events = TestLogFileProcessor.TestAddEventsRequest(limit=limit)
+                    (completion_callback, buffer_full) = processor.perform_processing(events,
+                                                                                      current_time=self.__fake_time)
+                    self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        finally:
+            pool.close()
+
+        pool_sampler = self.log_processor._LogFileProcessor__sampler
+        local_sampler = local_processor._LogFileProcessor__sampler
+        self.assertEquals(pool_sampler.rule_matches, local_sampler.rule_matches)
+        self.assertEquals(pool_sampler.rule_passes, local_sampler.rule_passes)
+        pool_redacter = self.log_processor._LogFileProcessor__redacter
+        local_redacter = local_processor._LogFileProcessor__redacter
+        self.assertEquals(pool_redacter.rule_lines, local_redacter.rule_lines)
+        self.assertEquals(pool_redacter.rule_redactions, local_redacter.rule_redactions)
+
+    def test_line_processing_pool_timeout(self):
+        log_processor = self.log_processor
+        log_processor.add_redacter('password=[^&]+', 'password=foo')
+
+        lines = []
+        for i in range(100):
+            lines.append('GET /foo?id=%d&password=secret&x=1\n' % i)
+        self.append_file(self.__path, *lines)
+
+        original_timeout = LineProcessingPool.WORKER_TIMEOUT
+        LineProcessingPool.WORKER_TIMEOUT = 0
+        pool = LineProcessingPool(2)
+        try:
+            log_processor.set_line_processing_pool(pool)
+            events = TestLogFileProcessor.TestAddEventsRequest(limit=200)
+            (completion_callback, buffer_full) = log_processor.perform_processing(events,
+                                                                                  current_time=self.__fake_time)
+            self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+        finally:
+            LineProcessingPool.WORKER_TIMEOUT = original_timeout
+            pool.close()
+
+        # Whether or not the workers were restarted, the lines are still processed.
+        self.assertEquals(100, events.total_events())
+        for i in range(100):
+            self.assertEquals(events.get_message(i), 'GET /foo?id=%d&password=foo&x=1\n' % i)
+
+    def test_json_lines(self):
+        log_processor = self.log_processor
+        log_processor.set_json_line_parsing(attribute_names=['status', 'user'])
+
+        self.append_file(self.__path, '{"message": "GET \\"/\\"", "status": 200, "user": "steve"}\n',
+                         '{"message": "POST", "status": 500, "body": {"a": [1]}}\n', 'Not JSON\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        self.assertEquals(3, events.total_events())
+        self.assertEquals(events.get_message(0), 'GET "/"')
+        self.assertEquals(events.events[0]['attrs']['status'], 200)
+        self.assertEquals(events.events[0]['attrs']['user'], 'steve')
+
+        # Since the body field was not lifted, the whole line is kept as the message.
+        self.assertEquals(events.get_message(1), '{"message": "POST", "status": 500, "body": {"a": [1]}}\n')
+        self.assertEquals(events.events[1]['attrs']['status'], 500)
+
+        self.assertEquals(events.get_message(2), 'Not JSON\n')
+
+    def test_preescaped_events(self):
+        log_processor = self.log_processor
+        log_processor.add_redacter('password=[^&]+', 'password=foo')
+
+        self.append_file(self.__path, 'He said "hi"\tthere\n', 'GET /foo&password=FakePassword&x=1\n')
+
+        events = TestLogFileProcessor.TestAddEventsRequest()
+        (completion_callback, buffer_full) = log_processor.perform_processing(events, current_time=self.__fake_time)
+        self.assertFalse(completion_callback(LogFileProcessor.SUCCESS))
+
+        # The line that was changed by redaction is escaped again.
+        self.assertEquals(2, events.total_events())
+        self.assertEquals(events.escaped_messages, {0: 'He said \\"hi\\"\\tthere\\n',
+                                                    1: 'GET /foo&password=foo&x=1\\n'})
+        self.assertEquals(events.get_message(1), 'GET /foo&password=foo&x=1\n')
+
     def test_signals_deletion(self):
         log_processor = self.log_processor
 
@@ -804,6 +2372,8 @@ class TestLogFileProcessor(unittest.TestCase):
             self.__limit = limit
             self.__thread_limit = thread_limit
             self.threads = {}
+            # Maps the index of each event added using add_event_from_template to its escaped message.
+            self.escaped_messages = {}
 
         def add_event(self, event):
             if len(self.events) < self.__limit:
@@ -812,6 +2382,18 @@ class TestLogFileProcessor(unittest.TestCase):
             else:
                 return False
 
+        def add_event_from_template(self, template, escaped_message, current_time=None, extra_attrs=None):
+            # Parse the event back out of its serialized form so that the tests can look at its fields.
+            if extra_attrs is None:
+                middle = template.middle
+            else:
+                middle = '"' + extra_attrs + template.middle_after_message
+            event = json_lib.parse(template.prefix + escaped_message + middle + '1' + template.suffix)
+            if not self.add_event(event):
+                return False
+            self.escaped_messages[len(self.events) - 1] = escaped_message
+            return True
+
         def position(self):
             return [len(self.events), dict(self.threads)]
 
@@ -19,7 +19,7 @@ __author__ = 'czerwin@scalyr.com'
 
 import unittest
 
-from scalyr_agent.scalyr_client import AddEventsRequest, PostFixBuffer
+from scalyr_agent.scalyr_client import AddEventsRequest, EventTemplate, PostFixBuffer
 
 
 class AddEventsRequestTest(unittest.TestCase):
@@ -43,6 +43,34 @@ class AddEventsRequestTest(unittest.TestCase):
         self.assertEquals(request.total_events, 2)
         request.close()
 
+    def test_add_event_from_template(self):
+        request = AddEventsRequest(self.__body)
+        request.set_client_time(1)
+
+        template = EventTemplate({'thread': 'log_1', 'attrs': {'host': 'h1', 'zone': 'z1'}})
+        self.assertTrue(request.add_event_from_template(template, 'a\\"b', timestamp=1L))
+        self.assertTrue(request.add_event_from_template(template, 'c', timestamp=2L))
+
+        self.assertEquals(
+            request.get_payload(),
+            """{"token":"fakeToken", events: [{"attrs":{"host":"h1","message":"a\\"b","zone":"z1"},"thread":"log_1","""
+            """"ts":"1"},{"attrs":{"host":"h1","message":"c","zone":"z1"},"thread":"log_1","ts":"2"}]"""
+            """, threads: [], client_time: 1 }""")
+        request.close()
+
+    def test_add_event_from_template_with_extra_attrs(self):
+        request = AddEventsRequest(self.__body)
+        request.set_client_time(1)
+
+        template = EventTemplate({'thread': 'log_1', 'attrs': {'host': 'h1', 'zone': 'z1'}})
+        self.assertTrue(request.add_event_from_template(template, 'a', timestamp=1L, extra_attrs=',"status":200'))
+
+        self.assertEquals(
+            request.get_payload(),
+            """{"token":"fakeToken", events: [{"attrs":{"host":"h1","message":"a","status":200,"zone":"z1"},"""
+            """"thread":"log_1","ts":"1"}], threads: [], client_time: 1 }""")
+        request.close()
+
     def test_multiple_calls_to_get_payload(self):
         request = AddEventsRequest(self.__body)
         request.set_client_time(1)
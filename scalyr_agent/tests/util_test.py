@@ -15,6 +15,7 @@
 #
 # author: Steven Czerwinski <czerwin@scalyr.com>
 import struct
+import sys
 import threading
 
 __author__ = 'czerwin@scalyr.com'
@@ -69,6 +70,18 @@ class TestUtil(unittest.TestCase):
         self.assertEquals(scalyr_util.remove_newlines_and_truncate('ok\n\r there', 1000), 'ok   there')
         self.assertEquals(scalyr_util.remove_newlines_and_truncate('ok\n\r there', 6), 'ok   t')
 
+    def test_posix_fadvise(self):
+        if not sys.platform.startswith('linux'):
+            return
+        self.__create_file(self.__path, 'contents')
+        fp = open(self.__path)
+        try:
+            self.assertTrue(scalyr_util.posix_fadvise(fp.fileno(), 0, 0, scalyr_util.POSIX_FADV_SEQUENTIAL))
+            # An invalid advice value is reported as a failure rather than raising an exception.
+            self.assertFalse(scalyr_util.posix_fadvise(fp.fileno(), 0, 0, 1000))
+        finally:
+            fp.close()
+
 
 class TestRateLimiter(unittest.TestCase):
     def setUp(self):
@@ -94,6 +107,17 @@ class TestRateLimiter(unittest.TestCase):
         self.advance_time(1)
         self.assertTrue(self.charge_if_available(60))
 
+    def test_charge_later(self):
+        self.assertEquals(self.__test_rate.get_available(current_time=self.__current_time), 100)
+        # Looking at what is available does not charge for it.
+        self.assertEquals(self.__test_rate.get_available(current_time=self.__current_time), 100)
+
+        self.__test_rate.charge(70, current_time=self.__current_time)
+        self.assertEquals(self.__test_rate.get_available(current_time=self.__current_time), 30)
+        self.advance_time(1)
+        self.assertEquals(self.__test_rate.get_available(current_time=self.__current_time), 40)
+        self.assertFalse(self.charge_if_available(41))
+
 
 class TestRunState(unittest.TestCase):
 
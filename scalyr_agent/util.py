@@ -139,6 +139,78 @@ def format_time(time_value):
         return result
 
 
+# The advice values for posix_fadvise, as defined on Linux.
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+
+# The posix_fadvise function to invoke, or None if it has not been looked up yet.  False if it is not available.
+__fadvise_function__ = None
+
+
+def posix_fadvise(file_descriptor, offset, length, advice):
+    """Announces an intention to access the file's data in the specified pattern, allowing the kernel to perform
+    appropriate optimizations such as reading ahead.
+
+    This is a no-op if posix_fadvise is not available on this platform.  The advice is only a hint, so all errors
+    are ignored.
+
+    @param file_descriptor: The file descriptor for the file.
+    @param offset: The offset of the first byte the advice applies to.
+    @param length: The number of bytes the advice applies to.  If zero, it applies to the end of the file.
+    @param advice: The advice, such as POSIX_FADV_SEQUENTIAL.
+
+    @type file_descriptor: int
+    @type offset: int
+    @type length: int
+    @type advice: int
+
+    @return: True if the advice was given.
+    @rtype: bool
+    """
+    global __fadvise_function__
+    if __fadvise_function__ is None:
+        __fadvise_function__ = __find_fadvise_function()
+    if __fadvise_function__ is False:
+        return False
+
+    try:
+        __fadvise_function__(file_descriptor, offset, length, advice)
+        return True
+    except (OSError, IOError):
+        return False
+
+
+def __find_fadvise_function():
+    """
+    @return: A function with the same signature as posix_fadvise, or False if it is not available.  Like
+        os.posix_fadvise, the function raises an OSError if the advice could not be given.
+    """
+    if hasattr(os, 'posix_fadvise'):
+        return os.posix_fadvise
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import ctypes
+        import ctypes.util
+        library_name = ctypes.util.find_library('c')
+        if library_name is None:
+            return False
+        # posix_fadvise64 always takes 64 bit offsets, even on 32 bit platforms.
+        function = ctypes.CDLL(library_name).posix_fadvise64
+        function.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+        function.restype = ctypes.c_int
+
+        def fadvise(file_descriptor, offset, length, advice):
+            # Unlike most libc functions, posix_fadvise returns the error number rather than setting errno.
+            result = function(file_descriptor, offset, length, advice)
+            if result != 0:
+                raise OSError(result, os.strerror(result))
+
+        return fadvise
+    except (ImportError, OSError, AttributeError):
+        return False
+
+
 class JsonReadFileException(Exception):
     """Raised when a failure occurs when reading a file as a JSON object."""
     def __init__(self, file_path, message):
@@ -496,6 +568,44 @@ class RateLimiter(object):
 
         @return: True if there are enough room in the rate limit to allow the operation.
         """
+        self.__fill_bucket(current_time)
+
+        if num_bytes <= self.__bucket_contents:
+            self.__bucket_contents -= num_bytes
+            return True
+
+        return False
+
+    def get_available(self, current_time=None):
+        """Returns the number of bytes that could currently be consumed, without charging for any.
+
+        This can be used along with 'charge' when the operations may later be rolled back, so that the bytes are
+        only charged once they are known to have been consumed.
+
+        @param current_time: If not none, the value to use as the current time, expressed in seconds past epoch. This
+            is used in testing.
+
+        @return: The number of bytes available in the bucket.
+        @rtype: float
+        """
+        self.__fill_bucket(current_time)
+        return self.__bucket_contents
+
+    def charge(self, num_bytes, current_time=None):
+        """Deducts num_bytes from the bucket, even if that leaves it with a negative balance.
+
+        @param num_bytes: The number of bytes to consume from the rate limit.
+        @param current_time: If not none, the value to use as the current time, expressed in seconds past epoch. This
+            is used in testing.
+        """
+        self.__fill_bucket(current_time)
+        self.__bucket_contents -= num_bytes
+
+    def __fill_bucket(self, current_time):
+        """Adds the bytes that have leaked back into the bucket since it was last filled.
+
+        @param current_time: If not none, the value to use as the current time, expressed in seconds past epoch.
+        """
         if current_time is None:
             current_time = time.time()
 
@@ -504,12 +614,6 @@ class RateLimiter(object):
         self.__bucket_contents = min(self.__bucket_size, self.__bucket_contents + fill_amount)
         self.__last_bucket_fill_time = current_time
 
-        if num_bytes <= self.__bucket_contents:
-            self.__bucket_contents -= num_bytes
-            return True
-
-        return False
-
 
 class ScriptEscalator(object):
     """Utility that helps re-execute the current script using the user account that owns the